@@ -0,0 +1,73 @@
+"""utils.checksum 基准测试
+
+与旧的逐字 hexlify 实现对比, 输入取真实 login 包中参与 CRC 计算的部分.
+
+    python benchmarks/checksum.py
+"""
+
+import binascii
+import struct
+import sys
+from pathlib import Path
+from timeit import Timer
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from drcom.account import Account  # noqa: E402
+from drcom.packet import LoginTemplate  # noqa: E402
+from drcom.utils import checksum, checksums  # noqa: E402
+
+
+def legacyChecksum(bytes_: bytes) -> bytes:
+    """v3.1.3 中的实现"""
+    resualt = 1234
+    for i in [x*4 for x in range(0, -(-len(bytes_)//4))]:
+        resualt ^= int(
+            binascii.hexlify(bytes_[i:i+4].ljust(4, b'\x00')[::-1]), 16
+        )
+
+    resualt = (1968 * resualt) & 0xffffffff
+    return struct.pack('<I', resualt)
+
+
+def crcInput(ror: bool) -> bytes:
+    """得到一个 login 包中参与 CRC 计算的字节"""
+    account = Account(dict(
+        server="10.0.0.1", server_port=61440, username="2019123456",
+        password="password", mac=0x0a1b2c3d4e5f, host_ip="10.30.1.23",
+        host_name="F**K DRCOM", host_os="DRCOM F**KER", dhcp="0.0.0.0",
+        dns="8.8.8.8", keep_alive_interval=15,
+        CONTROL_CHECK_STATUS=b"\x20", ADAPTER_NUM=b"\x05",
+        IP_DOG=b"\x01", AUTH_VERSION=b"\x2f\x00", SALT=b"",
+        KEEP_ALIVE_VERSION=b"\xdc\x02", ROR_VERSION=ror,
+    ))
+    template = LoginTemplate(account)
+    packet = bytes(template.render(b"\x01\x02\x03\x04"))
+    i = template.crc_at
+    return packet[:i] + b'\x01\x26\x07\x11\x00\x00' + packet[i + 6:i + 12]
+
+
+def best(func, number: int) -> float:
+    """取 5 轮中最快的一轮, 返回单次调用的微秒数"""
+    return min(Timer(func).repeat(5, number)) / number * 1e6
+
+
+def main():
+    for ror in (False, True):
+        data = crcInput(ror)
+        assert checksum(data) == legacyChecksum(data)
+        old = best(lambda: legacyChecksum(data), 2000)
+        new = best(lambda: checksum(data), 2000)
+        print(f"checksum {len(data)} bytes: "
+              f"legacy {old:8.2f} us, new {new:8.2f} us, x{old / new:.1f}")
+
+    batch = [crcInput(False)] * 1000
+    assert checksums(batch) == [checksum(i) for i in batch]
+    old = best(lambda: [checksum(i) for i in batch], 5) / len(batch)
+    new = best(lambda: checksums(batch), 5) / len(batch)
+    print(f"checksums x{len(batch)}, per packet: "
+          f"checksum {old:8.2f} us, checksums {new:8.2f} us, x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""命令行启动耗时的基准测试
+
+    python benchmarks/startup.py                # 检查 drcom log 的启动预算
+    python benchmarks/startup.py --budget 30    # 指定预算, 单位为毫秒
+
+每个场景在子进程中运行 --repeat 次, 取最快的一次, 减去空解释器 (python -c pass)
+的耗时作为 drcom 自身的启动开销. 同时用 ``-X importtime`` 统计导入的模块,
+drcom log 不应导入 FORBIDDEN 中的任何模块.
+
+超出预算或导入了禁止的模块时以退出码 1 结束.
+"""
+
+import compileall
+import subprocess
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+HERE = Path(__file__).absolute().parent
+ROOT = HERE.parent
+
+# drcom log 只读取日志, 用不到这些模块
+FORBIDDEN = ("threading", "queue", "json", "uuid", "socket", "asyncio",
+             "http.server", "platform")
+
+CONFIG = """\
+[application]
+log_path = "{log_path}"
+[drcom]
+server = "10.0.0.1"
+username = "2019123456"
+password = "password"
+[core]
+"""
+
+
+def command(argv: list) -> str:
+    return f"import sys; sys.argv = {['drcom'] + argv!r}; from drcom import main; main()"
+
+
+def measure(code: str, repeat: int) -> tuple:
+    """运行 repeat 次, 返回 (最快的秒数, 导入的模块 -> 累计微秒)"""
+    best = float("inf")
+    modules = {}
+    for _ in range(repeat):
+        start = perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                              cwd=str(ROOT), stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, universal_newlines=True)
+        elapsed = perf_counter() - start
+        if elapsed < best:
+            best = elapsed
+            modules = parseImportTime(proc.stderr)
+    return best, modules
+
+
+def parseImportTime(stderr: str) -> dict:
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget", type=float, default=60.0,
+                        help="drcom log 启动开销的预算, 单位为毫秒")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    # 没有最新的字节码时, 测到的是编译时间
+    compileall.compile_dir(str(ROOT / "drcom"), quiet=1)
+
+    with TemporaryDirectory() as tmp:
+        config = Path(tmp) / "drcom.toml"
+        config.write_text(CONFIG.format(log_path=(Path(tmp) / "drcom.db").as_posix()),
+                          encoding="utf-8")
+        scenarios = {
+            "python -c pass": "pass",
+            "import drcom": "import drcom",
+            "drcom log": command(["log", "-c", str(config), "2000-01-01"]),
+        }
+        results = {name: measure(code, args.repeat) for name, code in scenarios.items()}
+
+    base = results["python -c pass"][0]
+    print(f"{'scenario':20}{'total ms':>10}{'drcom ms':>10}{'import drcom ms':>17}")
+    for name, (elapsed, modules) in results.items():
+        imported = modules.get("drcom", 0) / 1e3
+        print(f"{name:20}{elapsed * 1e3:10.1f}{(elapsed - base) * 1e3:10.1f}{imported:17.1f}")
+
+    ok = True
+    elapsed, modules = results["drcom log"]
+    overhead = (elapsed - base) * 1e3
+    if overhead > args.budget:
+        print(f"drcom log: {overhead:.1f} ms > budget {args.budget:.1f} ms")
+        ok = False
+    forbidden = sorted(i for i in FORBIDDEN if i in modules)
+    if forbidden:
+        print("drcom log imports " + ", ".join(forbidden))
+        ok = False
+    slowest = sorted(modules.items(), key=lambda i: i[1], reverse=True)[:5]
+    print("slowest imports: " + ", ".join(f"{k} {v / 1e3:.1f} ms" for k, v in slowest))
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""协议与日志热路径的微基准测试
+
+    python benchmarks/suite.py                  # 运行并与 baseline.json 对比
+    python benchmarks/suite.py -o result.json   # 另外保存本次结果
+    python benchmarks/suite.py --save           # 用本次结果覆盖 baseline.json
+
+结果以每次调用的微秒数记录. calibration 是一段与 drcom 无关的纯 Python 循环,
+对比时先按它的变化折算机器本身的快慢, 再把慢了 --threshold 倍以上的项目标记为
+REGRESSION, 并以退出码 1 结束.
+"""
+
+import json
+import sys
+from argparse import ArgumentParser
+from contextlib import ExitStack
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from timeit import Timer
+
+HERE = Path(__file__).absolute().parent
+sys.path.insert(0, str(HERE.parent))
+
+from drcom import toml  # noqa: E402
+from drcom.toml import fast  # noqa: E402
+from drcom.board import BoardReader, StatusBoard  # noqa: E402
+from drcom.config import DrcomConfig  # noqa: E402
+from drcom.log import LEVEL_INFO, LogWriter, Message  # noqa: E402
+from drcom.session import DrcomSession  # noqa: E402
+from drcom.utils import checksum, hexdump, md5sum  # noqa: E402
+
+BASELINE = HERE / "baseline.json"
+
+
+class SilentLogWriter(LogWriter):
+    """后台线程丢弃所有记录, 只测量 record 放入队列的开销, 也不向终端输出"""
+
+    def write(self, batch: list):
+        pass
+
+
+def makeConfig(tmp: Path) -> DrcomConfig:
+    conf = DrcomConfig()
+    conf["application"]["log_path"] = str(tmp / "drcom-suite.db")
+    conf["drcom"].update({
+        "server": "10.0.0.1",
+        "username": "2019123456",
+        "password": "password",
+        "mac": 0x0a1b2c3d4e5f,
+        "host_ip": "10.30.1.23",
+    })
+    conf["core"].update({
+        "CONTROL_CHECK_STATUS": b"\x20",
+        "ADAPTER_NUM": b"\x05",
+        "IP_DOG": b"\x01",
+        "AUTH_VERSION": b"\x2f\x00",
+        "KEEP_ALIVE_VERSION": b"\xdc\x02",
+    })
+    return conf
+
+
+def makeAccounts(document: str, n: int) -> str:
+    """在 document 后追加 n 个 [[accounts]] 表, 模拟多账号的大配置"""
+    accounts = "".join(
+        f'\n[[accounts]]\nusername = "2019{i:06d}"\npassword = "password"\n'
+        f'host_ip = "10.30.{i // 256}.{i % 256}"\nmac = 0x0a1b2c{i:06x}\n'
+        for i in range(n))
+    return document + accounts
+
+
+def cases(stack: ExitStack) -> dict:
+    """名称 -> (被测函数, 每轮调用次数)
+
+    用到的文件都在一个临时目录中, stack 关闭时关闭状态表与日志并删除该目录.
+    """
+    tmp = Path(stack.enter_context(TemporaryDirectory(prefix="drcom-suite-")))
+    conf = makeConfig(tmp)
+    logger = SilentLogWriter(level=LEVEL_INFO, database=conf["application"]["log_path"],
+                             queue_size=1 << 20)
+    stack.callback(logger.close)
+    session = DrcomSession(conf, logger)
+    session.context.SALT = b"\x01\x02\x03\x04"
+    session.makeLoginPacket()
+    packet = bytes(session.makeLoginPacket())
+    keepalive = bytes(session.makeKeepAlivePacket(3, False))
+    message = Message(1571000000.0, LEVEL_INFO, "keepAliveStable 02 recv", keepalive)
+    document = conf.dumps()
+    large = makeAccounts(document, 1000)
+    # 状态表: 每个会话每次收发写一次槽, 监控程序每次轮询读取全部槽
+    path = tmp / "board"
+    board = StatusBoard(path, 100)
+    stack.callback(board.close)
+    for i in range(100):
+        board.allocate(f"2019{i:06d}").write("stable", 3, 60000 + i, session.metrics)
+    slot = board.slots[0]
+    reader = BoardReader(path)
+    stack.callback(reader.close)
+
+    return {
+        "calibration": (lambda: sum(range(1000)), 2000),
+        "makeLoginPacket": (session.makeLoginPacket, 2000),
+        "makeKeepAlivePacket": (lambda: session.makeKeepAlivePacket(3, False), 20000),
+        "checksum": (lambda: checksum(packet), 5000),
+        "md5sum": (lambda: md5sum(packet), 20000),
+        "hexdump": (lambda: hexdump(0x0a1b2c3d4e5f), 20000),
+        "Message.terminal": (lambda: message.terminal(color=True, data=True), 5000),
+        "Message.to_csv": (message.to_csv, 5000),
+        "LogWriter.record": (lambda: logger.record("keepAliveStable 02 sent", keepalive, LEVEL_INFO), 20000),
+        "toml.loads": (lambda: toml.loads(document), 200),
+        "toml.fast.loads": (lambda: fast.loads(document), 2000),
+        "toml.loads[1000 accounts]": (lambda: toml.loads(large), 2),
+        "toml.fast.loads[1000 accounts]": (lambda: fast.loads(large), 20),
+        "Slot.write": (lambda: slot.write("stable", 3, 60000, session.metrics), 20000),
+        "BoardReader.read[100]": (reader.read, 200),
+    }
+
+
+def run(repeat: int = 5) -> dict:
+    """运行所有项目, 返回 名称 -> 每次调用的微秒数 (取最快的一轮)"""
+    result = {}
+    with ExitStack() as stack:
+        for name, (func, number) in cases(stack).items():
+            result[name] = min(Timer(func).repeat(repeat, number)) / number * 1e6
+    return result
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> bool:
+    """打印对比表格, 有退化时返回 False"""
+    ok = True
+    scale = 1.0
+    if "calibration" in baseline:
+        scale = result["calibration"] / baseline["calibration"]
+    print(f"machine speed vs baseline: x{1 / scale:.2f}")
+    print(f"{'name':24}{'us/call':>12}{'baseline':>12}{'ratio':>8}")
+    for name, value in result.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:24}{value:12.3f}{'-':>12}{'-':>8}")
+            continue
+        ratio = value / base / scale
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            ok = False
+        print(f"{name:24}{value:12.3f}{base:12.3f}{ratio:8.2f}{flag}")
+    return ok
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="保存本次结果的 JSON 文件")
+    parser.add_argument("--baseline", default=str(BASELINE), help="基线 JSON 文件")
+    parser.add_argument("--save", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="慢于基线多少倍视为退化")
+    args = parser.parse_args()
+
+    result = run()
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2) + "\n")
+    baseline = Path(args.baseline)
+    if args.save:
+        baseline.write_text(json.dumps(result, indent=2) + "\n")
+        print(f"baseline saved at {baseline}")
+        return
+    old = json.loads(baseline.read_text()) if baseline.exists() else {}
+    if not compare(result, old, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,63 @@
 from pathlib import Path
 
 from .config import DrcomConfig
+from .config import findConfig
 from .config import getParser
 
 
 def main():
     parser = getParser()
     args = parser.parse_args()
-    if args.subcmd == "start":
-        from .app import DrcomApp
-        for i in args.config:
-            if i.exists():
-                file = i
-                break
+    if args.subcmd == "start" and args.use_async:
+        from .aio import DrcomEngine
+        if isinstance(args.config, tuple):
+            files = [i for i in args.config if i.exists()]
         else:
+            files = [i for i in args.config if i.exists()][:1]
+        if not files:
             raise FileNotFoundError("找不到可用的配置文件")
+        engine = DrcomEngine(DrcomConfig().load(i) for i in files)
+        engine.run()
+    elif args.subcmd == "start":
         conf = DrcomConfig()
-        conf.load(file)
-        app = DrcomApp(conf)
-        app.run()
+        conf.load(findConfig(args.config))
+        if len(conf["accounts"]) > 1:
+            # 多个账号在同一个事件循环中运行
+            from .aio import DrcomEngine
+            DrcomEngine([conf]).run()
+        else:
+            from .app import DrcomApp
+            app = DrcomApp(conf)
+            app.run()
+    elif args.subcmd in ("stop", "status", "logout", "relogin"):
+        conf = DrcomConfig()
+        conf.load(findConfig(args.config))
+        if args.subcmd == "status" and not args.json:
+            # 优先读取共享内存状态表, 不必与 drcom 通信
+            from .board import formatBoard, openBoard
+            reader = openBoard(conf["application"])
+            if reader is not None:
+                print(formatBoard(reader.read()))
+                return
+        from .control import controlPath, formatStatus, request
+        path = controlPath(conf["application"])
+        if path is None:
+            raise ConnectionError("配置中没有开启控制套接字")
+        command = args.subcmd
+        if getattr(args, "USERNAME", None):
+            command += " " + args.USERNAME
+        reply = request(path, command)
+        if args.subcmd != "status":
+            print(f"{args.subcmd}: {', '.join(reply['sessions']) or 'no session'}")
+        elif args.json:
+            import json
+            print(json.dumps(reply["sessions"], indent=2))
+        else:
+            print(formatStatus(reply["sessions"]))
     elif args.subcmd == "log":
         from .log import LogReader
-        for i in args.config:
-            if i.exists():
-                file = i
-                break
-        else:
-            raise FileNotFoundError("找不到可用的配置文件")
         conf = DrcomConfig()
-        conf.load(file)
+        conf.load(findConfig(args.config))
         reader = LogReader(args.DATE,
                            args.level,
                            max_keep=conf["application"]["log_max_keep"],
@@ -36,19 +65,27 @@ def main():
         if args.to_csv:
             reader.to_csv(Path("today-log.csv"))
         else:
-            from io import StringIO
-            buffer = StringIO()
             for m in reader.iter():
-                buffer.write(m.terminal(color=args.color, data=args.show_data))
-                buffer.write("\n")
-            buffer.seek(0)
-            print(buffer.read())
+                print(m.terminal(color=args.color, data=args.show_data))
     elif args.subcmd == "analyse":
         from .analyse import analysePcapng
         path = Path(args.FILE)
         conf = analysePcapng(path)
         conf.dump(Path("drcom.toml"))
         print("file saved at ./drcom.toml")
+    elif args.subcmd == "stats":
+        import json
+        from .metrics import defaultStatsPath, formatStats
+        conf = DrcomConfig()
+        conf.load(findConfig(args.config))
+        path = Path(conf["application"]["stats_path"] or defaultStatsPath())
+        print(formatStats(json.loads(path.read_text(encoding="utf-8"))))
+    elif args.subcmd == "bench":
+        from .bench import report, runBench
+        print(report(runBench(args.clients, args.duration, args.interval)))
+    elif args.subcmd == "mock":
+        from .mock import runMock
+        runMock(args.host, args.port)
     elif args.subcmd == "clean":
         from .log import LogWriter
         logger = LogWriter()
@@ -0,0 +1,161 @@
+"""账号记录
+
+配置中的 [drcom] 与 [core] 描述一个默认账号. [[accounts]] 中的每一项只需写出
+与默认账号不同的字段 (通常是 username, password, mac 与 host_ip), 其余字段继承默认值::
+
+    [[accounts]]
+    username = "2019000001"
+    password = "password"
+    mac = 0x0a1b2c3d4e01
+
+:func:`compileAccounts` 一次校验所有账号, 把每个账号编译成不可变的 :class:`Account`,
+其中预先编码好了构包要用的字节. 会话运行时只做属性访问, 不再查字典或重新编码.
+"""
+
+from .exceptions import ConfigException
+
+# 可以在 [[accounts]] 中覆盖的字段
+DRCOM_FIELDS = ("server", "server_port", "username", "password", "mac", "host_ip",
+                "host_name", "host_os", "dhcp", "dns", "keep_alive_interval")
+CORE_FIELDS = ("CONTROL_CHECK_STATUS", "ADAPTER_NUM", "IP_DOG", "AUTH_VERSION",
+               "KEEP_ALIVE_VERSION", "SALT", "ROR_VERSION")
+# 修改后需要重新登录的字段, keep_alive_interval 可以直接生效
+LOGIN_FIELDS = tuple(i for i in DRCOM_FIELDS if i not in ("server", "keep_alive_interval")) \
+    + ("servers", ) + CORE_FIELDS
+
+
+def packIP(ip: str) -> bytes:
+    """将点分十进制的 IPv4 地址转换为 4 字节
+
+    >>> packIP("10.0.0.1")
+    b'\\n\\x00\\x00\\x01'
+    """
+    return bytes([int(i) for i in ip.split('.')])
+
+
+def fixedStr(s: str, length: int) -> bytes:
+    """编码字符串并用 0 填充或截断到 length 字节"""
+    return (s.encode() + b'\x00' * length)[:length]
+
+
+class Account:
+    """一个账号编译后的只读记录
+
+    :param dict fields: DRCOM_FIELDS 与 CORE_FIELDS 中的所有字段
+    :raises ConfigException: 字段的类型或取值不正确
+
+    除了原样保存的字段, 还有预先编码的
+
+    :attr servers: 认证服务器地址的元组
+    :attr username_bytes: 编码后的账号
+    :attr password_bytes: 编码后的密码
+    :attr account_bytes: 账号, 36 字节
+    :attr host_name_bytes: 主机名, 32 字节
+    :attr host_os_bytes: 操作系统名, 32 字节
+    :attr host_ip_bytes: 本机 IP 地址, 4 字节
+    :attr dhcp_bytes: dhcp 服务器地址, 4 字节
+    :attr dns_bytes: dns 服务器地址, 4 字节
+    :attr mac_bytes: 本机 MAC 地址, 6 字节
+    """
+
+    __slots__ = DRCOM_FIELDS + CORE_FIELDS + (
+        "servers", "username_bytes", "password_bytes", "account_bytes",
+        "host_name_bytes", "host_os_bytes", "host_ip_bytes", "dhcp_bytes",
+        "dns_bytes", "mac_bytes")
+
+    def __init__(self, fields: dict):
+        init = object.__setattr__
+        for key in ("username", "password", "host_name", "host_os"):
+            if not isinstance(fields[key], str):
+                raise ConfigException(f"{key} 应为字符串")
+        if not fields["username"]:
+            raise ConfigException("username 不能为空")
+        servers = fields["server"]
+        if isinstance(servers, str):
+            servers = [servers]
+        if not servers or not all(isinstance(i, str) and i for i in servers):
+            raise ConfigException("server 应为地址或地址的列表")
+        port = fields["server_port"]
+        if type(port) is not int or not 0 < port < 0x10000:
+            raise ConfigException("server_port 应为 1 到 65535 之间的整数")
+        mac = fields["mac"]
+        if type(mac) is not int or not 0 <= mac < 1 << 48:
+            raise ConfigException("mac 应为 48 位整数")
+        interval = fields["keep_alive_interval"]
+        if type(interval) not in (int, float) or interval <= 0:
+            raise ConfigException("keep_alive_interval 应为正数")
+        if type(fields["ROR_VERSION"]) is not bool:
+            raise ConfigException("ROR_VERSION 应为布尔值")
+        for key in DRCOM_FIELDS + CORE_FIELDS:
+            init(self, key, fields[key])
+        for key in CORE_FIELDS:
+            if key == "ROR_VERSION":
+                continue
+            try:
+                init(self, key, bytes(bytearray(fields[key])))
+            except (TypeError, ValueError):
+                raise ConfigException(f"{key} 应为 0 到 255 之间整数的数组") from None
+        for key in ("host_ip", "dhcp", "dns"):
+            try:
+                packed = packIP(fields[key])
+            except (AttributeError, ValueError):
+                packed = b""
+            if len(packed) != 4:
+                raise ConfigException(f"{key} 应为 IPv4 地址")
+            init(self, f"{key}_bytes", packed)
+
+        init(self, "servers", tuple(servers))
+        init(self, "username_bytes", self.username.encode())
+        init(self, "password_bytes", self.password.encode())
+        init(self, "account_bytes", fixedStr(self.username, 36))
+        init(self, "host_name_bytes", fixedStr(self.host_name, 32))
+        init(self, "host_os_bytes", fixedStr(self.host_os, 32))
+        init(self, "mac_bytes", mac.to_bytes(6, "big"))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Account 是只读的, 不能修改 {name}")
+
+    def changedFields(self, other: "Account") -> list:
+        """与 other 相比, LOGIN_FIELDS 中不同的字段"""
+        return [i for i in LOGIN_FIELDS if getattr(self, i) != getattr(other, i)]
+
+    def __repr__(self):
+        return f"<Account {self.username}>"
+
+
+def compileAccounts(drcom: dict, core: dict, accounts: list) -> list:
+    """校验并编译所有账号
+
+    :param dict drcom: [drcom], 缺少的字段从这里继承
+    :param dict core: [core], 缺少的字段从这里继承
+    :param list accounts: [[accounts]], 为空时 [drcom] 与 [core] 本身就是唯一的账号
+    :returns: Account 的列表
+    :raises ConfigException: 列出所有账号中的全部错误
+    """
+    if not isinstance(accounts, list) or not all(isinstance(i, dict) for i in accounts):
+        raise ConfigException("accounts 应为表的数组, 即 [[accounts]]")
+    errors = []
+    result = []
+    usernames = set()
+    for index, entry in enumerate(accounts or [{}]):
+        where = f"accounts[{index}]" if accounts else "[drcom]"
+        unknown = entry.keys() - set(DRCOM_FIELDS + CORE_FIELDS)
+        if unknown:
+            errors.append(f"{where}: 未知的字段 {', '.join(sorted(unknown))}")
+            continue
+        # 逐个取值, 这样 [drcom] 中需要探测的 mac 与 host_ip 只在没有覆盖时才探测
+        fields = {key: entry[key] if key in entry else drcom[key] for key in DRCOM_FIELDS}
+        fields.update((key, entry[key] if key in entry else core[key]) for key in CORE_FIELDS)
+        try:
+            account = Account(fields)
+        except ConfigException as e:
+            errors.append(f"{where}: {e}")
+            continue
+        if account.username in usernames:
+            errors.append(f"{where}: username {account.username} 重复")
+            continue
+        usernames.add(account.username)
+        result.append(account)
+    if errors:
+        raise ConfigException("\n".join(errors))
+    return result
@@ -0,0 +1,704 @@
+"""基于 asyncio 的多账号引擎
+
+每个账号一个 :class:`AsyncDrcomSession`, 各自占用一个 UDP 端点,
+所有会话共用一个事件循环, 状态机与 :class:`drcom.app.DrcomApp` 相同.
+"""
+
+import asyncio
+import os
+import signal
+from itertools import chain
+from time import monotonic
+
+from .account import Account
+from .board import StatusBoard, boardPath
+from .config import DrcomConfig
+from .control import CONTROL_TIMEOUT, controlPath, encodeReply, listen, parseCommand
+from .exceptions import *
+from .log import LogWriter
+from .exposition import MetricsServer
+from .metrics import StatsDumper
+from .reload import ConfigWatcher, applyConfig, loadAccounts
+from .scheduler import TimerWheel
+from .session import (KEEP_ALIVE2_STEPS, KEEP_ALIVE_STABLE_STEPS,
+                      MAX_RETRANSMIT, RECV_TIMEOUT, STATE_KEEPALIVE,
+                      STATE_LOGIN, STATE_RETRY, STATE_STABLE, DrcomSession)
+
+# 会话出错后重启的最长间隔, 单位为秒
+MAX_RESTART_DELAY = 300.0
+
+
+class DrcomDatagramProtocol(asyncio.DatagramProtocol):
+    """把收到的数据报放入队列, 由会话协程取出"""
+
+    def __init__(self):
+        self.transport = None
+        self.queue = asyncio.Queue()
+        self.closed = asyncio.Event()   # 套接字真正关闭后才能在同一端口上重新绑定
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.closed.set()
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait(data)
+
+    async def recv(self, timeout: float = RECV_TIMEOUT) -> bytes:
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class RaceDatagramProtocol(DrcomDatagramProtocol):
+    """challenge 竞速用的端点没有 connect, 队列中同时保存来源地址"""
+
+    def datagram_received(self, data, addr):
+        self.queue.put_nowait((data, addr))
+
+
+class AsyncDrcomSession(DrcomSession):
+    """异步 Drcom 会话
+
+    流程与 :class:`drcom.app.DrcomApp` 一致, 只是收发换成了协程,
+    等待用 ``asyncio.sleep`` 代替 ``time.sleep``.
+    """
+
+    def __init__(self, config: DrcomConfig, logger: LogWriter = None,
+                 wheel: TimerWheel = None, account: Account = None):
+        super().__init__(config, logger, account)
+        self.protocol = None
+        self.server = None  # 端点连接的地址, 见 connectServer
+        self.resumeState = self.loadState()
+        self.wheel = wheel  # 留空则使用 asyncio 自己的定时器
+
+    async def open(self, first_port: int = 60000) -> int:
+        """从 first_port 开始寻找可用的端口, 建立连接到认证服务器的 UDP 端点
+
+        :returns: 绑定的端口
+        """
+        loop = asyncio.get_running_loop()
+        address = await self.resolveServer()
+        ports = range(first_port, 0x10000)
+        if self.resumeState is not None:
+            # 服务端按来源端口识别会话, 优先使用上一个进程的端口
+            ports = chain((self.resumeState["port"], ), ports)
+        for i in ports:
+            try:
+                _, self.protocol = await loop.create_datagram_endpoint(
+                    DrcomDatagramProtocol,
+                    local_addr=(self.application["bind_ip"], i),
+                    remote_addr=address)
+                self.port = i
+                self.server = address
+                return i
+            except OSError:
+                # errno 98 address already in use
+                continue
+        raise BindPortException(f"从 {first_port} 到 65536 间端口已耗尽")
+
+    async def resolveServer(self, resolver=None) -> tuple:
+        """解析认证服务器的地址, 缓存过期时在线程池中调用 getaddrinfo
+
+        :param ServerResolver resolver: 留空则为当前的服务器
+        """
+        if resolver is None:
+            resolver = self.resolver
+        if resolver.fresh():
+            return resolver.get()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, resolver.get)
+
+    async def connectServer(self):
+        """地址变化时在同一个端口上重建连接到新地址的端点"""
+        address = await self.resolveServer()
+        if address != self.server:
+            await self.reopen(DrcomDatagramProtocol, address)
+
+    async def reopen(self, protocol_factory, remote_addr: tuple = None):
+        """关闭当前端点, 在同一个端口上建立新的端点
+
+        :param tuple remote_addr: 连接的地址, 留空则不 connect
+        """
+        protocol = self.protocol
+        self.close()
+        if protocol is not None:
+            await protocol.closed.wait()
+        _, self.protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+            protocol_factory,
+            local_addr=(self.application["bind_ip"], self.port),
+            remote_addr=remote_addr)
+        self.server = remote_addr
+
+    def close(self):
+        if self.protocol is not None:
+            self.protocol.transport.close()
+            self.protocol = None
+
+    async def exchange(self, packet: bytes, phase: str) -> bytes:
+        """发送一个包, 等待回应, 并记录该阶段的 RTT
+
+        重传与冗余请求的规则同 :meth:`drcom.app.DrcomApp.exchange`.
+
+        :raises asyncio.TimeoutError: 重传后仍然没有回应
+        """
+        for attempt in range(MAX_RETRANSMIT + 1):
+            start = monotonic()
+            deadline = start + self.rtt.rto
+            hedge_at = start + self.rtt.hedgeDelay() if phase == "challenge" else deadline
+            hedged = False
+            self.send(packet)
+            try:
+                if hedge_at < deadline:
+                    try:
+                        data = await self.recvUntil(packet, phase, hedge_at)
+                    except asyncio.TimeoutError:
+                        self.metrics.count("hedge")
+                        self.logger.debug(f"{phase} hedged", packet)
+                        self.send(packet)
+                        hedged = True
+                        data = await self.recvUntil(packet, phase, deadline)
+                else:
+                    data = await self.recvUntil(packet, phase, deadline)
+            except asyncio.TimeoutError:
+                self.rtt.backoff()
+                self.metrics.count("retransmit")
+                self.logger.debug(f"{phase} retransmit", packet)
+                continue
+            rtt = monotonic() - start
+            if attempt == 0 and not hedged:
+                # 重传或冗余过的请求无法确定回应对应哪一次发送, 不计入估计
+                self.rtt.observe(rtt)
+            self.metrics.observe(phase, rtt)
+            return data
+        raise asyncio.TimeoutError(f"{phase} timed out after {MAX_RETRANSMIT} retransmissions")
+
+    def send(self, packet: bytes):
+        self.protocol.transport.sendto(packet)
+
+    async def recvUntil(self, packet: bytes, phase: str, deadline: float) -> bytes:
+        """在 monotonic 时间 deadline 之前接收 packet 的回应, 丢弃不匹配的数据报"""
+        while True:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+            data = await self.protocol.recv(timeout)
+            if self.matchReply(packet, data):
+                return data
+            self.logger.debug(f"{phase} drop stale", data)
+
+    async def run(self):
+        """开始运行, 直到被取消"""
+        resumed = await self.resume()
+        while True:
+            try:
+                if resumed:
+                    resumed = False
+                    await self.keepAlive(resumed=True)
+                else:
+                    await self.login()
+                    await self.emptySocketBuffer()
+                    await self.keepAlive()
+            except asyncio.TimeoutError:
+                self.metrics.count("timeout")
+                if self.failover():
+                    continue
+                self.state = STATE_RETRY
+                await asyncio.sleep(self.application["timeout_retry"])
+                self.logger.warn(r"restart caused by timeout", b"")
+                continue
+            except KeepAliveException as e:
+                self.metrics.count("KeepAliveException")
+                self.logger.warn(r"restart caused by keepAliveException", e.args[0])
+                continue
+
+    async def resume(self) -> bool:
+        """用状态文件恢复上一个进程的会话, 见 :meth:`drcom.app.DrcomApp.resume`"""
+        if self.resumeState is None or self.port != self.resumeState["port"]:
+            return False
+        self.resumeState = None
+        self.logger.info("resume keepAliveStable", bytes([self.srv_num]))
+        try:
+            await self.connectServer()
+            await self.keepAliveStable()
+        except (asyncio.TimeoutError, KeepAliveException):
+            self.logger.warn("resume failed, login again", b"")
+            self.clearState()
+            return False
+        self.keepAliveOK()
+        self.saveState()
+        return True
+
+    async def login(self):
+        while True:
+            self.state = STATE_LOGIN
+            try:
+                await self.connectServer()
+                await self.challenge()
+                await self.sendLogin()
+            except ChallengeException:
+                self.metrics.count("ChallengeException")
+                self.state = STATE_RETRY
+                await asyncio.sleep(self.application["challenge_retry"])
+                continue
+            except LoginException:
+                self.metrics.count("LoginException")
+                # 要么是账号资费问题
+                # 要么是非登录时间
+                self.state = STATE_RETRY
+                await asyncio.sleep(self.application["login_retry"])
+                try:
+                    await self.logout()
+                except (ChallengeException, asyncio.TimeoutError):
+                    # 注销失败不影响重新登录
+                    self.metrics.count("ChallengeException")
+                continue
+            break
+
+    async def challenge(self):
+        if len(self.servers) > 1:
+            await self.raceChallenge()
+            return
+        packet = self.makeChallengePacket()
+        self.logger.info("challenge sent", packet)
+        self.recvChallenge(await self.exchange(packet, "challenge"))
+
+    async def raceChallenge(self):
+        """同时向所有认证服务器发送 challenge, 见 :meth:`drcom.app.DrcomApp.raceChallenge`"""
+        addresses = {}
+        for i, resolver in enumerate(self.resolvers):
+            try:
+                addresses[await self.resolveServer(resolver)] = i
+            except OSError as e:
+                self.logger.warn(f"resolve {self.servers[i]} failed: {e}", b"")
+        if not addresses:
+            raise asyncio.TimeoutError()
+        await self.reopen(RaceDatagramProtocol)
+        packet = self.makeChallengePacket()
+        self.logger.info("challenge race sent", packet)
+        for attempt in range(MAX_RETRANSMIT + 1):
+            start = monotonic()
+            deadline = start + min(self.rtts[i].rto for i in addresses.values())
+            for address in addresses:
+                self.protocol.transport.sendto(packet, address)
+            try:
+                data, winner = await self.recvRace(addresses, deadline)
+            except asyncio.TimeoutError:
+                for i in addresses.values():
+                    self.rtts[i].backoff()
+                self.metrics.count("retransmit")
+                self.logger.debug("challenge race retransmit", packet)
+                continue
+            rtt = monotonic() - start
+            if attempt == 0:
+                self.rtts[winner].observe(rtt)
+            self.metrics.observe("challenge", rtt)
+            self.selectServer(winner)
+            self.logger.info(f"challenge race won by {self.context.server}", b"")
+            await self.connectServer()
+            self.recvChallenge(data)
+            return
+        raise asyncio.TimeoutError()
+
+    async def recvRace(self, addresses: dict, deadline: float) -> tuple:
+        """接收竞速中的 challenge 回应, 返回 (数据, 服务器序号)"""
+        while True:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                raise asyncio.TimeoutError()
+            data, address = await self.protocol.recv(timeout)
+            winner = self.raceWinner(addresses, address, data)
+            if winner is not None:
+                return data, winner
+            self.logger.debug("challenge race drop", data)
+
+    async def sendLogin(self):
+        packet = self.makeLoginPacket()
+        self.logger.info("login sent", packet)
+        self.recvLogin(await self.exchange(packet, "login"))
+
+    async def emptySocketBuffer(self):
+        """丢弃队列中已经到达的数据报, 不等待"""
+        queue = self.protocol.queue
+        while not queue.empty():
+            self.logger.debug("drop stale", queue.get_nowait())
+
+    async def keepAlive(self, resumed: bool = False):
+        if resumed:
+            deadline = self.nextKeepAliveDeadline()
+        else:
+            self.resetKeepAlive()
+            self.state = STATE_KEEPALIVE
+            while True:
+                try:
+                    await self.keepAlive1()
+                except KeepAliveException:
+                    self.metrics.count("KeepAliveException")
+                    continue
+                except asyncio.TimeoutError:
+                    self.metrics.count("timeout")
+                    continue
+                await self.keepAlive2()
+                self.keepAliveOK()
+                self.saveState()
+                deadline = self.nextKeepAliveDeadline()
+                break
+        self.state = STATE_STABLE
+        while True:
+            await self.sleepUntil(deadline)
+            await self.keepAliveStable()
+            self.keepAliveOK()
+            self.saveState()
+            deadline = self.nextKeepAliveDeadline(deadline)
+
+    async def sleepUntil(self, deadline: float):
+        """睡眠到 monotonic 时间 deadline, 记录醒来时晚了多少"""
+        if self.wheel is None:
+            await asyncio.sleep(max(0.0, deadline - monotonic()))
+            self.drift.record(monotonic() - deadline)
+            return
+        future = asyncio.get_running_loop().create_future()
+
+        def wake(late):
+            if not future.done():
+                future.set_result(late)
+
+        timer = self.wheel.schedule(deadline, wake)
+        try:
+            self.drift.record(await future)
+        finally:
+            timer.cancel()
+
+    async def keepAlive1(self):
+        packet = self.makeKeepAlive1Packet()
+        self.logger.info("keepAlive1 sent", packet)
+        self.recvKeepAlive1(await self.exchange(packet, "keepAlive1"))
+
+    async def keepAlive2(self):
+        for step, (type_, first) in enumerate(KEEP_ALIVE2_STEPS, 1):
+            packet = self.makeKeepAlivePacket(type_, first)
+            self.logger.info(f"keepAlive2 0{step} sent", packet)
+            self.recvKeepAlive2(step, await self.exchange(packet, "keepAlive2"))
+
+    async def keepAliveStable(self):
+        for step, (type_, first) in enumerate(KEEP_ALIVE_STABLE_STEPS, 1):
+            packet = self.makeKeepAlivePacket(type_, first)
+            self.logger.info(f"keepAliveStable 0{step} sent", packet)
+            self.recvKeepAliveStable(step, await self.exchange(packet, "keepAliveStable"))
+
+    async def logout(self):
+        await self.challenge()
+        if self.context.SALT:
+            packet = self.makeLogoutPacket()
+            self.send(packet)
+            data = await self.recvUntil(packet, "logout", monotonic() + RECV_TIMEOUT)
+            if data[:1] == b'\x04':
+                self.clearState()
+                return True
+        return False
+
+
+class DrcomEngine:
+    """在一个事件循环中运行多个 Drcom 会话
+
+    :param configs: DrcomConfig 的序列, 其中的每个账号 (见 :meth:`DrcomConfig.accounts`) 一个会话
+    :param LogWriter logger: 所有会话共用的日志记录器, 留空则按第一份配置新建
+    :param TimerWheel wheel: 所有会话共用的时间轮
+    :param session_class: 会话的类型, 默认为 :class:`AsyncDrcomSession`
+
+    keepalive 的定时由一个时间轮统一调度, 事件循环中只有一个周期性的定时器.
+    从文件加载的配置被修改时重新加载 (见 :mod:`drcom.reload`), 只重启有变化的会话.
+    """
+
+    def __init__(self, configs, logger: LogWriter = None,
+                 wheel: TimerWheel = None, session_class=AsyncDrcomSession):
+        configs = list(configs)
+        if not configs:
+            raise ValueError("至少需要一份配置")
+        if logger is None:
+            application = configs[0]["application"]
+            logger = LogWriter(level=application["logging"],
+                               database=application["log_path"],
+                               max_keep=application["log_max_keep"])
+        self.logger = logger
+        self.wheel = TimerWheel() if wheel is None else wheel
+        self.configs = configs
+        self.session_class = session_class
+        # 先编译所有配置中的账号, 有错误时在绑定任何端口之前报告
+        accounts = [c.accounts() for c in configs]
+        # 每份配置一组会话, 账号名 -> 会话
+        self.groups = [{a.username: session_class(c, logger, self.wheel, a) for a in group}
+                       for c, group in zip(configs, accounts)]
+        self.tasks = {}     # 会话 -> 运行它的任务
+        self.finished = None    # serve 的结束信号, 任务出错时设置异常, 见 serve
+        self.lock = None    # reload 与控制命令不能同时增减会话
+        self.board = None   # 共享内存状态表, 见 drcom.board
+
+    @property
+    def sessions(self) -> list:
+        # 统计与 HTTP 线程也会读取, 先复制, reload 同时增减会话时不会出错
+        return [i for group in list(self.groups) for i in list(group.values())]
+
+    async def tick(self):
+        """每隔 wheel.tick 秒推进一次时间轮"""
+        while True:
+            self.wheel.advance()
+            await asyncio.sleep(self.wheel.tick)
+
+    def snapshot(self) -> dict:
+        """会话名 -> 指标快照"""
+        return {i.context.username: i.snapshot() for i in self.sessions}
+
+    async def serve(self):
+        """为每个会话绑定端口并运行, 直到被取消或收到 stop 命令 (见 :mod:`drcom.control`)"""
+        port = 60000
+        for session in self.sessions:
+            port = await session.open(port) + 1
+        ticker = asyncio.ensure_future(self.tick())
+        application = self.sessions[0].application
+        dumper = StatsDumper(application["stats_path"], self.snapshot).start()
+        server = None
+        if application["metrics_port"]:
+            server = MetricsServer(application["metrics_host"],
+                                   application["metrics_port"], self.snapshot).start()
+        loop = asyncio.get_running_loop()
+        self.finished = loop.create_future()
+        self.lock = asyncio.Lock()
+        path = boardPath(application)
+        if path is not None:
+            try:
+                self.board = StatusBoard(path, len(self.sessions))
+            except OSError as e:
+                self.logger.warn(f"status board disabled: {e}", b"")
+        for session in self.sessions:
+            self.spawn(session)
+        watchers = [(i, ConfigWatcher(c.path)) for i, c in enumerate(self.configs)
+                    if c.path is not None and c["application"]["reload"]]
+        watching = [self.track(asyncio.ensure_future(self.watch(i, w))) for i, w in watchers]
+        control = None
+        path = controlPath(application)
+        if path is not None:
+            try:
+                control = await asyncio.start_unix_server(self.handleControl, sock=listen(path))
+            except OSError as e:
+                self.logger.warn(f"control socket disabled: {e}", b"")
+        try:
+            loop.add_signal_handler(signal.SIGTERM, self.terminate)
+        except (NotImplementedError, RuntimeError):
+            # Windows 或不在主线程中
+            pass
+        try:
+            await self.finished
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGTERM)
+            except (NotImplementedError, RuntimeError):
+                pass
+            if control is not None:
+                control.close()
+                await control.wait_closed()
+                try:
+                    os.remove(str(path))
+                except OSError:
+                    pass
+            if server is not None:
+                server.stop()
+            dumper.stop()
+            ticker.cancel()
+            for task in watching + list(self.tasks.values()):
+                task.cancel()
+            if watching:
+                # 监视任务移除读回调之后才能关闭 inotify
+                await asyncio.wait(watching)
+            for _, watcher in watchers:
+                watcher.close()
+            for session in self.sessions:
+                session.close()
+            if self.board is not None:
+                self.board.close()
+                self.board = None
+
+    def track(self, task: asyncio.Task) -> asyncio.Task:
+        """task 出错时结束 serve, 会话的错误已由 supervise 处理, 不会到达这里"""
+        task.add_done_callback(self.done)
+        return task
+
+    def done(self, task: asyncio.Task):
+        if task.cancelled() or self.finished.done():
+            return
+        if task.exception() is not None:
+            self.finished.set_exception(task.exception())
+
+    def finish(self):
+        """让 serve 正常返回"""
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+    def spawn(self, session: AsyncDrcomSession):
+        """运行已经绑定端口的会话"""
+        if self.board is not None:
+            session.slot = self.board.allocate(session.account.username)
+            session.publish()
+        self.tasks[session] = self.track(asyncio.ensure_future(self.supervise(session)))
+
+    async def supervise(self, session: AsyncDrcomSession):
+        """运行会话, 出错时记录并只重启这一个会话
+
+        重启间隔从 timeout_retry 开始, 连续出错时加倍, 最长 MAX_RESTART_DELAY 秒.
+        """
+        delay = None
+        while True:
+            started = monotonic()
+            try:
+                if session.protocol is None:
+                    # 出错时可能正在重建端点
+                    await session.open(session.port)
+                await session.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if delay is None or monotonic() - started > MAX_RESTART_DELAY:
+                    delay = session.application["timeout_retry"]
+                else:
+                    delay = min(delay * 2, MAX_RESTART_DELAY)
+                session.state = STATE_RETRY
+                session.logger.error(f"session failed: {e!r}, restart in {delay:g} s", b"")
+                await asyncio.sleep(delay)
+
+    async def stop(self, session: AsyncDrcomSession):
+        """停止会话, 已登录时先注销, 最后关闭端点并删除状态文件
+
+        注销失败不影响停止, 服务端会因为没有 keepalive 而清理旧会话.
+        """
+        task = self.tasks.pop(session)
+        task.cancel()
+        await asyncio.wait([task])
+        if session.protocol is not None and session.state in (STATE_KEEPALIVE, STATE_STABLE):
+            try:
+                await asyncio.wait_for(session.logout(), RECV_TIMEOUT)
+            except (asyncio.TimeoutError, ChallengeException, OSError) as e:
+                self.logger.warn(f"logout {session.context.username} failed: {e!r}", b"")
+        session.clearState()
+        if session.slot is not None:
+            self.board.release(session.slot)
+            session.slot = None
+        protocol = session.protocol
+        session.close()
+        if protocol is not None:
+            await protocol.closed.wait()
+
+    async def watch(self, index: int, watcher: ConfigWatcher):
+        """配置文件每次被修改后调用 reload"""
+        while True:
+            await watcher.wait()
+            self.logger.info(f"{watcher.path} changed, reload", b"")
+            async with self.lock:
+                await self.reload(index)
+
+    async def restart(self, index: int, session: AsyncDrcomSession,
+                      account: Account) -> AsyncDrcomSession:
+        """停止 session, 在它原来的端口上用 account 开始新的会话"""
+        port = session.port
+        await self.stop(session)
+        session = self.session_class(self.configs[index], self.logger, self.wheel, account)
+        await session.open(port)
+        self.spawn(session)
+        return session
+
+    async def reload(self, index: int):
+        """重新读取第 index 份配置并与运行中的会话比较
+
+        -   application 原地更新, 立即生效
+        -   删除的账号注销后停止
+        -   新增的账号绑定端口后开始运行
+        -   账号或 core 参数变化的会话注销后, 在原来的端口上用新的账号重新登录
+        -   其余会话只替换账号记录, 不产生网络流量
+
+        文件有错误时保留原来的配置.
+        """
+        config = self.configs[index]
+        loaded = loadAccounts(config.path, self.logger)
+        if loaded is None:
+            return
+        new, accounts = loaded
+        applyConfig(config, new, self.logger)
+        if index == 0:
+            self.logger.level = config["application"]["logging"]
+        group = self.groups[index]
+        usernames = {i.username for i in accounts}
+        for username in [i for i in group if i not in usernames]:
+            self.logger.info(f"account {username} removed", b"")
+            await self.stop(group.pop(username))
+        sessions = {}
+        for account in accounts:
+            session = group.get(account.username)
+            if session is None:
+                self.logger.info(f"account {account.username} added", b"")
+                session = self.session_class(config, self.logger, self.wheel, account)
+                await session.open()
+                self.spawn(session)
+            elif session.applyAccount(account):
+                session = await self.restart(index, session, account)
+            sessions[account.username] = session
+        self.groups[index] = sessions
+
+    async def control(self, command: str, username: str = None) -> dict:
+        """执行控制命令, 见 :mod:`drcom.control`
+
+        :param str username: 留空则为所有会话
+        :raises ValueError: 没有这个账号
+        """
+        if command == "status":
+            return {"ok": True, "sessions": self.snapshot()}
+        async with self.lock:
+            targets = [(i, session) for i, group in enumerate(self.groups)
+                       for session in group.values()
+                       if username in (None, session.account.username)]
+            if username is not None and not targets:
+                raise ValueError(f"没有账号 {username}")
+            if command == "relogin":
+                for index, session in targets:
+                    self.groups[index][session.account.username] = \
+                        await self.restart(index, session, session.account)
+            else:
+                # stop 与 logout
+                await asyncio.gather(*(self.stop(session) for _, session in targets))
+                for index, session in targets:
+                    del self.groups[index][session.account.username]
+        return {"ok": True, "sessions": [session.account.username for _, session in targets]}
+
+    async def handleControl(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个控制连接"""
+        try:
+            line = await asyncio.wait_for(reader.readline(), CONTROL_TIMEOUT)
+            command, username = parseCommand(line)
+            if command != "status":
+                self.logger.info(f"{command} requested", b"")
+            reply = await self.control(command, username)
+        except ValueError as e:
+            command, reply = None, {"ok": False, "error": str(e)}
+        except (asyncio.TimeoutError, OSError):
+            writer.close()
+            return
+        try:
+            writer.write(encodeReply(reply))
+            await writer.drain()
+        except OSError:
+            pass
+        writer.close()
+        # 回应发出之后再结束, 没有会话时也不必继续运行
+        if command == "stop" or command == "logout" and not self.tasks:
+            self.finish()
+
+    def terminate(self):
+        """SIGTERM 等同于 stop 命令"""
+        self.logger.info("SIGTERM received, stop", b"")
+
+        async def stop():
+            await self.control("stop")
+            self.finish()
+
+        self.track(asyncio.ensure_future(stop()))
+
+    def run(self):
+        """开始运行"""
+        asyncio.run(self.serve())
@@ -1,27 +1,180 @@
+"""解析抓包, 生成配置
+
+抓包文件通过 mmap 映射, 逐个 block 遍历, 内存占用只与单个包的大小有关.
+支持 pcapng 与传统的 pcap 格式.
+"""
+
+import mmap
 import re
-from binascii import hexlify
+import struct
 from pathlib import Path
 
 from .config import DrcomConfig
 
+DRCOM_PORT = 61440
+
+PCAPNG_SHB = 0x0A0D0D0A     # Section Header Block
+PCAPNG_IDB = 0x00000001     # Interface Description Block
+PCAPNG_OPB = 0x00000002     # Packet Block (已废弃)
+PCAPNG_SPB = 0x00000003     # Simple Packet Block
+PCAPNG_EPB = 0x00000006     # Enhanced Packet Block
+PCAPNG_BOM = 0x1A2B3C4D
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+
+# 0x28 是 "(", 需要转义
+KEEP_ALIVE_VERSION_RE = re.compile(rb"\x07.\x28\x00\x0b\x01(..)", re.S)
+
+
+def iterPcapng(buf) -> iter:
+    """逐个产生 pcapng 中的 (linktype, frame)
+
+    :param buf: 整个文件的只读缓冲区, 一般是 mmap
+    """
+    offset = 0
+    end = len(buf)
+    order = "<"
+    linktypes = []
+    while offset + 12 <= end:
+        btype, = struct.unpack_from(order + "I", buf, offset)
+        if btype == PCAPNG_SHB:
+            # 每个 section 都可能改变字节序, 并重新编号接口
+            bom, = struct.unpack_from("<I", buf, offset + 8)
+            order = "<" if bom == PCAPNG_BOM else ">"
+            linktypes = []
+        length, = struct.unpack_from(order + "I", buf, offset + 4)
+        if length < 12 or offset + length > end:
+            # 文件被截断
+            break
+        body = offset + 8
+        # 长度不足以容纳各自固定字段的 block 视为损坏, 跳过
+        if btype == PCAPNG_IDB:
+            linktype, = struct.unpack_from(order + "H", buf, body)
+            linktypes.append(linktype)
+        elif btype == PCAPNG_EPB and length >= 32:
+            iface, _, _, caplen = struct.unpack_from(order + "4I", buf, body)
+            if iface < len(linktypes):
+                caplen = min(caplen, length - 32)
+                yield linktypes[iface], buf[body + 20:body + 20 + caplen]
+        elif btype == PCAPNG_SPB and length >= 16:
+            if linktypes:
+                caplen = min(struct.unpack_from(order + "I", buf, body)[0],
+                             length - 16)
+                yield linktypes[0], buf[body + 4:body + 4 + caplen]
+        elif btype == PCAPNG_OPB and length >= 32:
+            iface, _, _, caplen = struct.unpack_from(order + "HHQI", buf, body)
+            if iface < len(linktypes):
+                caplen = min(caplen, length - 32)
+                yield linktypes[iface], buf[body + 20:body + 20 + caplen]
+        offset += length
+
+
+def iterPcap(buf) -> iter:
+    """逐个产生传统 pcap 中的 (linktype, frame)"""
+    if len(buf) < 24:
+        raise ValueError("不是 pcap 或 pcapng 文件")
+    magic = buf[:4]
+    if magic in (b"\xd4\xc3\xb2\xa1", b"\x4d\x3c\xb2\xa1"):
+        order = "<"
+    else:
+        order = ">"
+    linktype, = struct.unpack_from(order + "I", buf, 20)
+    linktype &= 0xffff
+    offset = 24
+    end = len(buf)
+    while offset + 16 <= end:
+        caplen, = struct.unpack_from(order + "I", buf, offset + 8)
+        offset += 16
+        yield linktype, buf[offset:offset + caplen]
+        offset += caplen
+
+
+def ipv4Payload(linktype: int, frame: bytes) -> bytes:
+    """去掉链路层首部, 返回 IPv4 包; 不是 IPv4 时返回 None"""
+    if linktype == LINKTYPE_ETHERNET:
+        i = 12
+        ethertype = frame[i:i + 2]
+        while ethertype in (b"\x81\x00", b"\x88\xa8"):
+            # VLAN tag
+            i += 4
+            ethertype = frame[i:i + 2]
+        return frame[i + 2:] if ethertype == b"\x08\x00" else None
+    if linktype in (LINKTYPE_RAW, LINKTYPE_IPV4):
+        return frame
+    if linktype == LINKTYPE_LINUX_SLL:
+        return frame[16:] if frame[14:16] == b"\x08\x00" else None
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return frame[20:] if frame[0:2] == b"\x08\x00" else None
+    if linktype == LINKTYPE_NULL:
+        family = frame[:4]
+        return frame[4:] if family in (b"\x02\x00\x00\x00", b"\x00\x00\x00\x02") else None
+    return None
+
+
+def iterDrcomPayloads(file: Path) -> iter:
+    """逐个产生发往 UDP/61440 的 (目的 IP, 载荷)
+
+    被截断 (例如受 snaplen 限制) 而不含完整 IPv4 与 UDP 首部的帧会被跳过.
+
+    :raises ValueError: 文件为空或不是抓包文件
+    """
+    with file.open("rb") as f:
+        if file.stat().st_size == 0:
+            # mmap 不能映射空文件
+            raise ValueError(f"{file} 是空文件")
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with buf:
+        if buf[:4] == struct.pack("<I", PCAPNG_SHB):
+            frames = iterPcapng(buf)
+        else:
+            frames = iterPcap(buf)
+        for linktype, frame in frames:
+            ip = ipv4Payload(linktype, frame)
+            if not ip or len(ip) < 20 or ip[0] >> 4 != 4 or ip[9] != 17:
+                continue
+            ihl = (ip[0] & 0x0f) * 4
+            if ihl < 20 or len(ip) < ihl + 8:
+                continue
+            dport, = struct.unpack_from("!H", ip, ihl + 2)
+            if dport != DRCOM_PORT:
+                continue
+            yield ip[16:20], ip[ihl + 8:]
+
 
 def analysePcapng(file: Path) -> DrcomConfig:
     obj = DrcomConfig()
-    text = file.read_bytes()
-    offset = re.search(
-        b"\xf0\x00\xf0\x00[\x00-\xff]{4}[\x03\x07]\x01", text).start() + 8
-    if re.match(b"\x00\x00[\x00-\xff]{2}", text[offset+334:offset+338]):
+    login = None
+    version = None
+    for server, payload in iterDrcomPayloads(file):
+        if (login is None and len(payload) >= 312 and
+                payload[:2] in (b"\x03\x01", b"\x07\x01")):
+            login = server, payload
+        if version is None:
+            m = KEEP_ALIVE_VERSION_RE.match(payload)
+            if m and m.group(1) != b"\x0f\x27":
+                version = m.group(1)
+        if login is not None and version is not None:
+            break
+    if login is None:
+        raise ValueError("抓包中找不到 login 包")
+    if version is None:
+        raise ValueError("抓包中找不到 keepalive 包")
+
+    server, text = login
+    if re.match(b"\x00\x00[\x00-\xff]{2}", text[334:338]):
         obj["core"]["ROR_VERSION"] = True
     else:
         obj["core"]["ROR_VERSION"] = False
 
-    obj["core"]["CONTROL_CHECK_STATUS"] = bytes([text[offset + 56]])
-    obj["core"]["ADAPTER_NUM"] = bytes([text[offset + 57]])
-    obj["core"]["IP_DOG"] = bytes([text[offset + 105]])
-    obj["core"]["AUTH_VERSION"] = text[offset + 310:offset + 312]
-    obj["core"]["KEEP_ALIVE_VERSION"] = [i for i in re.findall(
-        # 匹配到的是 (..) 对应的内容
-        b"\xf0\x00\xf0\x00....\x07.\x5c\x28\x00\x0b\x01(..)", text) if i != b"\x0f\x27"][0]
-    obj["drcom"]["server"] = ".".join(
-        [str(i) for i in text[offset-12:offset-8]])
+    obj["core"]["CONTROL_CHECK_STATUS"] = bytes([text[56]])
+    obj["core"]["ADAPTER_NUM"] = bytes([text[57]])
+    obj["core"]["IP_DOG"] = bytes([text[105]])
+    obj["core"]["AUTH_VERSION"] = text[310:312]
+    obj["core"]["KEEP_ALIVE_VERSION"] = version
+    obj["drcom"]["server"] = ".".join([str(i) for i in server])
     return obj
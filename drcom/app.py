@@ -1,17 +1,28 @@
-import random
+import signal
 import socket as s
-import struct
-import time
+from concurrent.futures import Future
+from itertools import chain
 from sys import exit
+from threading import Event
+from time import monotonic
 
 from .config import DrcomConfig
-from .context import DrcomContext
+from .board import StatusBoard, boardPath
+from .buffer import BufferPool
+from .control import CONTROL_TIMEOUT, ControlServer, controlPath
 from .exceptions import *
-from .log import LogWriter
-from .utils import *
+from .exposition import MetricsServer
+from .metrics import StatsDumper
+from .reload import ConfigWatcher, applyConfig, loadAccounts
+from .session import (KEEP_ALIVE2_STEPS, KEEP_ALIVE_STABLE_STEPS,
+                      MAX_RETRANSMIT, RECV_TIMEOUT, STATE_KEEPALIVE,
+                      STATE_LOGIN, STATE_RETRY, STATE_STABLE, DrcomSession)
 
+# 等待回应时每隔这个秒数检查一次控制命令, 重传与重试期间同样可以停止
+CONTROL_POLL = 0.5
 
-class DrcomApp:
+
+class DrcomApp(DrcomSession):
     """Drcom 应用程序
 
     提供 Drcom 客户端的一切功能, 包括:
@@ -21,68 +32,238 @@ class DrcomApp:
     3. 错误处理
     4. 管理配置
     5. 分析抓包并生成配置
+
+    构包与解包由 :class:`drcom.session.DrcomSession` 完成, 这里只负责阻塞式的收发.
     """
 
     def __init__(self, config: DrcomConfig):
         """根据 DrcomConfig 实例化应用程序
         """
-        self.application = config["application"]
-        self.drcom = config["drcom"]
-        self.core = config["core"]
-
-        self.context = self.initContext()
+        super().__init__(config)
+        self.config = config
+        self.watcher = None     # 配置文件的监视器, 见 run
+        self.control = None     # 控制套接字, 见 run
+        self.pending = None     # 待主线程执行的控制命令, (命令, Future), 执行完毕后才清除
+        self.terminating = False    # 收到了 SIGTERM
+        self.waiting = False    # 主线程正在 wait 或 recv 中, 信号处理函数可以打断
+        self.busy = False       # 正在执行控制命令, 不再打断
+        self.wakeup = Event()
+        self.buffers = BufferPool()
+        self.server = None  # connect 的地址, 见 connectServer
         # IPv4, UDP
         self.socket = s.socket(s.AF_INET, s.SOCK_DGRAM)
-        self.socket.settimeout(10)
-        for i in range(60000, 0x10000):
+        self.socket.settimeout(RECV_TIMEOUT)
+        self.resumeState = self.loadState()
+        ports = range(60000, 0x10000)
+        if self.resumeState is not None:
+            # 服务端按来源端口识别会话, 优先使用上一个进程的端口
+            ports = chain((self.resumeState["port"], ), ports)
+        for i in ports:
             try:
                 self.socket.bind((self.application["bind_ip"], i))
+                self.port = i
                 break
             except OSError:
                 # errno 98 address already in use
                 continue
         else:
             raise BindPortException("从 60000 到 65536 间端口已耗尽")
-        self.logger = LogWriter(level=self.application["logging"],
-                                database=self.application["log_path"],
-                                max_keep=self.application["log_max_keep"])
 
     def run(self):
-        """开始运行"""
+        """开始运行, 收到 stop 或 logout 命令 (见 :mod:`drcom.control`) 或 SIGTERM 后注销并返回"""
+        snapshot = lambda: {self.context.username: self.snapshot()}
+        dumper = StatsDumper(self.application["stats_path"], snapshot).start()
+        if self.application["metrics_port"]:
+            MetricsServer(self.application["metrics_host"],
+                          self.application["metrics_port"], snapshot).start()
+        if self.application["reload"] and self.config.path is not None:
+            self.watcher = ConfigWatcher(self.config.path)
+        path = controlPath(self.application)
+        if path is not None:
+            try:
+                self.control = ControlServer(path, self.handleControl).start()
+            except OSError as e:
+                self.logger.warn(f"control socket disabled: {e}", b"")
+        board = None
+        path = boardPath(self.application)
+        if path is not None:
+            try:
+                board = StatusBoard(path, 1)
+                self.slot = board.allocate(self.account.username)
+                self.publish()
+            except OSError as e:
+                self.logger.warn(f"status board disabled: {e}", b"")
+        signal.signal(signal.SIGTERM, self.terminate)
+        try:
+            self.loop()
+        finally:
+            if self.control is not None:
+                self.control.stop()
+            dumper.stop()
+            if board is not None:
+                self.slot = None
+                board.close()
+
+    def loop(self):
+        resumed = self.resume()
+        retry = False
         while True:
             try:
-                self.login()
-                self.emptySocketBuffer()
-                self.keepAlive()
+                if retry:
+                    # 在 try 中等待, 等待时收到的控制命令也能被处理
+                    retry = False
+                    self.wait(self.application["timeout_retry"])
+                    self.logger.warn(r"restart caused by timeout", b"")
+                if resumed:
+                    resumed = False
+                    self.keepAlive(resumed=True)
+                else:
+                    self.login()
+                    self.emptySocketBuffer()
+                    self.keepAlive()
             except s.timeout:
-                time.sleep(self.application["timeout_retry"])
-                self.logger.warn(r"restart caused by timeout", b"")
+                self.metrics.count("timeout")
+                if self.failover():
+                    continue
+                self.state = STATE_RETRY
+                retry = True
                 continue
             except KeepAliveException as e:
+                self.metrics.count("KeepAliveException")
                 self.logger.warn(r"restart caused by keepAliveException", e.args[0])
                 continue
+            except ReloadException as e:
+                self.logger.info(f"restart caused by reload: {e}", b"")
+                continue
+            except ControlException:
+                if self.runCommand():
+                    return
+
+    def runCommand(self) -> bool:
+        """执行待执行的控制命令, SIGTERM 等同于 stop
+
+        :returns: 是否应当退出
+        """
+        command, future = self.pending if self.pending is not None else ("stop", None)
+        if self.terminating:
+            command = "stop"
+        self.logger.info(f"{command} requested", b"")
+        stop = command != "relogin"
+        self.busy = True
+        try:
+            if stop:
+                self.shutdown()
+        finally:
+            self.busy = False
+            self.pending = None
+            if future is not None:
+                future.set_result({"ok": True, "sessions": [self.account.username]})
+        return stop
+
+    def handleControl(self, command: str, username: str = None) -> dict:
+        """在控制线程中处理命令, 见 :mod:`drcom.control`
+
+        status 直接用快照回答; 其余命令交给主线程, 它在 CONTROL_POLL 秒内执行.
+        """
+        if username not in (None, self.account.username):
+            raise ValueError(f"没有账号 {username}")
+        if command == "status":
+            return {"ok": True, "sessions": {self.context.username: self.snapshot()}}
+        if self.pending is not None:
+            raise ValueError(f"上一个命令 {self.pending[0]} 尚未完成")
+        future = Future()
+        self.pending = (command, future)
+        self.wakeup.set()
+        return future.result(CONTROL_TIMEOUT)
+
+    def terminate(self, signum, frame):
+        """SIGTERM 等同于 stop 命令
+
+        信号处理函数运行在主线程中, 不能碰 wakeup 的锁; 主线程正在 wait 或 recv 中时
+        直接打断, 否则由下一次 :meth:`checkPending` 处理. 正在注销时忽略.
+        """
+        self.terminating = True
+        if self.waiting and not self.busy:
+            raise ControlException("stop")
+
+    def checkPending(self):
+        """有待执行的控制命令或收到了 SIGTERM 时抛出 ControlException
 
-    def initContext(self) -> DrcomContext:
-        dc = DrcomContext(
-            server=self.drcom["server"],
-            port=self.drcom["server_port"],
-            username=self.drcom["username"],
-            password=self.drcom["password"],
-            mac=self.drcom["mac"],
-            host_ip=self.drcom["host_ip"],
-            host_name=self.drcom["host_name"],
-            host_os=self.drcom["host_os"],
-            dhcp=self.drcom["dhcp"],
-            dns=self.drcom["dns"],
-            CONTROL_CHECK_STATUS=self.core["CONTROL_CHECK_STATUS"],
-            ADAPTER_NUM=self.core["ADAPTER_NUM"],
-            IP_DOG=self.core["IP_DOG"],
-            AUTH_VERSION=self.core["AUTH_VERSION"],
-            SALT=self.core["SALT"],
-            KEEP_ALIVE_VERSION=self.core["KEEP_ALIVE_VERSION"],
-            ROR_VERSION=self.core["ROR_VERSION"],
-        )
-        return dc
+        所有等待 (:meth:`wait`, :meth:`recvUntil`, :meth:`recvRace`) 都会调用,
+        重试与重传的循环因此同样可以被打断.
+        """
+        if (self.pending is not None or self.terminating) and not self.busy:
+            self.wakeup.clear()
+            raise ControlException("stop" if self.terminating else self.pending[0])
+
+    def wait(self, seconds: float):
+        """代替 time.sleep, 可以被控制命令打断
+
+        :raises ControlException: 有待执行的控制命令
+        """
+        try:
+            self.waiting = True
+            if self.pending is None and not self.terminating:
+                self.wakeup.wait(max(0.0, seconds))
+        finally:
+            self.waiting = False
+        self.checkPending()
+
+    def shutdown(self):
+        """已登录时注销, 并删除状态文件"""
+        if self.state in (STATE_KEEPALIVE, STATE_STABLE):
+            try:
+                self.logout()
+            except (s.timeout, ChallengeException, OSError) as e:
+                self.logger.warn(f"logout failed: {e!r}", b"")
+        self.clearState()
+
+    def reloadConfig(self):
+        """重新读取配置文件, 见 :mod:`drcom.reload`
+
+        继续使用同名的账号, 找不到时使用第一个账号. 多个账号需要重启后由异步引擎运行.
+        账号被删除或有变化时, 先注销旧会话 (见 :meth:`shutdown`), 再用新的账号重新登录.
+
+        :raises ReloadException: 账号或 core 参数有变化, 需要重新登录
+        """
+        loaded = loadAccounts(self.config.path, self.logger)
+        if loaded is None:
+            return
+        config, accounts = loaded
+        applyConfig(self.config, config, self.logger)
+        self.logger.level = self.application["logging"]
+        if len(accounts) > 1:
+            self.logger.warn("multiple accounts, restart drcom to run all of them", b"")
+        username = self.account.username
+        account = next((i for i in accounts if i.username == username), accounts[0])
+        if self.applyAccount(account):
+            # 用旧的账号注销, 同时删除属于它的状态文件
+            self.shutdown()
+            self.setAccount(account)
+            raise ReloadException(f"account {account.username} changed")
+
+    def resume(self) -> bool:
+        """用状态文件恢复上一个进程的会话
+
+        直接发送一轮 keepAliveStable, 服务端回应则跳过 challenge 与 login.
+        失败时删除状态文件, 由调用方重新登录.
+
+        :returns: 是否恢复成功
+        """
+        if self.resumeState is None or self.port != self.resumeState["port"]:
+            return False
+        self.resumeState = None
+        self.logger.info("resume keepAliveStable", bytes([self.srv_num]))
+        try:
+            self.connectServer()
+            self.keepAliveStable()
+        except (s.timeout, KeepAliveException):
+            self.logger.warn("resume failed, login again", b"")
+            self.clearState()
+            return False
+        self.keepAliveOK()
+        self.saveState()
+        return True
 
     def login(self):
         """登录
@@ -93,17 +274,29 @@ class DrcomApp:
         -   :meth:`sendLogin`
         """
         while True:
+            self.state = STATE_LOGIN
             try:
+                self.connectServer()
                 self.challenge()
                 self.sendLogin()
             except ChallengeException:
-                time.sleep(self.application["challenge_retry"])
+                self.metrics.count("ChallengeException")
+                self.state = STATE_RETRY
+                self.wait(self.application["challenge_retry"])
                 continue
             except LoginException:
+                self.metrics.count("LoginException")
                 # 要么是账号资费问题
                 # 要么是非登录时间
-                time.sleep(self.application["login_retry"])
-                self.logout()
+                self.state = STATE_RETRY
+                self.wait(self.application["login_retry"])
+                try:
+                    if self.logout():
+                        exit(0)
+                except (s.timeout, ChallengeException, OSError) as e:
+                    # 注销失败不影响重新登录
+                    self.metrics.count("ChallengeException")
+                    self.logger.warn(f"logout failed: {e!r}", b"")
                 continue
             break
 
@@ -119,22 +312,83 @@ class DrcomApp:
 
         -   context.SALT
         """
-        rand = time.time() + random.randint(0xf, 0xff)
-        pack = struct.pack("<H", int(rand) % 0xffff)
-        packet = b'\x01\x02' + pack + b'\x09' + b'\x00' * 15
+        if len(self.servers) > 1:
+            self.raceChallenge()
+            return
+        packet = self.makeChallengePacket()
         self.logger.info("challenge sent", packet)
-        self.socket.sendto(
-            packet,
-            (self.context.server, self.context.port)
-        )
-        data, _ = self.socket.recvfrom(1024)
-        self.logger.info("challenge recv", data)
-        if data[:1] != b'\x02':
-            self.logger.warn("challenge recv err, != 02", data)
-            raise ChallengeException(rf"{data[:1]} != b'\x02'")
-
-        self.context.SALT = data[4:8]
-        self.logger.debug("SALT modified in challenge", self.context.SALT)
+        self.recvChallenge(self.exchange(packet, "challenge"))
+
+    def raceChallenge(self):
+        """同时向所有认证服务器发送 challenge, 之后使用最先回应的那个
+
+        竞速期间套接字不 connect, 决出胜者后再 connect 到它.
+        超时后向所有服务器重传, 最多重传 MAX_RETRANSMIT 次.
+
+        修改属性
+
+        -   context.SALT
+        -   context.server
+        """
+        addresses = {}
+        for i, resolver in enumerate(self.resolvers):
+            try:
+                addresses[resolver.get()] = i
+            except s.gaierror as e:
+                self.logger.warn(f"resolve {self.servers[i]} failed: {e}", b"")
+        if not addresses:
+            raise s.timeout("no server resolved")
+        self.reopenSocket()
+        packet = self.makeChallengePacket()
+        self.logger.info("challenge race sent", packet)
+        for attempt in range(MAX_RETRANSMIT + 1):
+            start = monotonic()
+            deadline = start + min(self.rtts[i].rto for i in addresses.values())
+            for address in addresses:
+                self.socket.sendto(packet, address)
+            try:
+                data, winner = self.recvRace(addresses, deadline)
+            except s.timeout:
+                for i in addresses.values():
+                    self.rtts[i].backoff()
+                self.metrics.count("retransmit")
+                self.logger.debug("challenge race retransmit", packet)
+                continue
+            rtt = monotonic() - start
+            if attempt == 0:
+                self.rtts[winner].observe(rtt)
+            self.metrics.observe("challenge", rtt)
+            self.selectServer(winner)
+            self.logger.info(f"challenge race won by {self.context.server}", b"")
+            self.connectServer()
+            self.recvChallenge(data)
+            return
+        raise s.timeout(f"challenge race timed out after {MAX_RETRANSMIT} retransmissions")
+
+    def recvRace(self, addresses: dict, deadline: float) -> tuple:
+        """接收竞速中的 challenge 回应
+
+        :returns: (数据, 服务器序号)
+        """
+        while True:
+            self.checkPending()
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                raise s.timeout("timed out")
+            self.socket.settimeout(min(timeout, CONTROL_POLL))
+            buffer = self.buffers.next()
+            self.waiting = True
+            try:
+                n, address = self.socket.recvfrom_into(buffer)
+            except s.timeout:
+                continue
+            finally:
+                self.waiting = False
+            data = buffer[:n]
+            winner = self.raceWinner(addresses, address, data)
+            if winner is not None:
+                return data, winner
+            self.logger.debug("challenge race drop", data)
 
     def sendLogin(self):
         """发送登录数据
@@ -154,211 +408,125 @@ class DrcomApp:
         """
         packet = self.makeLoginPacket()
         self.logger.info("login sent", packet)
-        self.socket.sendto(packet, (self.context.server, self.context.port))
-        data, _ = self.socket.recvfrom(1024)
-        self.logger.info("login recv", data)
-        if data[:1] == b'\x04':
-            self.context.AUTH_INFO = data[23:39]
-            self.logger.debug("AUTH_INFO set in sendLogin",
-                              self.context.AUTH_INFO)
-        else:
-            self.logger.warn("login fail, != 04", data)
-            raise LoginException(rf"{data[:1]} != b'\x04'")
+        self.recvLogin(self.exchange(packet, "login"))
 
-    def makeLoginPacket(self) -> bytes:
-        """构建 login 包
+    def exchange(self, packet: bytes, phase: str) -> memoryview:
+        """发送一个包, 等待回应, 并记录该阶段的 RTT
 
-        读取属性
+        等待 rtt.rto 秒仍没有回应时重传, 最多重传 MAX_RETRANSMIT 次.
+        challenge 在 rtt.hedgeDelay() 秒后没有回应时, 先发送一个冗余请求.
 
-        -   context.username
-        -   context.password
-        -   context.SALT
-        -   context.CONTROL_CHECK_STATUS
-        -   context.ADAPTER_NUM
-        -   context.mac
-        -   context.host_ip
-        -   context.IP_DOG
-        -   context.host_name
-        -   context.dns
-        -   context.dhcp
-        -   context.host_os
-        -   context.AUTH_VERSION
-        -   context.ROR_VERSION
+        :raises socket.timeout: 重传后仍然没有回应
+        """
+        for attempt in range(MAX_RETRANSMIT + 1):
+            start = monotonic()
+            deadline = start + self.rtt.rto
+            hedge_at = start + self.rtt.hedgeDelay() if phase == "challenge" else deadline
+            hedged = False
+            self.send(packet)
+            try:
+                if hedge_at < deadline:
+                    try:
+                        data = self.recvUntil(packet, phase, hedge_at)
+                    except s.timeout:
+                        self.metrics.count("hedge")
+                        self.logger.debug(f"{phase} hedged", packet)
+                        self.send(packet)
+                        hedged = True
+                        data = self.recvUntil(packet, phase, deadline)
+                else:
+                    data = self.recvUntil(packet, phase, deadline)
+            except s.timeout:
+                self.rtt.backoff()
+                self.metrics.count("retransmit")
+                self.logger.debug(f"{phase} retransmit", packet)
+                continue
+            rtt = monotonic() - start
+            if attempt == 0 and not hedged:
+                # 重传或冗余过的请求无法确定回应对应哪一次发送, 不计入估计
+                self.rtt.observe(rtt)
+            self.metrics.observe(phase, rtt)
+            return data
+        raise s.timeout(f"{phase} timed out after {MAX_RETRANSMIT} retransmissions")
+
+    def connectServer(self):
+        """解析认证服务器的地址 (有缓存) 并 connect 套接字
+
+        connect 之后内核会丢弃其他来源的数据报, 收发也不再需要逐包处理地址.
+        地址不变时什么也不做.
+        """
+        address = self.resolver.get()
+        if address != self.server:
+            self.socket.connect(address)
+            self.server = address
+
+    def reopenSocket(self):
+        """在同一个端口上换一个没有 connect 的套接字"""
+        self.socket.close()
+        self.socket = s.socket(s.AF_INET, s.SOCK_DGRAM)
+        self.socket.bind((self.application["bind_ip"], self.port))
+        self.server = None
 
-        调用函数
+    def send(self, packet: bytes):
+        try:
+            self.socket.send(packet)
+        except ConnectionRefusedError:
+            # 上一个包触发的 ICMP 端口不可达, 当作丢包, 由重传处理
+            pass
 
-        -   utils.md5sum
-        -   utils.dump
-        -   utils.ror
-        -   utils.checksum
+    def recvUntil(self, packet: bytes, phase: str, deadline: float) -> memoryview:
+        """在 monotonic 时间 deadline 之前接收 packet 的回应
 
-        -
-        """
-        data = b''
-        """
-        struct  _tagLoginPacket {
-            struct _tagDrCOMHeader Header;
-            unsigned char PasswordMd5[MD5_LEN];
-            char Account[ACCOUNT_MAX_LEN];
-            unsigned char ControlCheckStatus;
-            unsigned char AdapterNum;
-            unsigned char MacAddrXORPasswordMD5[MAC_LEN];
-            unsigned char PasswordMd5_2[MD5_LEN];
-            unsigned char HostIpNum;
-            unsigned int HostIPList[HOST_MAX_IP_NUM];
-            unsigned char HalfMD5[8];
-            unsigned char DogFlag;
-            unsigned int unkown2;
-            struct _tagHostInfo HostInfo;
-            unsigned char ClientVerInfoAndInternetMode;
-            unsigned char DogVersion;
-        };
-        """
-        # _tagLoginPacket.Header
-        data += b'\x03\x01\x00' + bytes([len(self.context.username) + 20])
-        # _tagLoginPacket.PasswordMD5
-        data += md5sum(b'\x03\x01' + self.context.SALT +
-                       self.context.password.encode())
-        # _tagLoginPacket.Account
-        data += (self.context.username.encode() + b'\x00'*36)[:36]
-        # _tagLoginPacket.ControlCheckStatus
-        data += self.context.CONTROL_CHECK_STATUS
-        # _tagLoginPacket.AdapterNum
-        data += self.context.ADAPTER_NUM
-        # _tagLoginPacket.MacAddrXORPasswordMD5
-        data += hexdump(
-            int(
-                binascii.hexlify(data[4:10]),
-                base=16
-            ) ^ self.context.mac
-        )[-6:]
-        # _tagLoginPacket.PasswordMD5_2
-        data += md5sum(b'\x01' + self.context.password.encode() +
-                       self.context.SALT + b'\x00'*4)
-        # _tagLoginPacket.HostIpNum
-        data += b'\x01'
-        # _tagLoginPacket.HostIPList
-        data += b''.join(
-            [bytes([int(i)]) for i in self.context.host_ip.split('.')]
-        )
-        data += b'\x00'*12
-        # _tagLoginPacket.HalfMD5 [8]
-        data += md5sum(data + b'\x14\x00\x07\x0B')[:8]
-        # _tagLoginPacket.DogFlag
-        data += self.context.IP_DOG
-        # _tagLoginPacket.unkown2
-        data += b'\x00'*4
-        # _tagLoginPacket.HostInfo
-        """
-        struct  _tagHostInfo {
-            char HostName[HOST_NAME_MAX_LEN];
-            unsigned int DNSIP1;
-            unsigned int DHCPServerIP;
-            unsigned int DNSIP2;
-            unsigned int WINSIP1;
-            unsigned int WINSIP2;
-            struct _tagOSVersionInfo OSVersion;
-        };
-        """
-        # _tagHostInfo.HostName
-        data += (self.context.host_name.encode() + b'\x00'*32)[:32]
-        # _tagHostInfo.DNSIP1
-        data += b''.join(
-            [bytes([int(i)]) for i in self.context.dns.split('.')]
-        )
-        # _tagHostInfo.DHCPServerIP
-        data += b''.join(
-            [bytes([int(i)]) for i in self.context.dhcp.split('.')]
-        )
-        # _tagHostInfo.DNSIP2
-        data += b'\x00'*4
-        # _tagHostInfo.WINSIP1
-        data += b'\x00'*4
-        # _tagHostInfo.WINSIP2
-        data += b'\x00'*4
-        # _tagHostInfo.OSVersion
-        """
-        struct  _tagOSVersionInfo {
-            unsigned int OSVersionInfoSize;
-            unsigned int MajorVersion;
-            unsigned int MinorVersion;
-            unsigned int BuildNumber;
-            unsigned int PlatformID;
-            char ServicePack[128];
-        };
-        """
-        # _tagOSVersionInfo.OSVersionInfoSize
-        data += b'\x94\x00\x00\x00'
-        # _tagOSVersionInfo.MajorVersion
-        data += b'\x05\x00\x00\x00'
-        # _tagOSVersionInfo.MinorVersion
-        data += b'\x01\x00\x00\x00'
-        # _tagOSVersionInfo.BuildNumber
-        data += b'\x28\x0A\x00\x00'
-        # _tagOSVersionInfo.PlatformID
-        data += b'\x02\x00\x00\x00'
-        # _tagOSVersionInfo.ServicePack
-        data += (self.context.host_os.encode() + 32*b'\x00')[:32]
-        data += b'\x00'*96
-        data += self.context.AUTH_VERSION
-        if self.context.ROR_VERSION:
-            """
-            struct _tagLDAPAuth {
-                unsigned char Code;
-                unsigned char PasswordLen;
-                unsigned char Password[MD5_LEN];
-            }
-            """
-            # _tagLDAPAuth.Code
-            data += b'\x00'
-            # _tagLDAPAuth.PasswordLen
-            data += bytes([len(self.context.password)])
-            # _tagLDAPAuth.Password
-            data += ror(md5sum(b'\x03\x01' + self.context.SALT +
-                               self.context.password), self.context.password)
-        """
-        struct  _tagDrcomAuthExtData {
-            unsigned char Code;
-            unsigned char Len;
-            unsigned long CRC;
-            unsigned short Option;
-            unsigned char AdapterAddress[MAC_LEN];
-        };
-        """
-        # _tagDrcomAuthExtData.Code
-        data += b'\x02'
-        # _tagDrcomAuthExtData.Len
-        data += b'\x0c'
-        # _tagDrcomAuthExtData.CRC
-        data += checksum(
-            data + b'\x01\x26\x07\x11\x00\x00' + hexdump(self.context.mac)
-        )
-        # _tagDrcomAuthExtData.Option
-        data += b'\x00\x00'
-        # _tagDrcomAuthExtData.AdapterAddress
-        data += hexdump(self.context.mac)
-        # auto logout / default: False
-        data += b'\x00'
-        # broadcast mode / default: False
-        data += b'\x00'
-        # unknown, 随机填充的
-        data += b'\xe9\x13'
-        return data
+        不匹配的数据报 (见 :meth:`matchReply`) 一到达就丢弃, 继续等待.
+        每隔 CONTROL_POLL 秒检查一次控制命令.
 
-    def emptySocketBuffer(self):
+        :raises ControlException: 有待执行的控制命令
+        """
         while True:
+            self.checkPending()
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                raise s.timeout("timed out")
             try:
-                self.socket.recvfrom(1024)
-            except s.timeout:
-                break
+                data = self.recv(min(timeout, CONTROL_POLL))
+            except (ConnectionRefusedError, s.timeout):
+                # 超时后由循环开头判断是否已到 deadline
+                continue
+            if self.matchReply(packet, data):
+                return data
+            self.logger.debug(f"{phase} drop stale", data)
+
+    def recv(self, timeout: float = RECV_TIMEOUT) -> memoryview:
+        """接收一个数据报, 放入缓冲池中的下一个缓冲区
+
+        返回的 memoryview 在缓冲池循环一圈之前有效.
+        """
+        self.socket.settimeout(timeout)
+        buffer = self.buffers.next()
+        self.waiting = True
+        try:
+            n = self.socket.recv_into(buffer)
+        finally:
+            self.waiting = False
+        return buffer[:n]
 
-    def keepAlive(self):
+    def emptySocketBuffer(self):
+        """丢弃接收缓冲区中已经到达的数据报, 不等待"""
+        try:
+            while True:
+                self.logger.debug("drop stale", self.recv(0.0))
+        except (BlockingIOError, ConnectionRefusedError, s.timeout):
+            pass
+
+    def keepAlive(self, resumed: bool = False):
         """保持连接
 
+        :param bool resumed: 已由 :meth:`resume` 恢复, 直接进入稳定期
+
         修改属性
 
-        -   self.srv_num    新建
-        -   self.tail       新建
+        -   self.srv_num
+        -   self.tail
 
         调用函数
 
@@ -367,21 +535,40 @@ class DrcomApp:
         -   :meth:`keepAliveStable`
         """
 
-        self.srv_num = 0
-        self.tail = b'\x00\x00\x00\x00'
-        while True:
-            try:
-                self.keepAlive1()
-            except KeepAliveException:
-                continue
-            except s.timeout:
-                continue
-            self.keepAlive2()
-            time.sleep(self.drcom["keep_alive_interval"])
-            break
+        if resumed:
+            deadline = self.nextKeepAliveDeadline()
+        else:
+            self.resetKeepAlive()
+            self.state = STATE_KEEPALIVE
+            while True:
+                try:
+                    self.keepAlive1()
+                except KeepAliveException:
+                    self.metrics.count("KeepAliveException")
+                    continue
+                except s.timeout:
+                    self.metrics.count("timeout")
+                    continue
+                self.keepAlive2()
+                self.keepAliveOK()
+                self.saveState()
+                deadline = self.nextKeepAliveDeadline()
+                break
+        self.state = STATE_STABLE
         while True:
+            self.sleepUntil(deadline)
             self.keepAliveStable()
-            time.sleep(self.drcom["keep_alive_interval"])
+            self.keepAliveOK()
+            self.saveState()
+            deadline = self.nextKeepAliveDeadline(deadline)
+
+    def sleepUntil(self, deadline: float):
+        """睡眠到 monotonic 时间 deadline, 记录醒来时晚了多少"""
+        self.wait(deadline - monotonic())
+        self.drift.record(monotonic() - deadline)
+        # 阻塞式的客户端在每次醒来时检查配置文件
+        if self.watcher is not None and self.watcher.changed():
+            self.reloadConfig()
 
     def keepAlive1(self):
         """保持连接第一阶段
@@ -398,23 +585,9 @@ class DrcomApp:
 
         -   utils.md5sum
         """
-        data = b''
-        foo = struct.pack("!H", int(time.time()) % 0xffff)
-        data += b'\xff'
-        data += md5sum(b'\x03\x01' + self.context.SALT +
-                       self.context.password.encode())
-        data += b'\x00\x00\x00'
-        data += self.context.AUTH_INFO
-        data += foo
-        data += b'\x00\x00\x00\x00'
+        data = self.makeKeepAlive1Packet()
         self.logger.info("keepAlive1 sent", data)
-        self.socket.sendto(
-            data, (self.context.server, self.context.port))
-        data, _ = self.socket.recvfrom(1024)
-        self.logger.info("keepAlive1 recv", data)
-        if data[:1] != b'\x07':
-            self.logger.warn("keepAlive1 err, != 07", data)
-            raise KeepAliveException(data)
+        self.recvKeepAlive1(self.exchange(data, "keepAlive1"))
 
     def keepAlive2(self):
         """保持连接第二阶段
@@ -435,88 +608,10 @@ class DrcomApp:
 
         -   :meth:`makeKeepAlivePacket`
         """
-        # Step 1
-        packet = self.makeKeepAlivePacket(1, True)
-        self.logger.info("keepAlive2 01 sent", packet)
-        self.socket.sendto(
-            packet, (self.context.server, self.context.port))
-        data, _ = self.socket.recvfrom(1024)
-        if data[:1] != b"\x07":
-            self.logging.warn("keepAlive2 01 error, !=07", data)
-            raise KeepAliveException(data)
-        self.logger.info("keepAlive2 01 recv", data)
-        if (
-            data.startswith(b'\x07\x00\x28\x00') or
-            data.startswith(b'\x07' + bytes([self.srv_num]) + b'\x28\x00') or
-            data[:1] == b'\x07' and data[2:3] == b'\x10'
-        ):
-            self.srv_num += 1
-            self.logger.debug("srv_num add, keepAlive2 01",
-                              bytes([self.srv_num]))
-
-        # Step 2
-        packet = self.makeKeepAlivePacket(1, False)
-        self.logger.info("keepAlive2 02 sent", packet)
-        self.socket.sendto(
-            packet, (self.context.server, self.context.port))
-        data, _ = self.socket.recvfrom(1024)
-        self.logger.info("keepAlive2 02 recv", data)
-        if data[:1] != b'\x07':
-            self.logger.warn("keepAlive2 02 err, != 07", data)
-            raise KeepAliveException(data)
-        else:
-            self.srv_num += 1
-            self.tail = data[16:20]
-            self.logger.debug("srv_num add keepAlive2 02",
-                              bytes([self.srv_num]))
-            self.logger.debug("tail mod in keepAlive2 02", self.tail)
-
-        # Step 3
-        packet = self.makeKeepAlivePacket(3, False)
-        self.logger.info("keepAlive2 03 sent", packet)
-        self.socket.sendto(packet, (self.context.server, self.context.port))
-        data, _ = self.socket.recvfrom(1024)
-        self.logger.info("keepAlive2 03 recv", data)
-        if data[:1] != b'\x07':
-            self.logger.warn("keepAlive2 03 err, != 07", data)
-            raise KeepAliveException(data)
-        else:
-            self.srv_num += 1
-            self.tail = data[16:20]
-            self.logger.debug("srv_num add keepAlive2 03",
-                              bytes([self.srv_num]))
-            self.logger.debug("tail mod in keepAlive2 03", self.tail)
-
-    def makeKeepAlivePacket(self, type_, first):
-        """构建 keepalive 包
-
-        读取属性
-
-        self.srv_num
-        self.tail
-
-        修改属性
-
-        调用函数
-        """
-        data = b''
-        data += b'\x07' + bytes([self.srv_num]) + \
-            b'\x28\x00\x0b' + bytes([type_])
-        if first:
-            data += b'\x0f\x27'
-        else:
-            data += self.context.KEEP_ALIVE_VERSION
-        data += b'\x2f\x12\x00\x00\x00\x00\x00\x00'
-        data += self.tail
-        data += b'\x00\x00\x00\x00'
-        if type_ == 3:
-            data += b'\x00\x00\x00\x00'
-            data += b''.join([bytes([int(i)])
-                              for i in self.context.host_ip.split('.')])
-            data += b'\x00\x00\x00\x00\x00\x00\x00\x00'
-        else:
-            data += b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        return data
+        for step, (type_, first) in enumerate(KEEP_ALIVE2_STEPS, 1):
+            packet = self.makeKeepAlivePacket(type_, first)
+            self.logger.info(f"keepAlive2 0{step} sent", packet)
+            self.recvKeepAlive2(step, self.exchange(packet, "keepAlive2"))
 
     def keepAliveStable(self):
         """keepAlive 稳定期
@@ -533,55 +628,18 @@ class DrcomApp:
 
         调用函数
         """
-        # Step 1
-        packet = self.makeKeepAlivePacket(1, False)
-        self.logger.info("keepAliveStable 01 sent", packet)
-        self.socket.sendto(
-            packet, (self.context.server, self.context.port))
-        data, _ = self.socket.recvfrom(1024)
-        if data[:1] != b"\x07":
-            self.logging.warn("keepAliveStable 01 error, !=07", data)
-            raise KeepAliveException(data)
-        self.logger.info("keepAliveStable 01 recv", data)
-        self.srv_num += 1
-        self.tail = data[16:20] if data[16:20] else b"\x00\x00\x00\x00"
-        self.logger.debug("srv_num add keepAliveStable 01",
-                          bytes([self.srv_num]))
-        self.logger.debug("tail mod in keepAliveStable 01", self.tail)
-
-        # Step 2
-        packet = self.makeKeepAlivePacket(3, False)
-        self.logger.info("keepAliveStable 02 sent", packet)
-        self.socket.sendto(
-            packet, (self.context.server, self.context.port))
-        data, _ = self.socket.recvfrom(1024)
-        if data[:1] != b"\x07":
-            self.logging.warn("keepAliveStable 02 error, !=07", data)
-            raise KeepAliveException(data)
-        self.logger.info("keepAliveStable 02 recv", data)
-        self.srv_num = (self.srv_num + 1) % 127
-        self.tail = data[16:20]
-        self.logger.debug("srv_num reset keepAliveStable 02",
-                          bytes([self.srv_num]))
-        self.logger.debug("tail mod in keepAliveStable 02", self.tail)
+        for step, (type_, first) in enumerate(KEEP_ALIVE_STABLE_STEPS, 1):
+            packet = self.makeKeepAlivePacket(type_, first)
+            self.logger.info(f"keepAliveStable 0{step} sent", packet)
+            self.recvKeepAliveStable(step, self.exchange(packet, "keepAliveStable"))
 
     def logout(self):
         self.challenge()
-        data = b''
         if self.context.SALT:
-            data += b'\x06\x01\x00'
-            data += bytes([len(self.context.username) + 20])
-            data += md5sum(b'\x03\x01' + self.context.SALT +
-                           self.context.password.encode())
-            data += (self.context.username.encode() + 36 * b'\x00')[:36]
-            data += self.context.CONTROL_CHECK_STATUS
-            data += self.context.ADAPTER_NUM
-            data += hexdump(
-                int(binascii.hexlify(data[4:10]), 16) ^ self.context.mac
-            )[-6:0]
-            data += self.context.AUTH_INFO
-            self.socket.sendto(data,
-                               (self.context.server, self.context.port))
-            data, _ = self.socket.recvfrom(1024)
+            packet = self.makeLogoutPacket()
+            self.send(packet)
+            data = self.recvUntil(packet, "logout", monotonic() + RECV_TIMEOUT)
             if data[:1] == b'\x04':
-                exit(0)
+                self.clearState()
+                return True
+        return False
@@ -0,0 +1,171 @@
+"""drcom bench: 对本地替身服务端做压力测试
+
+替身服务端 (:mod:`drcom.mock`) 运行在子进程中, 本进程用
+:class:`drcom.aio.DrcomEngine` 运行 N 个模拟客户端, 统计
+
+-   logins/sec
+-   keepalives/sec
+-   每个会话消耗的 CPU 时间
+-   每次收发的延迟分位数
+"""
+
+import asyncio
+import socket
+from multiprocessing import Event, Process
+from tempfile import gettempdir
+from pathlib import Path
+from time import perf_counter, process_time
+
+from .aio import AsyncDrcomSession, DrcomEngine
+from .config import DrcomConfig
+from .log import LogWriter
+from .mock import runMock
+
+# 等待替身服务端绑定端口的最长秒数
+MOCK_START_TIMEOUT = 10.0
+
+
+class BenchStats:
+    """所有模拟客户端共用的统计"""
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.rtts = []
+        self.logins = 0
+        self.keepalives = 0
+        self.last_login = self.start
+
+    def record(self, code: int, rtt: float):
+        self.rtts.append(rtt)
+        if code == 0x03:
+            self.logins += 1
+            self.last_login = perf_counter()
+        elif code in (0x07, 0xff):
+            self.keepalives += 1
+
+    def percentile(self, p: float) -> float:
+        if not self.rtts:
+            return 0.0
+        rtts = sorted(self.rtts)
+        return rtts[min(len(rtts) - 1, int(len(rtts) * p))]
+
+
+class BenchSession(AsyncDrcomSession):
+    """记录每次收发耗时的会话"""
+
+    stats = None    # 由 runBench 设置
+
+    async def exchange(self, packet: bytes, phase: str) -> bytes:
+        start = perf_counter()
+        data = await super().exchange(packet, phase)
+        self.stats.record(packet[0], perf_counter() - start)
+        return data
+
+
+def benchConfig(clients: int, port: int, interval: float) -> DrcomConfig:
+    """一份配置, 以 [[accounts]] 描述 clients 个账号"""
+    conf = DrcomConfig()
+    conf["application"]["logging"] = 100
+    conf["application"]["bind_ip"] = "127.0.0.1"
+    conf["application"]["resume"] = False
+    # 不要覆盖正在运行的 drcom 的指标快照
+    conf["application"]["stats_path"] = str(
+        Path(gettempdir()) / "drcom" / "stats-bench.json")
+    conf["application"]["control_path"] = ""
+    conf["application"]["board_path"] = ""
+    conf["drcom"].update({
+        "keep_alive_interval": interval,
+        "server": "127.0.0.1",
+        "server_port": port,
+        "password": "bench",
+        "mac": 0x0a0000000000,
+        "host_ip": "127.0.0.1",
+    })
+    conf["core"].update({
+        "CONTROL_CHECK_STATUS": b"\x20",
+        "ADAPTER_NUM": b"\x05",
+        "IP_DOG": b"\x01",
+        "AUTH_VERSION": b"\x2f\x00",
+        "KEEP_ALIVE_VERSION": b"\xdc\x02",
+    })
+    conf["accounts"].extend({"username": f"bench{i:06d}", "mac": 0x0a0000000000 + i}
+                            for i in range(clients))
+    return conf
+
+
+def freePort() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def runBench(clients: int = 100, duration: float = 10.0,
+             interval: float = 1.0) -> dict:
+    """运行压力测试并返回结果
+
+    :param int clients: 模拟客户端的数量
+    :param float duration: 测试持续的秒数
+    :param float interval: keep_alive_interval
+    """
+    port = freePort()
+    ready = Event()
+    server = Process(target=runMock, args=("127.0.0.1", port, ready), daemon=True)
+    server.start()
+    # 服务端绑定之前发出的 challenge 会丢失, 要等 RTO_INITIAL 后重传, 拉高延迟分位数
+    if not ready.wait(MOCK_START_TIMEOUT):
+        server.terminate()
+        server.join()
+        raise RuntimeError(f"替身服务端没有在 {MOCK_START_TIMEOUT:.0f} 秒内绑定端口 {port}")
+
+    logger = LogWriter(level=100, database=str(
+        Path(gettempdir()) / "drcom" / "log" / "drcom-bench.db"))
+    stats = BenchStats()
+    BenchSession.stats = stats
+    engine = DrcomEngine([benchConfig(clients, port, interval)],
+                         logger=logger, session_class=BenchSession)
+
+    async def main():
+        task = asyncio.ensure_future(engine.serve())
+        await asyncio.sleep(duration)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+    try:
+        cpu = process_time()
+        stats.start = stats.last_login = perf_counter()
+        asyncio.run(main())
+        elapsed = perf_counter() - stats.start
+        cpu = process_time() - cpu
+    finally:
+        server.terminate()
+        server.join()
+
+    login_time = max(stats.last_login - stats.start, 1e-9)
+    return {
+        "clients": clients,
+        "duration": elapsed,
+        "logins": stats.logins,
+        "logins_per_sec": stats.logins / login_time,
+        "keepalives": stats.keepalives,
+        "keepalives_per_sec": stats.keepalives / elapsed,
+        "cpu_per_session": cpu / clients,
+        "latency_p50": stats.percentile(0.50),
+        "latency_p90": stats.percentile(0.90),
+        "latency_p99": stats.percentile(0.99),
+    }
+
+
+def report(result: dict) -> str:
+    """格式化为终端输出"""
+    return "\n".join([
+        f"clients         {result['clients']}",
+        f"duration        {result['duration']:.2f} s",
+        f"logins          {result['logins']} ({result['logins_per_sec']:.1f}/s)",
+        f"keepalives      {result['keepalives']} ({result['keepalives_per_sec']:.1f}/s)",
+        f"cpu/session     {result['cpu_per_session'] * 1e3:.3f} ms",
+        "latency p50/p90/p99  " + "/".join(
+            f"{result[k] * 1e3:.3f}" for k in ("latency_p50", "latency_p90", "latency_p99")) + " ms",
+    ])
@@ -0,0 +1,330 @@
+"""共享内存中的会话状态表
+
+监控程序每秒轮询多次时, 读日志或连接控制套接字都太贵. 运行中的 drcom 把每个会话的
+状态写入一个固定布局的文件, 读取方 mmap 之后只做内存读取, 不再有任何系统调用.
+
+文件布局 (小端序)::
+
+    头部 HEADER_SIZE 字节: magic, 版本, 槽大小, 容量, 已用槽数, 进程号, 关闭标志, 启动时间
+    槽 × 容量, 每个 SLOT_SIZE 字节:
+        seq         u32     写入期间为奇数
+        state       u8      STATES 中的序号
+        srv_num     u8
+        port        u16     绑定的本地端口
+        username    32s     UTF-8, 0 填充, 全 0 表示空槽
+        rtt         f64     最近一次收发的往返秒数, NaN 表示还没有
+        keepalive   f64     最近一次成功 keepalive 的 Unix 时间, 0 表示还没有
+        counters    u32 × len(COUNTERS)
+
+每个会话只有一个写入方 (它自己的事件循环或主线程). 写入方先把 seq 加一成为奇数,
+写入槽的内容, 再加一成为偶数; 读取方在读取前后各读一次 seq, 两次相同且为偶数时
+读到的才是完整的一次写入, 否则重读.
+
+Python 无法插入内存屏障, 上述协议依赖 CPU 按程序顺序提交存储与读取. x86 上成立;
+ARM 等弱序的 CPU (例如路由器) 上读取方偶尔可能读到新旧混合的槽. 状态表因此只供
+参考, 用于监控与显示; 需要准确的值时使用控制套接字的 status 命令.
+
+写入方只在会话状态变化与每轮 keepalive 结束时写入, 收发的热路径上没有额外开销.
+
+会话数超过容量时 (重新加载配置新增了账号), 写入方建立一个两倍大的新文件替换旧文件,
+并在旧文件中置关闭标志 MOVED, 读取方看到后重新 mmap.
+"""
+
+import math
+import mmap
+import os
+import struct
+from pathlib import Path
+from tempfile import gettempdir
+from time import time
+
+from .metrics import COUNTERS
+from .states import STATES
+
+MAGIC = b"DRCOMSB\x00"
+VERSION = 1
+
+HEADER = struct.Struct("<8sIIIIIId")
+HEADER_SIZE = 64
+SEQ = struct.Struct("<I")
+BODY = struct.Struct(f"<BBH32sdd{len(COUNTERS)}I")
+SLOT_SIZE = 128
+# count 与 closed 在头部中的偏移, 写入方单独更新它们
+COUNT = struct.Struct("<I")
+COUNT_OFFSET = 8 + 4 * 3
+CLOSED_OFFSET = 8 + 4 * 5
+
+# closed 的取值
+OPEN = 0
+CLOSED = 1  # 进程已退出
+MOVED = 2   # 文件已被更大的文件替换, 重新打开 path
+
+# 读取一个槽时最多重试的次数
+MAX_RETRY = 10000
+
+STATE_INDEX = {state: i for i, state in enumerate(STATES)}
+EMPTY_BODY = BODY.pack(0, 0, 0, b"", math.nan, 0.0, *[0] * len(COUNTERS))
+
+assert BODY.size + SEQ.size <= SLOT_SIZE and HEADER.size <= HEADER_SIZE
+
+
+def defaultBoardPath() -> str:
+    return str(Path(gettempdir()) / "drcom" / "board")
+
+
+def boardPath(application: dict) -> Path:
+    """application 中的 board_path, 为空字符串时返回 None 表示不开启"""
+    path = application["board_path"]
+    if path == "":
+        return None
+    return Path(defaultBoardPath() if path is None else path)
+
+
+def openBoard(application: dict) -> "BoardReader":
+    """打开运行中的 drcom 的状态表
+
+    :returns: BoardReader, 没有开启, 文件不存在或写入方已经退出时返回 None
+    """
+    path = boardPath(application)
+    if path is None:
+        return None
+    try:
+        reader = BoardReader(path)
+    except (OSError, ValueError):
+        return None
+    if not reader.live():
+        reader.close()
+        return None
+    return reader
+
+
+def encodeName(username: str) -> bytes:
+    """UTF-8 编码并截断到 32 字节, 不截断半个字符"""
+    return username.encode()[:32].decode("utf-8", "ignore").encode()
+
+
+def pidAlive(pid: int) -> bool:
+    if os.name == "nt":
+        # Windows 上 os.kill 会结束进程, 只能相信关闭标志
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 进程存在但属于其他用户
+        return True
+    return True
+
+
+class Slot:
+    """状态表中属于一个会话的槽, 由 :meth:`StatusBoard.allocate` 分配"""
+
+    __slots__ = ("board", "offset", "seq", "username")
+
+    def __init__(self, board: "StatusBoard", index: int, username: str):
+        self.board = board
+        self.offset = HEADER_SIZE + index * SLOT_SIZE
+        self.seq = 0
+        self.username = encodeName(username)
+
+    def write(self, state: str, srv_num: int, port: int, metrics):
+        """写入会话的当前状态
+
+        :param MetricsRegistry metrics: 读取 last_rtt, last_keepalive_time 与 counters
+        """
+        mm = self.board.mm
+        offset = self.offset
+        counters = metrics.counters
+        rtt = metrics.last_rtt
+        self.seq += 1
+        SEQ.pack_into(mm, offset, self.seq)
+        BODY.pack_into(mm, offset + SEQ.size,
+                       STATE_INDEX.get(state, 255), srv_num & 0xff, port or 0, self.username,
+                       math.nan if rtt is None else rtt,
+                       metrics.last_keepalive_time or 0.0,
+                       *[counters.get(i, 0) & 0xffffffff for i in COUNTERS])
+        self.seq += 1
+        SEQ.pack_into(mm, offset, self.seq)
+
+    def rename(self, username: str):
+        """会话换了账号, 下一次 write 生效"""
+        self.username = encodeName(username)
+
+    def clear(self):
+        mm = self.board.mm
+        self.seq += 1
+        SEQ.pack_into(mm, self.offset, self.seq)
+        mm[self.offset + SEQ.size:self.offset + SEQ.size + BODY.size] = EMPTY_BODY
+        self.seq += 1
+        SEQ.pack_into(mm, self.offset, self.seq)
+
+
+class StatusBoard:
+    """写入方, 建立并持有状态表文件的 mmap
+
+    :param Path path: 文件路径
+    :param int capacity: 初始的槽数
+
+    :raises FileExistsError: path 上已有另一个运行中的 drcom 的状态表
+    """
+
+    def __init__(self, path: Path, capacity: int):
+        self.path = path
+        try:
+            reader = BoardReader(path)
+        except (OSError, ValueError):
+            # 不存在或不是状态表, 直接覆盖
+            reader = None
+        if reader is not None:
+            live = reader.live()
+            reader.close()
+            if live:
+                raise FileExistsError(f"{path} 已被另一个 drcom 使用")
+        self.slots = []     # 序号 -> Slot, 空槽为 None
+        self.mm = None
+        self.create(max(capacity, 1))
+
+    def create(self, capacity: int):
+        """建立 capacity 个槽的新文件, 复制已有的槽, 原子地替换 path"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        size = HEADER_SIZE + capacity * SLOT_SIZE
+        tmp = self.path.with_name(self.path.name + f".{os.getpid()}.tmp")
+        fd = os.open(str(tmp), os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        old = self.mm
+        if old is not None:
+            mm[HEADER_SIZE:len(old)] = old[HEADER_SIZE:]
+        HEADER.pack_into(mm, 0, MAGIC, VERSION, SLOT_SIZE, capacity,
+                         len(self.slots), os.getpid(), OPEN, time())
+        os.replace(str(tmp), str(self.path))
+        self.mm = mm
+        self.capacity = capacity
+        if old is not None:
+            COUNT.pack_into(old, CLOSED_OFFSET, MOVED)
+            old.close()
+
+    def allocate(self, username: str) -> Slot:
+        """为一个会话分配槽, 优先复用空槽, 没有空槽时扩容"""
+        if None in self.slots:
+            index = self.slots.index(None)
+        else:
+            index = len(self.slots)
+            if index == self.capacity:
+                self.create(self.capacity * 2)
+            self.slots.append(None)
+            COUNT.pack_into(self.mm, COUNT_OFFSET, len(self.slots))
+        slot = self.slots[index] = Slot(self, index, username)
+        return slot
+
+    def release(self, slot: Slot):
+        """清空会话的槽, 留给之后新增的会话"""
+        index = (slot.offset - HEADER_SIZE) // SLOT_SIZE
+        if self.slots[index] is slot:
+            slot.clear()
+            self.slots[index] = None
+
+    def close(self):
+        """进程退出前调用, 读取方据此知道数据已经过时"""
+        if self.mm is not None:
+            COUNT.pack_into(self.mm, CLOSED_OFFSET, CLOSED)
+            self.mm.close()
+            self.mm = None
+
+
+class BoardReader:
+    """读取方, 供 ``drcom status`` 与外部监控程序使用
+
+    打开时 mmap 一次, 之后每次 :meth:`read` 只读内存.
+
+    :raises ValueError: 文件不是状态表或版本不同
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.mm = None
+        self.open()
+
+    def open(self):
+        with open(str(self.path), "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, slot_size, capacity, _, pid, _, started = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION or slot_size != SLOT_SIZE:
+            mm.close()
+            raise ValueError(f"{self.path} 不是状态表或版本不同")
+        if self.mm is not None:
+            self.mm.close()
+        self.mm = mm
+        self.capacity = capacity
+        self.pid = pid
+        self.started = started
+
+    def live(self) -> bool:
+        """写入方仍在运行"""
+        closed = COUNT.unpack_from(self.mm, CLOSED_OFFSET)[0]
+        return closed == OPEN and pidAlive(self.pid)
+
+    def read(self) -> dict:
+        """账号 -> 状态记录, 见 :meth:`readSlot`"""
+        if COUNT.unpack_from(self.mm, CLOSED_OFFSET)[0] == MOVED:
+            self.open()
+        count = min(COUNT.unpack_from(self.mm, COUNT_OFFSET)[0], self.capacity)
+        result = {}
+        for index in range(count):
+            record = self.readSlot(index)
+            if record is not None:
+                result[record.pop("username")] = record
+        return result
+
+    def readSlot(self, index: int) -> dict:
+        """按 seqlock 读取一个槽, 空槽返回 None"""
+        mm = self.mm
+        offset = HEADER_SIZE + index * SLOT_SIZE
+        for _ in range(MAX_RETRY):
+            before = SEQ.unpack_from(mm, offset)[0]
+            if before & 1:
+                continue
+            body = BODY.unpack_from(mm, offset + SEQ.size)
+            if SEQ.unpack_from(mm, offset)[0] == before:
+                break
+        else:
+            # 写入方在写入中途退出, seq 停在奇数; 不能无限等待
+            body = BODY.unpack_from(mm, offset + SEQ.size)
+        state, srv_num, port, username, rtt, keepalive = body[:6]
+        username = username.rstrip(b"\x00")
+        if not username:
+            return None
+        return {
+            "username": username.decode("utf-8", "replace"),
+            "state": STATES[state] if state < len(STATES) else "unknown",
+            "srv_num": srv_num,
+            "port": port,
+            "rtt": None if math.isnan(rtt) else rtt,
+            "last_keepalive": keepalive or None,
+            "counters": dict(zip(COUNTERS, body[6:])),
+        }
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+
+def formatBoard(sessions: dict, now: float = None) -> str:
+    """把 :meth:`BoardReader.read` 的结果格式化为每个会话一行"""
+    now = time() if now is None else now
+    lines = []
+    for name, record in sessions.items():
+        keepalive = record["last_keepalive"]
+        keepalive = "never" if keepalive is None else f"{now - keepalive:.1f} s ago"
+        rtt = record["rtt"]
+        rtt = "-" if rtt is None else f"{rtt * 1e3:.2f} ms"
+        errors = ", ".join(f"{k}={v}" for k, v in record["counters"].items() if v)
+        lines.append(f"[{name}] {record['state']}, port {record['port']}, "
+                     f"srv_num {record['srv_num']}, last keepalive {keepalive}, "
+                     f"rtt {rtt}" + (f", {errors}" if errors else ""))
+    return "\n".join(lines) if lines else "no session"
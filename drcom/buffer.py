@@ -0,0 +1,21 @@
+"""可复用的接收缓冲区"""
+
+
+class BufferPool:
+    """固定数量的接收缓冲区, 循环使用
+
+    :meth:`next` 依次返回各个缓冲区的 memoryview, 某个缓冲区中的数据
+    在之后 count - 1 次 :meth:`next` 之内有效, 需要长期保存的字段要复制出来.
+
+    :param int count: 缓冲区数量
+    :param int size: 每个缓冲区的字节数
+    """
+
+    def __init__(self, count: int = 4, size: int = 1024):
+        self.views = [memoryview(bytearray(size)) for _ in range(count)]
+        self.index = 0
+
+    def next(self) -> memoryview:
+        view = self.views[self.index]
+        self.index = (self.index + 1) % len(self.views)
+        return view
@@ -2,18 +2,16 @@
 
 1. 读取配置文件中的字段
 2. 生成配置文件
+3. 缓存解析好的配置, 配置文件不变时跳过 TOML 解析
 """
 
+import marshal
+import os
 from argparse import SUPPRESS, Action, ArgumentParser
-from os import environ
 from pathlib import Path
-from platform import system
-from sys import exit
 from time import localtime, strftime
+from zlib import crc32
 
-from .toml import dumps as TOMLdumps
-from .toml import loads as TOMLloads
-from .utils import getIP, getMacAdress
 
 DEFAULT_CONFIG_FILES = [
     Path("drcom.toml"),
@@ -21,6 +19,132 @@ DEFAULT_CONFIG_FILES = [
     Path("/etc/drcom/drcom.toml")   # 为 Linux Systemd 准备
 ]
 
+# core 中以整数数组表示的字节串
+BYTES_FIELDS = {"CONTROL_CHECK_STATUS", "ADAPTER_NUM", "IP_DOG",
+                "AUTH_VERSION", "KEEP_ALIVE_VERSION", "SALT"}
+
+# 缓存的格式版本, 修改 compileConfig 的输出时递增
+CACHE_VERSION = 1
+
+
+def findConfig(files) -> Path:
+    """返回第一个存在的配置文件
+
+    :raises FileNotFoundError: 都不存在
+    """
+    for i in files:
+        if i.exists():
+            return i
+    raise FileNotFoundError("找不到可用的配置文件")
+
+
+def compileConfig(filedata: dict) -> dict:
+    """把 TOML 解析结果中 core 的整数数组转为 bytes
+
+    accounts 中的字段由 drcom.account.Account 校验并转换
+    """
+    core = filedata.get("core", {})
+    for key in BYTES_FIELDS & core.keys():
+        core[key] = bytes(bytearray(core[key]))
+    return filedata
+
+
+def parseConfig(string: str) -> dict:
+    """解析 TOML 字符串并经过 compileConfig
+
+    命中编译缓存时用不到解析器, 因此在这里才导入
+    """
+    from .toml.fast import loads
+    return compileConfig(loads(string))
+
+
+def cachePath(file: Path) -> Path:
+    """编译缓存与配置文件放在一起: drcom.toml -> .drcom.toml.cache"""
+    return file.with_name(f".{file.name}.cache")
+
+
+def fingerprint(file: Path, content: str, stat: os.stat_result) -> tuple:
+    """缓存的键, 路径, 修改时间, 大小与内容的 CRC 任一变化都会使缓存失效"""
+    return (CACHE_VERSION, str(file.absolute()), stat.st_mtime_ns,
+            stat.st_size, crc32(content.encode("utf-8")))
+
+
+def loadCache(path: Path, key: tuple) -> dict:
+    """读取编译缓存
+
+    :returns: compileConfig 的结果, 缓存不存在, 损坏或键不匹配时返回 None;
+        其他用户可以读取的缓存 (旧版本按配置文件的权限写入) 也视为不存在, 由调用方重写
+    """
+    try:
+        if os.name == "posix" and path.stat().st_mode & 0o077:
+            return None
+        cached, data = marshal.loads(path.read_bytes())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    return data if cached == key else None
+
+
+def dumpCache(path: Path, key: tuple, data: dict):
+    """原子地写入编译缓存
+
+    缓存中有明文密码, 无论配置文件的权限如何都只有所有者可以读写.
+    临时文件以 O_EXCL 新建, 不会沿用残留文件或符号链接的权限.
+    目录不可写 (如 /etc/drcom) 或配置中有 marshal 不支持的类型时放弃缓存.
+    """
+    tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+    try:
+        blob = marshal.dumps((key, data))
+        try:
+            os.remove(str(tmp))
+        except FileNotFoundError:
+            pass
+        fd = os.open(str(tmp), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(str(tmp), str(path))
+    except (OSError, ValueError):
+        try:
+            os.remove(str(tmp))
+        except OSError:
+            pass
+
+
+def probeMac() -> int:
+    from .utils import getMacAdress
+    return getMacAdress()
+
+
+def probeIP() -> str:
+    from .utils import getIP
+    return getIP()
+
+
+class LazyTable(dict):
+    """缺少某个键时才调用 defaults 中的函数得到默认值
+
+    本机的 IP 与 MAC 地址需要探测, 只有配置文件没有给出而又被读取时才探测,
+    drcom log 等用不到它们的命令不会付出这个开销.
+
+    :param dict data: 普通的默认值
+    :param dict defaults: 键 -> 无参函数
+    """
+
+    def __init__(self, data: dict, defaults: dict):
+        super().__init__(data)
+        self.defaults = defaults
+
+    def __missing__(self, key):
+        if key not in self.defaults:
+            raise KeyError(key)
+        value = self[key] = self.defaults[key]()
+        return value
+
+    def resolve(self):
+        """计算所有尚未给出的默认值"""
+        for key in self.defaults:
+            self[key]
+        return self
+
 
 class DrcomConfig:
     """DrcomConfig
@@ -29,6 +153,7 @@ class DrcomConfig:
     """
 
     def __init__(self):
+        self.path = None    # 由 load 设置, 重新加载时读取
         self.data = {
             "application": {
                 "logging": 10,              # int
@@ -38,20 +163,30 @@ class DrcomConfig:
                 "login_retry": 3600,        # 登陆失败时重试间隔
                 "timeout_retry": 60,        # 连接超时重试间隔
                 "challenge_retry": 10,
+                "stats_path": None,         # str，指标快照路径, 默认为 {临时目录}/drcom/stats.json
+                "metrics_host": "127.0.0.1",    # str，OpenMetrics 端点的监听地址
+                "metrics_port": 0,          # int，OpenMetrics 端点的端口, 0 表示不开启
+                "resolve_ttl": 300,         # int，认证服务器地址的缓存秒数
+                "resume": True,             # bool，重启后尝试直接恢复 keepalive
+                "state_path": None,         # str，会话状态文件路径, 默认为 {临时目录}/drcom/state/{账号}.json, 可以含有 {username}
+                "control_path": None,       # str，控制套接字路径, 默认为 {临时目录}/drcom/control.sock, 空字符串表示不开启
+                "board_path": None,         # str，共享内存状态表路径, 默认为 {临时目录}/drcom/board, 空字符串表示不开启
+                "reload": True,             # bool，配置文件修改后自动重新加载, 见 drcom.reload
             },
-            "drcom": {
+            "drcom": LazyTable({
                 "keep_alive_interval": 15,  # int
-                "server": "认证服务器",     # str
+                "server": "认证服务器",     # str, 有多个认证服务器时可以写成列表
                 "server_port": 61440,       # 认证服务器端口
                 "username": "校园网账号",   # str
                 "password": "校园网密码",   # str
-                "mac": getMacAdress(),      # int
-                "host_ip": getIP(),         # str
                 "host_name": "F**K DRCOM",  # str
                 "host_os": "DRCOM F**KER",  # str
                 "dhcp": "0.0.0.0",          # str
                 "dns": "8.8.8.8",           # str
-            },
+            }, {
+                "mac": probeMac,            # int, 默认为本机的 MAC 地址
+                "host_ip": probeIP,         # str, 默认为本机的 IP 地址
+            }),
             "core": {
                 "CONTROL_CHECK_STATUS": b"",    # bytes
                 "ADAPTER_NUM": b"",             # bytes
@@ -60,30 +195,59 @@ class DrcomConfig:
                 "KEEP_ALIVE_VERSION": b"",      # bytes
                 "SALT": b"",                    # bytes
                 "ROR_VERSION": False,           # bool
-            }
+            },
+            # list, [[accounts]] 中的每一项覆盖 drcom 与 core 中的部分字段, 见 drcom.account
+            "accounts": [],
         }
 
     def loads(self, string: str):
         """从 TOML 格式的字符串中加载配置
         """
-        filedata = TOMLloads(string)
-        for table in self.data:
+        return self.merge(parseConfig(string))
+
+    def merge(self, filedata: dict):
+        """用 compileConfig 的结果覆盖默认值"""
+        for table in ("application", "drcom", "core"):
             self.data[table].update(filedata[table])
-        for key in {"CONTROL_CHECK_STATUS", "ADAPTER_NUM", "IP_DOG", "AUTH_VERSION", "KEEP_ALIVE_VERSION", "SALT"}:
-            self.data["core"][key] = (lambda b: bytes(
-                bytearray(b)))(self.data["core"][key])
+        self.data["accounts"] = filedata.get("accounts", [])
         return self
 
-    def load(self, file: Path):
+    def accounts(self) -> list:
+        """校验并编译所有账号, 没有 [[accounts]] 时 [drcom] 与 [core] 本身就是唯一的账号
+
+        :returns: drcom.account.Account 的列表
+        :raises ConfigException: 有字段不正确
+        """
+        from .account import compileAccounts
+        return compileAccounts(self.data["drcom"], self.data["core"], self.data["accounts"])
+
+    def load(self, file: Path, cache: bool = True):
         """从 TOML 文件中加载配置
 
         :param Path file: pathlib.Path 对象，目标 TOML 文件. 字符编码必须是 UTF-8
+        :param bool cache: 使用 cachePath(file) 处的编译缓存
         """
+        self.path = file
+        stat = file.stat()
         content = file.read_text("utf-8")
-        return self.loads(content)
+        if not cache:
+            return self.loads(content)
+        key = fingerprint(file, content, stat)
+        path = cachePath(file)
+        filedata = loadCache(path, key)
+        if filedata is None:
+            filedata = parseConfig(content)
+            dumpCache(path, key, filedata)
+        return self.merge(filedata)
 
     def dumps(self) -> str:
-        return TOMLdumps(self.data)
+        from .toml import dumps
+        # 生成的配置文件中也要有探测到的默认值
+        self.data["drcom"].resolve()
+        data = dict(self.data)
+        if not data["accounts"]:
+            del data["accounts"]
+        return dumps(data)
 
     def dump(self, file: Path):
         file.write_text(self.dumps(), encoding="utf-8")
@@ -94,10 +258,16 @@ class DrcomConfig:
 
 class SetFilesPathAction(Action):
     """设置 dest 为 Path 对象
+
+    可以多次指定, 依次追加
     """
 
     def __call__(self, parser, namespace, values, option_string=None):
-        path = (Path(values).absolute(), )  # 需要一个元组
+        old = getattr(namespace, self.dest, None)
+        if not isinstance(old, tuple):
+            # 默认值是列表, 第一次指定时丢弃
+            old = ()
+        path = old + (Path(values).absolute(), )  # 需要一个元组
         setattr(namespace, self.dest, path)
 
 
@@ -117,7 +287,28 @@ def getParser() -> ArgumentParser:
         default=DEFAULT_CONFIG_FILES,
         action=SetFilesPathAction,
     )
-    stop = cmd.add_parser("stop", description="停止 drcom")
+    start.add_argument("--async", dest="use_async",
+                       help="在同一个事件循环中运行 -c 指定的所有配置",
+                       action="store_true", default=False)
+    stop = cmd.add_parser("stop", description="注销所有会话并停止运行中的 drcom")
+    status = cmd.add_parser("status", description="显示运行中的 drcom 各会话的状态")
+    status.add_argument("--json", help="输出原始的 JSON",
+                        action="store_true", default=False)
+    logout = cmd.add_parser("logout", description="注销并停止运行中的 drcom 的会话")
+    relogin = cmd.add_parser("relogin", description="让运行中的 drcom 重新登录")
+    for i in (logout, relogin):
+        i.add_argument("USERNAME", help="账号, 留空则为所有会话", nargs="?")
+    # 这些命令通过控制套接字与运行中的 drcom 通信, 套接字路径来自配置文件
+    for i in (stop, status, logout, relogin):
+        i.add_argument(
+            "-c", "--config",
+            dest="config",
+            help="指定配置文件 优先级 ./drcom.toml > ~/.config/drcom/drcom.toml > /etc/drcom/drcon.toml",
+            required=False,
+            metavar="path/to/drcom.toml",
+            default=DEFAULT_CONFIG_FILES,
+            action=SetFilesPathAction,
+        )
     log = cmd.add_parser("log", description="显示日志")
     log.add_argument(
         "-c", "--config",
@@ -140,6 +331,26 @@ def getParser() -> ArgumentParser:
     analyse = cmd.add_parser("analyse", description="解析抓包，生成配置")
     analyse.add_argument("FILE", help="要解析的抓包文件")
     clean = cmd.add_parser("clean", description="清理日志")
+    stats = cmd.add_parser("stats", description="显示运行中会话的指标")
+    stats.add_argument(
+        "-c", "--config",
+        dest="config",
+        help="指定配置文件 优先级 ./drcom.toml > ~/.config/drcom/drcom.toml > /etc/drcom/drcon.toml",
+        required=False,
+        metavar="path/to/drcom.toml",
+        default=DEFAULT_CONFIG_FILES,
+        action=SetFilesPathAction,
+    )
+    bench = cmd.add_parser("bench", description="对本地替身服务端做压力测试")
+    bench.add_argument("-n", "--clients", help="模拟客户端的数量",
+                       type=int, default=100)
+    bench.add_argument("-t", "--duration", help="测试持续的秒数",
+                       type=float, default=10.0)
+    bench.add_argument("--interval", help="keepalive 间隔秒数",
+                       type=float, default=1.0)
+    mock = cmd.add_parser("mock", description="运行本地的认证服务端替身")
+    mock.add_argument("--host", default="127.0.0.1")
+    mock.add_argument("--port", type=int, default=61440)
     return parser
 
 
@@ -149,8 +360,4 @@ def configure() -> DrcomConfig:
 
     arg = getParser().parse_args()
     conf = DrcomConfig()
-    for i in arg.config:
-        if i.exists():
-            file = i
-            break
-    return conf.load(file)
+    return conf.load(findConfig(arg.config))
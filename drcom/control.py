@@ -0,0 +1,188 @@
+"""运行中的 drcom 的控制套接字
+
+``drcom start`` 在一个 Unix 域套接字上监听, 每个连接发送一行命令, 收到一行 JSON 回应:
+
+-   ``status``: 所有会话的快照, 含状态, 当前服务器, 上一次 keepalive, srv_num 与 RTT
+-   ``logout [账号]``: 注销并停止会话, 不给出账号时为所有会话; 没有会话时进程退出
+-   ``relogin [账号]``: 丢弃会话, 重新 challenge 与 login
+-   ``stop``: 注销所有会话后退出, systemd 发送的 SIGTERM 同样如此
+
+回答只来自内存中的快照, 不读取日志, 耗时与日志大小无关.
+"""
+
+import json
+import os
+import socket
+from pathlib import Path
+from tempfile import gettempdir
+from threading import Event, Thread
+
+COMMANDS = ("status", "stop", "logout", "relogin")
+# 客户端与服务端等待对方的秒数; stop 要等所有会话注销, 最坏情况下
+# challenge 重传 3 次, 每次等待 RTO_MAX (10 秒), 再等待 logout 的回应 RECV_TIMEOUT (10 秒),
+# 共 50 秒, 另加等待主线程响应命令的时间
+CONTROL_TIMEOUT = 60.0
+# 一行命令的最大长度
+MAX_LINE = 4096
+
+
+def defaultControlPath() -> str:
+    return str(Path(gettempdir()) / "drcom" / "control.sock")
+
+
+def controlPath(application: dict) -> Path:
+    """application 中的 control_path, 为空字符串时返回 None 表示不开启"""
+    path = application["control_path"]
+    if path == "" or not hasattr(socket, "AF_UNIX"):
+        return None
+    return Path(defaultControlPath() if path is None else path)
+
+
+def parseCommand(line: bytes) -> tuple:
+    """解析一行命令
+
+    :returns: (命令, 账号), 没有给出账号时为 None
+    :raises ValueError: 未知的命令
+    """
+    words = line.decode("utf-8", "replace").split()
+    if not words or words[0] not in COMMANDS or len(words) > 2:
+        raise ValueError(f"未知的命令 {line[:64]!r}, 可用的命令: {', '.join(COMMANDS)}")
+    if words[0] in ("status", "stop") and len(words) > 1:
+        raise ValueError(f"{words[0]} 不接受参数")
+    return words[0], words[1] if len(words) > 1 else None
+
+
+def encodeReply(reply: dict) -> bytes:
+    return json.dumps(reply).encode("utf-8") + b"\n"
+
+
+def listen(path: Path) -> socket.socket:
+    """在 path 上监听, 只允许同一用户连接
+
+    上一个进程留下的套接字文件会被删除.
+
+    :raises FileExistsError: 已有另一个 drcom 在监听 path
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(str(path))
+    except (ConnectionRefusedError, FileNotFoundError):
+        try:
+            os.remove(str(path))
+        except FileNotFoundError:
+            pass
+    else:
+        raise FileExistsError(f"{path} 上已有 drcom 在运行")
+    finally:
+        probe.close()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(str(path))
+    # 可以注销会话, 不能让其他用户连接
+    os.chmod(str(path), 0o600)
+    sock.listen(8)
+    return sock
+
+
+def request(path: Path, command: str, timeout: float = CONTROL_TIMEOUT) -> dict:
+    """向运行中的 drcom 发送一条命令并返回回应
+
+    :raises ConnectionError: drcom 没有运行
+    :raises RuntimeError: drcom 拒绝了命令
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        raise ConnectionError("此平台不支持控制套接字")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise ConnectionError(f"drcom 没有运行 ({path})") from None
+        sock.sendall(command.encode("utf-8") + b"\n")
+        data = b""
+        while not data.endswith(b"\n"):
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    if not data:
+        raise ConnectionError("drcom 没有回应")
+    reply = json.loads(data.decode("utf-8"))
+    if not reply["ok"]:
+        raise RuntimeError(reply["error"])
+    return reply
+
+
+def formatStatus(sessions: dict) -> str:
+    """把 status 的回应格式化为每个会话一行"""
+    lines = []
+    for name, snap in sessions.items():
+        since = snap["since_last_keepalive"]
+        since = "never" if since is None else f"{since:.1f} s ago"
+        rtt = snap["servers"].get(snap["server"], {})
+        srtt = rtt.get("srtt")
+        srtt = "-" if srtt is None else f"{srtt * 1e3:.2f} ms"
+        lines.append(f"[{name}] {snap['state']}, server {snap['server']}, port {snap['port']}, "
+                     f"srv_num {snap['srv_num']}, last keepalive {since}, srtt {srtt}")
+    return "\n".join(lines) if lines else "no session"
+
+
+class ControlServer:
+    """在后台线程中逐个处理控制连接, 供阻塞式的 DrcomApp 使用
+
+    :param Path path: 套接字路径
+    :param handler: 函数 (命令, 账号) -> 回应的字典, 在后台线程中调用
+    """
+
+    def __init__(self, path: Path, handler):
+        self.path = path
+        self.handler = handler
+        self.socket = listen(path)
+        self.stopped = Event()
+        self.thread = Thread(target=self.loop, name="drcom-control", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """停止监听, 正在处理的命令回应之后才返回"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        # accept 不会因为另一个线程关闭套接字而返回, 连接一次唤醒它
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(str(self.path))
+        except OSError:
+            pass
+        self.thread.join(CONTROL_TIMEOUT)
+        self.socket.close()
+        try:
+            os.remove(str(self.path))
+        except OSError:
+            pass
+
+    def loop(self):
+        while True:
+            conn, _ = self.socket.accept()
+            if self.stopped.is_set():
+                conn.close()
+                return
+            with conn:
+                conn.settimeout(CONTROL_TIMEOUT)
+                try:
+                    self.serve(conn)
+                except OSError:
+                    pass
+
+    def serve(self, conn: socket.socket):
+        line = conn.makefile("rb").readline(MAX_LINE)
+        try:
+            reply = self.handler(*parseCommand(line))
+        except ValueError as e:
+            reply = {"ok": False, "error": str(e)}
+        except Exception as e:
+            # 主线程没有及时处理等, 不能让控制线程退出
+            reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        conn.sendall(encodeReply(reply))
@@ -20,3 +20,22 @@ class BindPortException(OSError):
 class KeepAliveException(ValueError):
     def __init__(self, msg):
         super().__init__(msg)
+
+
+class ConfigException(ValueError):
+    def __init__(self, msg):
+        super().__init__(msg)
+
+
+class ReloadException(Exception):
+    """重新加载的配置中账号或 core 参数有变化, 需要重新登录"""
+
+    def __init__(self, msg):
+        super().__init__(msg)
+
+
+class ControlException(Exception):
+    """收到需要主循环处理的控制命令, 见 drcom.control"""
+
+    def __init__(self, msg):
+        super().__init__(msg)
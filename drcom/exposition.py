@@ -0,0 +1,149 @@
+"""以 OpenMetrics 文本格式暴露运行中会话的指标
+
+HTTP 服务运行在单独的线程中, 每次请求时从会话的快照渲染,
+不会阻塞 keepalive 循环. 只应监听本机地址.
+"""
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from threading import Thread
+
+from .session import STATES
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def renderOpenMetrics(sessions: dict) -> str:
+    """把 会话名 -> :meth:`DrcomSession.snapshot` 渲染为 OpenMetrics 文本"""
+    out = []
+    labels = {name: f'session="{escape(name)}"' for name in sessions}
+
+    out.append("# TYPE drcom_session_state stateset")
+    out.append("# HELP drcom_session_state 会话当前所处的阶段")
+    for name, snap in sessions.items():
+        for state in STATES:
+            value = 1 if snap["state"] == state else 0
+            out.append(f'drcom_session_state{{{labels[name]},drcom_session_state="{state}"}} {value}')
+
+    out.append("# TYPE drcom_server info")
+    out.append("# HELP drcom_server 当前使用的认证服务器")
+    for name, snap in sessions.items():
+        out.append(f'drcom_server_info{{{labels[name]},server="{escape(snap["server"])}"}} 1')
+
+    out.append("# TYPE drcom_rtt_seconds histogram")
+    out.append("# UNIT drcom_rtt_seconds seconds")
+    out.append("# HELP drcom_rtt_seconds 各阶段一次收发的往返时间")
+    for name, snap in sessions.items():
+        for phase, h in snap["rtt"].items():
+            prefix = f'drcom_rtt_seconds_bucket{{{labels[name]},phase="{phase}",le='
+            cumulative = 0
+            for bound, n in zip(h["bounds"], h["counts"]):
+                cumulative += n
+                out.append(f'{prefix}"{bound}"}} {cumulative}')
+            out.append(f'{prefix}"+Inf"}} {h["count"]}')
+            out.append(f'drcom_rtt_seconds_sum{{{labels[name]},phase="{phase}"}} {h["sum"]}')
+            out.append(f'drcom_rtt_seconds_count{{{labels[name]},phase="{phase}"}} {h["count"]}')
+
+    out.append("# TYPE drcom_errors counter")
+    out.append("# HELP drcom_errors 各种异常与超时的次数")
+    for name, snap in sessions.items():
+        for kind, n in snap["counters"].items():
+            out.append(f'drcom_errors_total{{{labels[name]},kind="{kind}"}} {n}')
+
+    out.append("# TYPE drcom_uptime_seconds gauge")
+    out.append("# UNIT drcom_uptime_seconds seconds")
+    for name, snap in sessions.items():
+        out.append(f'drcom_uptime_seconds{{{labels[name]}}} {snap["uptime"]}')
+
+    out.append("# TYPE drcom_since_last_keepalive_seconds gauge")
+    out.append("# UNIT drcom_since_last_keepalive_seconds seconds")
+    for name, snap in sessions.items():
+        if snap["since_last_keepalive"] is not None:
+            out.append(f'drcom_since_last_keepalive_seconds{{{labels[name]}}} '
+                       f'{snap["since_last_keepalive"]}')
+
+    out.append("# TYPE drcom_resolve counter")
+    out.append("# HELP drcom_resolve 认证服务器地址的解析次数, miss 为实际调用 getaddrinfo")
+    for name, snap in sessions.items():
+        resolve = snap["resolve"]
+        out.append(f'drcom_resolve_total{{{labels[name]},result="hit"}} {resolve["hits"]}')
+        out.append(f'drcom_resolve_total{{{labels[name]},result="miss"}} {resolve["misses"]}')
+
+    out.append("# TYPE drcom_resolve_seconds gauge")
+    out.append("# UNIT drcom_resolve_seconds seconds")
+    for name, snap in sessions.items():
+        out.append(f'drcom_resolve_seconds{{{labels[name]}}} {snap["resolve"]["seconds"]}')
+
+    out.append("# TYPE drcom_keepalive_drift_seconds summary")
+    out.append("# UNIT drcom_keepalive_drift_seconds seconds")
+    out.append("# HELP drcom_keepalive_drift_seconds keepalive 实际发出时间比计划时间晚的秒数")
+    for name, snap in sessions.items():
+        drift = snap["drift"]
+        out.append(f'drcom_keepalive_drift_seconds_count{{{labels[name]}}} {drift["count"]}')
+        out.append(f'drcom_keepalive_drift_seconds_sum{{{labels[name]}}} {drift["sum"]}')
+
+    out.append("# TYPE drcom_keepalive_drift_max_seconds gauge")
+    out.append("# UNIT drcom_keepalive_drift_max_seconds seconds")
+    for name, snap in sessions.items():
+        out.append(f'drcom_keepalive_drift_max_seconds{{{labels[name]}}} {snap["drift"]["max"]}')
+
+    out.append("# TYPE drcom_keepalive_drift_last_seconds gauge")
+    out.append("# UNIT drcom_keepalive_drift_last_seconds seconds")
+    for name, snap in sessions.items():
+        out.append(f'drcom_keepalive_drift_last_seconds{{{labels[name]}}} {snap["drift"]["last"]}')
+
+    out.append("# EOF")
+    return "\n".join(out) + "\n"
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """在后台线程中提供 /metrics
+
+    :param str host: 监听地址, 应当是 127.0.0.1 之类的本机地址
+    :param int port: 监听端口
+    :param snapshot: 无参函数, 返回 会话名 -> :meth:`DrcomSession.snapshot`
+    """
+
+    def __init__(self, host: str, port: int, snapshot):
+        self.snapshot = snapshot
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = renderOpenMetrics(server.snapshot()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # 不向终端输出访问日志
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.thread = Thread(target=self.httpd.serve_forever,
+                             name="drcom-metrics", daemon=True)
+
+    @property
+    def address(self) -> tuple:
+        return self.httpd.server_address
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,12 +1,12 @@
-import sqlite3 as s
-from os import remove
+import sys
+from atexit import register as atexit
 from pathlib import Path
-from tempfile import gettempdir
-from time import localtime, mktime, strftime, strptime, time
+from time import localtime, mktime, monotonic, strftime, strptime, time
 from binascii import hexlify
-from threading import Thread
 
-import json
+# sqlite3, queue 与 threading 的导入耗时与 drcom 其余部分相当,
+# 只在第一次用到时导入, drcom log 等短命令不需要后台线程
+Empty = Full = Queue = Thread = None
 
 TABLE_NAME = "log"
 # 一天的秒数
@@ -41,13 +41,15 @@ class Message:
         self.msg = msg
         self.data = data
 
-    @property
-    def sql(self) -> str:
-        return f"""INSERT INTO {TABLE_NAME} (time, level, msg, data)
+    sql = f"""INSERT INTO {TABLE_NAME} (time, level, msg, data)
         VALUES (?, ?, ?, ?);"""
 
-    def store(self, cursor: s.Cursor):
-        cursor.execute(self.sql, (self.time, self.level, self.msg, self.data))
+    @property
+    def row(self) -> tuple:
+        return (self.time, self.level, self.msg, self.data)
+
+    def store(self, cursor: "sqlite3.Cursor"):
+        cursor.execute(self.sql, self.row)
 
     def terminal(self, **kw):
         """格式化字符串, 输出至终端的格式
@@ -88,27 +90,78 @@ class Message:
         )
 
 
+def importWriterModules():
+    """导入 :class:`LogWriter` 的后台线程需要的模块"""
+    global Empty, Full, Queue, Thread
+    if Thread is None:
+        from queue import Empty, Full, Queue
+        from threading import Thread
+
+
 class Logger:
     def __init__(self, max_keep: float = None, database: str = None):
         """
         :param float max_keep: 日志最大保存期限，参数应当是 Unix 时间戳
-        :param str database: 日志文件路径
+        :param str database: 日志数据库 (SQLite) 路径
 
         如果留空或者传入 None， max_keep 会使用默认值 7 天，database
-        则是 {临时目录}/drcom/log/drcom-log.log
+        则是 {临时目录}/drcom/log/drcom-log.db
         """
         # 7 天
         self.max_keep = float(604800) if max_keep is None else max_keep
-        self.database = str(Path(gettempdir()) / "drcom" / "log" /
-                            "drcom-log.log") if database is None else database
+        if database is None:
+            from tempfile import gettempdir
+            database = str(Path(gettempdir()) / "drcom" / "log" / "drcom-log.db")
+        self.database = database
+
+    def connect(self) -> "sqlite3.Connection":
+        """打开日志数据库, 必要时建表
+
+        使用 WAL 模式, 读取日志时不会阻塞写入.
+        """
+        import sqlite3
+        Path(self.database).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.database)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute(f"""CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+            time REAL NOT NULL,
+            level INTEGER NOT NULL,
+            msg TEXT NOT NULL,
+            data BLOB
+        );""")
+        conn.execute(f"""CREATE INDEX IF NOT EXISTS {TABLE_NAME}_time_level
+            ON {TABLE_NAME} (time, level);""")
+        return conn
+
+    def connectReadOnly(self) -> "sqlite3.Connection":
+        """只读打开日志数据库, 不建表, 不修改日志模式, 也不创建目录"""
+        import sqlite3
+        uri = Path(self.database).absolute().as_uri() + "?mode=ro"
+        return sqlite3.connect(uri, uri=True)
+
+    def clean(self):
+        """删除超过 max_keep 的日志"""
+        conn = self.connect()
+        with conn:
+            conn.execute(f"DELETE FROM {TABLE_NAME} WHERE time < ?;",
+                         (time() - self.max_keep, ))
+        conn.execute("VACUUM;")
+        conn.close()
 
 
 class LogWriter(Logger):
     """SQL Logger
 
-    将日志记录在终端中打印，且存储文本文件中。文件存储为 [temp]/drcom/log/drcom-log.log,
+    将日志记录在终端中打印，且存储在 SQLite 数据库中。文件存储为 [temp]/drcom/log/drcom-log.db,
 
     :param int level: 最低日志记录等级，只有高于此等级的事件才会被记录。默认为 10
+    :param int batch_size: 攒够多少条记录后写入一次
+    :param float flush_interval: 最多间隔多少秒写入一次
+    :param int queue_size: 队列长度上限, 队列满时丢弃新的记录并计数
+
+    :meth:`record` 只把记录放入队列, 格式化与读写文件都在后台线程中完成,
+    网络循环不会等待文件系统.
 
     各方法的等级依次为：
 
@@ -121,16 +174,91 @@ class LogWriter(Logger):
         error,40
     """
 
-    def __init__(self, level=LEVEL_DEBUG, max_keep=None, database=None):
+    def __init__(self, level=LEVEL_DEBUG, max_keep=None, database=None,
+                 batch_size=64, flush_interval=1.0, queue_size=4096):
         super().__init__(max_keep, database)
+        importWriterModules()
         self.level = level
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = Queue(queue_size)
+        self.dropped = 0    # 因队列已满而丢弃的记录数
+        self.thread = None  # 第一次记录时启动
+        self.conn = None    # 在后台线程中打开
+
+    def start(self):
+        """启动后台写入线程"""
+        self.thread = Thread(target=self.writeLoop,
+                             name="drcom-log", daemon=True)
+        self.thread.start()
+        atexit(self.close)
+
+    def close(self):
+        """写完队列中剩余的记录后停止后台线程"""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
 
     def record(self, msg: str, data: bytes, level: int):
         if level >= self.level:
-            m = Message(time(), level, msg, data)
-            print(m.terminal(color=True, data=False))
-            with open(self.database, "at", encoding="utf-8") as log:
-                print(m.terminal(color=False, data=True), file=log)
+            if self.thread is None:
+                self.start()
+            # data 可能是会被复用的缓冲区, 需要复制
+            m = Message(time(), level, msg, bytes(data))
+            try:
+                self.queue.put_nowait(m)
+            except Full:
+                self.dropped += 1
+
+    def writeLoop(self):
+        """后台线程: 攒够 batch_size 条或超过 flush_interval 秒后写入一次"""
+        reported = 0
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - monotonic())
+            try:
+                m = self.queue.get(timeout=timeout)
+            except Empty:
+                # 超时, 写入已攒下的记录; None 表示停止
+                m = False
+            if m:
+                batch.append(m)
+                if deadline is None:
+                    deadline = monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+            if self.dropped != reported:
+                batch.append(Message(time(), LEVEL_WARN,
+                                     f"{self.dropped - reported} records dropped", b""))
+                reported = self.dropped
+            if batch:
+                self.write(batch)
+                batch = []
+                deadline = None
+            if m is None:
+                break
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def write(self, batch: list):
+        """把一批记录输出到终端, 并在一个事务中写入数据库"""
+        import sqlite3
+        sys.stdout.write("".join(
+            m.terminal(color=True, data=False) + "\n" for m in batch))
+        sys.stdout.flush()
+        try:
+            if self.conn is None:
+                self.conn = self.connect()
+            with self.conn:
+                self.conn.executemany(Message.sql, [m.row for m in batch])
+        except sqlite3.Error:
+            self.dropped += len(batch)
+
+    def bind(self, name: str) -> "BoundLogger":
+        """返回在每条记录前加上 name 的视图, 见 :class:`BoundLogger`"""
+        return BoundLogger(self, name)
 
     def verbose(self, msg: str, data: bytes):
         self.record(msg, data, LEVEL_VERBOSE)
@@ -146,3 +274,99 @@ class LogWriter(Logger):
 
     def error(self, msg: str, data: bytes):
         self.record(msg, data, LEVEL_ERROR)
+
+
+class BoundLogger:
+    """共用一个 :class:`LogWriter` 的会话各自的记录器
+
+    每条记录的 msg 前加上 ``[name]``, 多个账号写入同一个日志时可以区分.
+
+    :param LogWriter writer: 实际写入的记录器
+    :param str name: 会话名, 一般为账号
+    """
+
+    def __init__(self, writer: LogWriter, name: str):
+        self.writer = writer
+        self.name = name
+
+    @property
+    def level(self) -> int:
+        return self.writer.level
+
+    @level.setter
+    def level(self, value: int):
+        self.writer.level = value
+
+    def bind(self, name: str) -> "BoundLogger":
+        return BoundLogger(self.writer, name)
+
+    def record(self, msg: str, data: bytes, level: int):
+        if level >= self.writer.level:
+            self.writer.record(f"[{self.name}] {msg}", data, level)
+
+    def verbose(self, msg: str, data: bytes):
+        self.record(msg, data, LEVEL_VERBOSE)
+
+    def debug(self, msg: str, data: bytes):
+        self.record(msg, data, LEVEL_DEBUG)
+
+    def info(self, msg: str, data: bytes):
+        self.record(msg, data, LEVEL_INFO)
+
+    def warn(self, msg: str, data: bytes):
+        self.record(msg, data, LEVEL_WARN)
+
+    def error(self, msg: str, data: bytes):
+        self.record(msg, data, LEVEL_ERROR)
+
+
+class LogReader(Logger):
+    """读取某一天的日志
+
+    :param str date: 日期, 格式为 YYYY-MM-DD
+    :param int level: 最低日志等级
+    :param float max_keep: 同 :class:`Logger`
+    :param str database: 同 :class:`Logger`
+
+    按 (time, level) 索引做范围查询, 不会扫描整个数据库.
+    """
+
+    def __init__(self, date: str, level: int = LEVEL_DEBUG,
+                 max_keep: float = None, database: str = None):
+        super().__init__(max_keep, database)
+        self.start = mktime(strptime(date, "%Y-%m-%d"))
+        self.end = self.start + SECs_ONE_DAY
+        self.level = level
+
+    def iter(self):
+        """按时间顺序逐条产生 :class:`Message`
+
+        数据库不存在, 没有日志表, 不是 SQLite 数据库, 或者是只读目录中缺少 -shm 文件的
+        WAL 数据库时什么也不产生.
+        """
+        import sqlite3
+        if not Path(self.database).exists():
+            return
+        try:
+            conn = self.connectReadOnly()
+        except sqlite3.DatabaseError:
+            return
+        try:
+            cursor = conn.execute(
+                f"""SELECT time, level, msg, data FROM {TABLE_NAME}
+                WHERE time >= ? AND time < ? AND level >= ?
+                ORDER BY time;""",
+                (self.start, self.end, self.level))
+            for row in cursor:
+                yield Message(*row)
+        except sqlite3.DatabaseError:
+            return
+        finally:
+            conn.close()
+
+    def to_csv(self, file: Path):
+        """将日志逐条写入 CSV 文件"""
+        with file.open("wt", encoding="utf-8") as csv:
+            for m in self.iter():
+                csv.write(m.to_csv())
+                csv.write("\n")
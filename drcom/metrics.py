@@ -0,0 +1,200 @@
+"""进程内的指标
+
+每个会话一个 :class:`MetricsRegistry`, 记录
+
+-   各阶段收发的 RTT 直方图
+-   各种异常与超时的计数
+-   距离上一次成功 keepalive 的时间
+
+更新一个指标只是几次整数运算, 可以放在热路径上.
+:class:`StatsDumper` 在后台线程中定期把快照写成 JSON, 供 ``drcom stats`` 读取.
+"""
+
+import json
+import os
+from bisect import bisect_left
+from pathlib import Path
+from tempfile import gettempdir, mkstemp
+from threading import Event, Thread
+from time import monotonic, time
+
+PHASES = ("challenge", "login", "keepAlive1", "keepAlive2", "keepAliveStable")
+COUNTERS = ("ChallengeException", "LoginException", "KeepAliveException", "timeout",
+            "retransmit", "hedge", "failover")
+
+# RTT 直方图的桶上界, 单位为秒; 最后还有一个 +Inf 桶
+RTT_BOUNDS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05,
+              0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+class Histogram:
+    """固定分桶的直方图"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=RTT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """按桶估计分位数, 返回所在桶的上界"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.bounds, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self) -> dict:
+        return {
+            "bounds": list(self.bounds),
+            "counts": list(self.counts),
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+
+class MetricsRegistry:
+    """一个会话的全部指标
+
+    :attr rtt: 阶段名 -> :class:`Histogram`
+    :attr counters: 计数器名 -> int
+    :attr last_keepalive: 上一次成功 keepalive 的 monotonic 时间, 尚未成功时为 None
+    :attr last_keepalive_time: 同一时刻的 Unix 时间, 供其他进程读取
+    :attr last_rtt: 最近一次收发的往返秒数
+    """
+
+    def __init__(self):
+        self.rtt = {i: Histogram() for i in PHASES}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.last_keepalive = None
+        self.last_keepalive_time = None
+        self.last_rtt = None
+        self.started = monotonic()
+
+    def observe(self, phase: str, rtt: float):
+        self.rtt[phase].observe(rtt)
+        self.last_rtt = rtt
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def keepAliveOK(self):
+        self.last_keepalive = monotonic()
+        self.last_keepalive_time = time()
+
+    def snapshot(self) -> dict:
+        now = monotonic()
+        since = None if self.last_keepalive is None else now - self.last_keepalive
+        return {
+            "rtt": {k: v.snapshot() for k, v in self.rtt.items()},
+            "counters": dict(self.counters),
+            "since_last_keepalive": since,
+            "uptime": now - self.started,
+        }
+
+
+def defaultStatsPath() -> str:
+    return str(Path(gettempdir()) / "drcom" / "stats.json")
+
+
+def writeJSON(path: Path, obj, mode: int = 0o644):
+    """先写临时文件再替换, 读取方不会看到写了一半的文件
+
+    临时文件由 mkstemp 以随机的名字独占地建立, 不会跟随预先放置的符号链接;
+    写入或替换失败时删除临时文件.
+
+    :param int mode: 文件的权限, 含有密钥的文件应为 0o600
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = mkstemp(prefix=path.name + ".", suffix=".tmp", dir=str(path.parent))
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(obj))
+        if mode != 0o600:
+            # mkstemp 建立的文件为 0o600
+            os.chmod(tmp, mode)
+        os.replace(tmp, str(path))
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class StatsDumper:
+    """后台线程, 每隔 interval 秒把快照写入 path
+
+    :param str path: JSON 文件路径, 留空则为 {临时目录}/drcom/stats.json
+    :param snapshot: 无参函数, 返回 会话名 -> :meth:`MetricsRegistry.snapshot`
+    :param float interval: 写入间隔秒数
+
+    snapshot 在后台线程中调用, 不能在其中遍历可能被网络循环同时修改的容器.
+    """
+
+    def __init__(self, path: str, snapshot, interval: float = 5.0):
+        self.path = Path(defaultStatsPath() if path is None else path)
+        self.snapshot = snapshot
+        self.interval = interval
+        self.stopped = Event()
+        self.thread = Thread(target=self.loop, name="drcom-stats", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        """停止后台线程, 等待它写完最后一次快照"""
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def dump(self):
+        try:
+            writeJSON(self.path, {"time": time(), "sessions": self.snapshot()})
+        except OSError:
+            pass
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+        self.dump()
+
+
+def formatStats(stats: dict) -> str:
+    """把 stats.json 的内容格式化为终端输出"""
+    lines = []
+    age = time() - stats["time"]
+    lines.append(f"snapshot taken {age:.1f} s ago")
+    for name, session in stats["sessions"].items():
+        since = session["since_last_keepalive"]
+        since = "never" if since is None else f"{since + age:.1f} s ago"
+        lines.append("")
+        lines.append(f"[{name}] uptime {session['uptime'] + age:.0f} s, "
+                     f"last keepalive {since}")
+        lines.append(f"  {'phase':16}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for phase, snap in session["rtt"].items():
+            h = Histogram(tuple(snap["bounds"]))
+            h.counts, h.sum, h.count = snap["counts"], snap["sum"], snap["count"]
+            mean = h.sum / h.count * 1e3 if h.count else 0.0
+            lines.append(f"  {phase:16}{h.count:8}{mean:10.2f}"
+                         f"{h.quantile(0.5) * 1e3:10.2f}{h.quantile(0.99) * 1e3:10.2f}")
+        lines.append("  " + ", ".join(f"{k}={v}" for k, v in session["counters"].items()))
+        if "resolve" in session:
+            resolve = session["resolve"]
+            lines.append(f"  resolve hits={resolve['hits']}, misses={resolve['misses']}, "
+                         f"last {resolve['seconds'] * 1e3:.2f} ms")
+        if "drift" in session:
+            drift = session["drift"]
+            lines.append(f"  keepalive drift count={drift['count']}, "
+                         f"mean {drift['mean'] * 1e3:.2f} ms, max {drift['max'] * 1e3:.2f} ms, "
+                         f"last {drift['last'] * 1e3:.2f} ms")
+    return "\n".join(lines)
@@ -0,0 +1,72 @@
+"""本地的 Drcom 认证服务端替身
+
+只实现 :class:`drcom.app.DrcomApp` 用到的交互, 不做任何校验, 用于压力测试:
+
+-   challenge   0x01 → 0x02
+-   login       0x03 → 0x04
+-   keepAlive1  0xff → 0x07
+-   keepAlive2 / keepAliveStable    0x07 → 0x07
+-   logout      0x06 → 0x04
+"""
+
+import asyncio
+import os
+
+
+class MockDrcomProtocol(asyncio.DatagramProtocol):
+    """按客户端地址保存 SALT 与 tail, 回应各阶段的包"""
+
+    def __init__(self):
+        self.transport = None
+        self.clients = {}   # addr -> (SALT, tail)
+        self.received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        code = data[:1]
+        if code == b'\x01':
+            salt = os.urandom(4)
+            self.clients[addr] = (salt, os.urandom(4))
+            reply = b'\x02' + data[1:4] + salt + b'\x00' * 12
+        elif code == b'\x03':
+            reply = b'\x04\x00\x00\x05' + b'\x00' * 19 + os.urandom(16) + b'\x00' * 10
+        elif code == b'\xff':
+            reply = b'\x07' + b'\x00' * 39
+        elif code == b'\x07' and len(data) >= 6:
+            _, tail = self.clients.get(addr, (None, b'\x00' * 4))
+            reply = bytearray(40)
+            reply[0:6] = b'\x07' + data[1:2] + b'\x28\x00\x0b' + bytes([data[5] + 1])
+            reply[16:20] = tail
+        elif code == b'\x06':
+            self.clients.pop(addr, None)
+            reply = b'\x04' + b'\x00' * 15
+        else:
+            return
+        self.transport.sendto(reply, addr)
+
+
+async def serveMock(host: str = "127.0.0.1", port: int = 61440, ready=None):
+    """运行替身服务端, 直到被取消
+
+    :param ready: 绑定端口之后调用 ready.set(), 如 multiprocessing.Event
+    """
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        MockDrcomProtocol, local_addr=(host, port))
+    if ready is not None:
+        ready.set()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+
+
+def runMock(host: str = "127.0.0.1", port: int = 61440, ready=None):
+    """阻塞运行替身服务端, 可作为子进程的入口, ready 见 :func:`serveMock`"""
+    try:
+        asyncio.run(serveMock(host, port, ready))
+    except KeyboardInterrupt:
+        pass
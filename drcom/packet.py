@@ -0,0 +1,266 @@
+"""预先排布好的数据包模板
+
+与 SALT 无关的字段只在模板建立时写入一次, 之后每次发送只修补变化的部分.
+"""
+
+from hashlib import md5
+
+from .account import Account, fixedStr, packIP
+from .utils import checksum, ror
+
+
+class LoginTemplate:
+    """login 包模板
+
+    按 ``_tagLoginPacket`` / ``_tagHostInfo`` / ``_tagOSVersionInfo`` 排布一次,
+    :meth:`render` 只修补依赖 SALT 的字段:
+
+    -   PasswordMd5
+    -   MacAddrXORPasswordMD5
+    -   PasswordMd5_2
+    -   HalfMD5
+    -   _tagLDAPAuth.Password (ROR_VERSION)
+    -   _tagDrcomAuthExtData.CRC
+
+    :param Account account: 读取预先编码的账号, 主机信息与 core 参数
+    """
+
+    def __init__(self, account: Account):
+        self.password = account.password_bytes
+        self.mac = account.mac
+        self.ror = account.ROR_VERSION
+        # md5(b'\x01' + password + SALT + b'\x00' * 4) 的公共前缀
+        self.md5_2 = md5(b'\x01' + self.password)
+
+        buf = bytearray()
+        """
+        struct  _tagLoginPacket {
+            struct _tagDrCOMHeader Header;
+            unsigned char PasswordMd5[MD5_LEN];
+            char Account[ACCOUNT_MAX_LEN];
+            unsigned char ControlCheckStatus;
+            unsigned char AdapterNum;
+            unsigned char MacAddrXORPasswordMD5[MAC_LEN];
+            unsigned char PasswordMd5_2[MD5_LEN];
+            unsigned char HostIpNum;
+            unsigned int HostIPList[HOST_MAX_IP_NUM];
+            unsigned char HalfMD5[8];
+            unsigned char DogFlag;
+            unsigned int unkown2;
+            struct _tagHostInfo HostInfo;
+            unsigned char ClientVerInfoAndInternetMode;
+            unsigned char DogVersion;
+        };
+        """
+        # _tagLoginPacket.Header
+        buf += b'\x03\x01\x00' + bytes([len(account.username) + 20])
+        # _tagLoginPacket.PasswordMD5
+        self.md5_1_at = len(buf)
+        buf += b'\x00' * 16
+        # _tagLoginPacket.Account
+        buf += account.account_bytes
+        # _tagLoginPacket.ControlCheckStatus
+        buf += account.CONTROL_CHECK_STATUS
+        # _tagLoginPacket.AdapterNum
+        buf += account.ADAPTER_NUM
+        # _tagLoginPacket.MacAddrXORPasswordMD5
+        self.mac_xor_at = len(buf)
+        buf += b'\x00' * 6
+        # _tagLoginPacket.PasswordMD5_2
+        self.md5_2_at = len(buf)
+        buf += b'\x00' * 16
+        # _tagLoginPacket.HostIpNum
+        buf += b'\x01'
+        # _tagLoginPacket.HostIPList
+        buf += account.host_ip_bytes
+        buf += b'\x00' * 12
+        # _tagLoginPacket.HalfMD5 [8]
+        self.half_md5_at = len(buf)
+        buf += b'\x00' * 8
+        # _tagLoginPacket.DogFlag
+        buf += account.IP_DOG
+        # _tagLoginPacket.unkown2
+        buf += b'\x00' * 4
+        """
+        struct  _tagHostInfo {
+            char HostName[HOST_NAME_MAX_LEN];
+            unsigned int DNSIP1;
+            unsigned int DHCPServerIP;
+            unsigned int DNSIP2;
+            unsigned int WINSIP1;
+            unsigned int WINSIP2;
+            struct _tagOSVersionInfo OSVersion;
+        };
+        """
+        # _tagHostInfo.HostName
+        buf += account.host_name_bytes
+        # _tagHostInfo.DNSIP1
+        buf += account.dns_bytes
+        # _tagHostInfo.DHCPServerIP
+        buf += account.dhcp_bytes
+        # _tagHostInfo.DNSIP2, WINSIP1, WINSIP2
+        buf += b'\x00' * 12
+        """
+        struct  _tagOSVersionInfo {
+            unsigned int OSVersionInfoSize;
+            unsigned int MajorVersion;
+            unsigned int MinorVersion;
+            unsigned int BuildNumber;
+            unsigned int PlatformID;
+            char ServicePack[128];
+        };
+        """
+        # OSVersionInfoSize, MajorVersion, MinorVersion, BuildNumber, PlatformID
+        buf += b'\x94\x00\x00\x00' b'\x05\x00\x00\x00' b'\x01\x00\x00\x00' \
+            b'\x28\x0A\x00\x00' b'\x02\x00\x00\x00'
+        # _tagOSVersionInfo.ServicePack
+        buf += account.host_os_bytes
+        buf += b'\x00' * 96
+        buf += account.AUTH_VERSION
+        if self.ror:
+            """
+            struct _tagLDAPAuth {
+                unsigned char Code;
+                unsigned char PasswordLen;
+                unsigned char Password[MD5_LEN];
+            }
+            """
+            # _tagLDAPAuth.Code, _tagLDAPAuth.PasswordLen
+            buf += b'\x00' + bytes([len(self.password)])
+            # _tagLDAPAuth.Password
+            self.ror_at = len(buf)
+            buf += b'\x00' * len(self.password)
+        """
+        struct  _tagDrcomAuthExtData {
+            unsigned char Code;
+            unsigned char Len;
+            unsigned long CRC;
+            unsigned short Option;
+            unsigned char AdapterAddress[MAC_LEN];
+        };
+        """
+        # _tagDrcomAuthExtData.Code, _tagDrcomAuthExtData.Len
+        buf += b'\x02\x0c'
+        # _tagDrcomAuthExtData.CRC
+        self.crc_at = len(buf)
+        buf += b'\x00' * 4
+        # _tagDrcomAuthExtData.Option
+        buf += b'\x00\x00'
+        # _tagDrcomAuthExtData.AdapterAddress
+        buf += account.mac_bytes
+        # auto logout / default: False
+        # broadcast mode / default: False
+        # unknown, 随机填充的
+        buf += b'\x00\x00\xe9\x13'
+
+        self.buffer = buf
+        self.view = memoryview(buf)
+
+    def render(self, salt: bytes) -> bytearray:
+        """用 SALT 修补模板
+
+        返回的是模板自身的缓冲区, 只在下一次调用 render 之前有效.
+
+        :param bytes salt: challenge 阶段得到的 SALT
+        """
+        salt = bytes(salt)
+        buf = self.buffer
+        view = self.view
+
+        md5_1 = md5(b'\x03\x01' + salt + self.password).digest()
+        i = self.md5_1_at
+        buf[i:i + 16] = md5_1
+
+        i = self.mac_xor_at
+        buf[i:i + 6] = (int.from_bytes(md5_1[:6], "big") ^ self.mac).to_bytes(6, "big")
+
+        h = self.md5_2.copy()
+        h.update(salt + b'\x00' * 4)
+        i = self.md5_2_at
+        buf[i:i + 16] = h.digest()
+
+        i = self.half_md5_at
+        h = md5(view[:i])
+        h.update(b'\x14\x00\x07\x0B')
+        buf[i:i + 8] = h.digest()[:8]
+
+        if self.ror:
+            i = self.ror_at
+            buf[i:i + len(self.password)] = ror(md5_1, self.password)
+
+        # CRC 的输入是 CRC 之前的数据 + 01 26 07 11 00 00 + MAC,
+        # 其中 00 00 + MAC 正好与模板中 Option, AdapterAddress 的内容一致
+        i = self.crc_at
+        buf[i:i + 4] = b'\x01\x26\x07\x11'
+        buf[i:i + 4] = checksum(view[:i + 12])
+        return buf
+
+
+class KeepAliveTemplate:
+    """keepalive 包模板
+
+    缓存 (type 1, first), (type 1), (type 3) 三种 40 字节的包,
+    :meth:`render` 只修补 srv_num 与 tail, 不产生新的对象.
+
+    :param Account account: 读取 KEEP_ALIVE_VERSION 与 host_ip
+    """
+
+    SRV_NUM_AT = 1
+
+    FIRST_VERSION = b'\x0f\x27'
+
+    def __init__(self, account: Account):
+        # memoryview 可以直接写入底层的 bytearray
+        self.first = memoryview(self.layout(1, self.FIRST_VERSION, account))
+        self.type1 = memoryview(self.layout(1, account.KEEP_ALIVE_VERSION, account))
+        self.type3 = memoryview(self.layout(3, account.KEEP_ALIVE_VERSION, account))
+        # first 的版本号固定为 2 字节, 与 KEEP_ALIVE_VERSION 的长度无关
+        self.first_tail_at = self.tailAt(self.FIRST_VERSION)
+        self.tail_at = self.tailAt(account.KEEP_ALIVE_VERSION)
+
+    @staticmethod
+    def tailAt(version: bytes) -> int:
+        """tail 的偏移: 6 字节的头部, 版本号, 8 字节的 2f 12 00 ..."""
+        return 6 + len(version) + 8
+
+    @staticmethod
+    def layout(type_: int, version: bytes, account: Account) -> bytearray:
+        buf = bytearray()
+        buf += b'\x07\x00\x28\x00\x0b' + bytes([type_])
+        buf += version
+        buf += b'\x2f\x12\x00\x00\x00\x00\x00\x00'
+        # tail
+        buf += b'\x00\x00\x00\x00'
+        buf += b'\x00\x00\x00\x00'
+        if type_ == 3:
+            buf += b'\x00\x00\x00\x00'
+            buf += account.host_ip_bytes
+            buf += b'\x00' * 8
+        else:
+            buf += b'\x00' * 16
+        return buf
+
+    def render(self, type_: int, first: bool, srv_num: int, tail: bytes) -> memoryview:
+        """修补并返回对应的模板
+
+        返回的是模板自身的缓冲区, 只在下一次修补同一种包之前有效.
+
+        :param int type_: 1 或 3
+        :param bool first: 是否为 keepAlive2 的第一个包
+        :param int srv_num: 包序号
+        :param bytes tail: 上一个回应中的 tail, 4 字节
+        """
+        i = self.tail_at
+        if first:
+            buf = self.first
+            i = self.first_tail_at
+        elif type_ == 3:
+            buf = self.type3
+        else:
+            buf = self.type1
+        buf[self.SRV_NUM_AT] = srv_num
+        if len(tail) != 4:
+            # 服务端的回应过短, 按 0 补齐
+            tail = bytes(tail[:4]).ljust(4, b'\x00')
+        buf[i:i + 4] = tail
+        return buf
@@ -0,0 +1,147 @@
+"""配置文件的热加载
+
+运行中修改 drcom.toml 后:
+
+-   [application] 中的重试间隔, 日志等级, 解析缓存时间等直接写入会话共用的字典, 立即生效;
+    RESTART_KEYS 中的值只在启动时读取, 需要重启 drcom
+-   只有 keep_alive_interval 变化的账号直接替换账号记录, 不产生网络流量
+-   账号或 core 参数变化的会话重新登录, 新增的账号开始运行, 删除的账号注销
+
+Linux 上用 inotify 监视配置文件所在的目录 (编辑器常常先写临时文件再改名),
+其他平台每隔 RELOAD_POLL 秒比较一次文件的 stat.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+from .config import DrcomConfig
+
+# 轮询文件 stat 的间隔秒数
+RELOAD_POLL = 2.0
+# 收到 inotify 事件后等待编辑器写完的秒数
+RELOAD_SETTLE = 0.2
+
+# 只在启动时读取, 修改后需要重启 drcom 才能生效
+RESTART_KEYS = ("bind_ip", "log_path", "log_max_keep", "stats_path",
+                "metrics_host", "metrics_port", "control_path",
+                "board_path", "reload")
+
+IN_CLOSE_WRITE = 0x08
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+
+
+def inotifyWatch(directory: Path) -> int:
+    """监视 directory 中文件的写入与改名
+
+    :returns: 非阻塞的 inotify 文件描述符, 平台不支持时返回 None
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(str(directory)), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class ConfigWatcher:
+    """判断配置文件是否被修改
+
+    :param Path path: 配置文件
+    :param float interval: 没有 inotify 时轮询的间隔秒数
+    """
+
+    def __init__(self, path: Path, interval: float = RELOAD_POLL):
+        self.path = Path(path)
+        self.interval = interval
+        self.last = self.fingerprint()
+        self.fd = inotifyWatch(self.path.absolute().parent)
+
+    def fingerprint(self) -> tuple:
+        try:
+            stat = os.stat(str(self.path))
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def changed(self) -> bool:
+        """文件是否与上一次检查时不同
+
+        有 inotify 时, 没有事件就不必 stat; 文件暂时不存在 (改名的中途) 时不算变化.
+        """
+        if self.fd is not None:
+            events = False
+            try:
+                while os.read(self.fd, 4096):
+                    events = True
+            except BlockingIOError:
+                pass
+            if not events:
+                return False
+        current = self.fingerprint()
+        if current is None or current == self.last:
+            return False
+        self.last = current
+        return True
+
+    async def wait(self):
+        """等待到文件被修改, 供异步引擎使用"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.fd is None:
+                await asyncio.sleep(self.interval)
+            else:
+                readable = asyncio.Event()
+                loop.add_reader(self.fd, readable.set)
+                try:
+                    await readable.wait()
+                finally:
+                    loop.remove_reader(self.fd)
+                await asyncio.sleep(RELOAD_SETTLE)
+            if self.changed():
+                return
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def loadAccounts(path: Path, logger) -> tuple:
+    """重新读取配置文件并编译账号
+
+    :returns: (DrcomConfig, Account 的列表), 文件有错误时记录日志并返回 None,
+        调用方继续使用原来的配置
+    """
+    try:
+        config = DrcomConfig().load(path)
+        return config, config.accounts()
+    except (OSError, KeyError, ValueError) as e:
+        logger.warn(f"reload {path} failed, keep running: {e}", b"")
+        return None
+
+
+def applyConfig(current: DrcomConfig, new: DrcomConfig, logger):
+    """把重新加载的 new 合并进运行中的 current
+
+    会话读取的是 current 中的同一个 application 字典, 原地更新即可生效;
+    RESTART_KEYS 中的值保持不变. 其余的表直接替换, 账号由调用方逐个比较.
+    """
+    application = current["application"]
+    pending = [i for i in RESTART_KEYS if application.get(i) != new["application"].get(i)]
+    if pending:
+        logger.warn(f"{', '.join(pending)} changed, restart drcom to apply", b"")
+    application.update((k, v) for k, v in new["application"].items() if k not in RESTART_KEYS)
+    for table in ("drcom", "core", "accounts"):
+        current.data[table] = new.data[table]
@@ -0,0 +1,76 @@
+"""认证服务器地址的解析与缓存
+
+配置中的 server 可以是主机名. 解析结果缓存 ttl 秒, 过期后在下一次登录前刷新;
+刷新失败时继续使用旧地址, 不因 DNS 故障中断已经建立的会话.
+"""
+
+import socket
+from time import monotonic
+
+# 解析结果的缓存时间, 单位为秒
+RESOLVE_TTL = 300
+
+
+class ServerResolver:
+    """解析并缓存一个认证服务器的 IPv4 地址
+
+    :param str host: 主机名或 IP 地址
+    :param int port: 端口
+    :param float ttl: 缓存时间
+    :param LogWriter logger: 记录每次解析的耗时, 可以留空
+
+    :attr address: (ip, port), 尚未解析时为 None
+    :attr hits: 命中缓存的次数
+    :attr misses: 实际解析的次数
+    :attr elapsed: 最近一次解析的耗时秒数
+    """
+
+    def __init__(self, host: str, port: int, ttl: float = RESOLVE_TTL, logger=None):
+        self.host = host
+        self.port = port
+        self.ttl = ttl
+        self.logger = logger
+        self.address = None
+        self.expires = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.elapsed = 0.0
+
+    def fresh(self) -> bool:
+        return self.address is not None and monotonic() < self.expires
+
+    def get(self) -> tuple:
+        """返回缓存的地址, 过期时重新解析"""
+        if self.fresh():
+            self.hits += 1
+            return self.address
+        return self.resolve()
+
+    def resolve(self) -> tuple:
+        """调用 getaddrinfo 解析地址
+
+        :raises socket.gaierror: 解析失败, 且没有可以继续使用的旧地址
+        """
+        start = monotonic()
+        self.misses += 1
+        try:
+            info = socket.getaddrinfo(self.host, self.port,
+                                      socket.AF_INET, socket.SOCK_DGRAM)
+        except socket.gaierror as e:
+            if self.address is None:
+                raise
+            # 继续使用旧地址, 一个 ttl 后再试
+            self.expires = monotonic() + self.ttl
+            if self.logger is not None:
+                self.logger.warn(f"resolve {self.host} failed, keep {self.address[0]}: {e}", b"")
+            return self.address
+        self.address = info[0][4][:2]
+        self.elapsed = monotonic() - start
+        self.expires = monotonic() + self.ttl
+        if self.logger is not None:
+            self.logger.info(f"resolved {self.host} -> {self.address[0]} "
+                             f"in {self.elapsed * 1e3:.2f} ms", b"")
+        return self.address
+
+    def snapshot(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "seconds": self.elapsed}
@@ -0,0 +1,173 @@
+"""keepalive 调度
+
+所有截止时间都基于 ``time.monotonic()``, 不受系统时间调整影响.
+:class:`TimerWheel` 是一个哈希时间轮, 插入与到期都是 O(1),
+一个线程 (或一个事件循环) 可以为成千上万个会话调度 keepalive.
+:class:`RttEstimator` 根据往返时间决定重传超时.
+"""
+
+from time import monotonic
+
+# 重传超时的初值与上下限, 单位为秒
+RTO_INITIAL = 1.0
+RTO_MIN = 0.2
+RTO_MAX = 10.0
+
+
+class DriftStats:
+    """记录定时器实际触发时间比截止时间晚了多少秒"""
+
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, late: float):
+        self.count += 1
+        self.total += late
+        self.last = late
+        if late > self.max:
+            self.max = late
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "mean": self.mean,
+            "max": self.max,
+            "last": self.last,
+        }
+
+
+class RttEstimator:
+    """往返时间估计 (Jacobson/Karels, 即 RFC 6298 的算法)
+
+    :attr srtt: 平滑后的 RTT, 尚无样本时为 None
+    :attr rttvar: RTT 的平均偏差
+    :attr rto: 当前的重传超时
+    """
+
+    __slots__ = ("srtt", "rttvar", "rto")
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = RTO_INITIAL
+
+    def observe(self, rtt: float):
+        """加入一个样本, 重传过的请求不应计入 (Karn 算法)"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.rto = min(max(self.srtt + self.K * self.rttvar, RTO_MIN), RTO_MAX)
+
+    def backoff(self):
+        """超时后把 RTO 加倍"""
+        self.rto = min(self.rto * 2, RTO_MAX)
+
+    def hedgeDelay(self) -> float:
+        """估计 RTT 的 p95, 超过它仍未收到回应时发送冗余请求
+
+        用 srtt + 2 * rttvar 近似, 尚无样本时取 RTO 的一半.
+        """
+        if self.srtt is None:
+            return self.rto / 2
+        return min(self.srtt + 2 * self.rttvar, self.rto)
+
+
+class Timer:
+    """:meth:`TimerWheel.schedule` 返回的句柄"""
+
+    __slots__ = ("deadline", "tick", "callback", "bucket")
+
+    def __init__(self, deadline: float, tick: int, callback, bucket: set):
+        self.deadline = deadline
+        self.tick = tick
+        self.callback = callback
+        self.bucket = bucket
+
+    def cancel(self):
+        """取消定时器, 已触发或已取消时什么也不做"""
+        if self.bucket is not None:
+            self.bucket.discard(self)
+            self.bucket = None
+
+
+class TimerWheel:
+    """哈希时间轮
+
+    时间被切分为长度为 tick 秒的格子, 截止时间落在第 n 格的定时器放在
+    ``slots[n % len(slots)]`` 中. :meth:`advance` 每前进一格只检查一个桶.
+
+    :param float tick: 每格的长度, 即调度精度, 单位为秒
+    :param int slots: 桶的数量, tick * slots 最好大于最长的 keepalive 间隔
+    """
+
+    def __init__(self, tick: float = 0.05, slots: int = 1024):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.current = self.tickOf(monotonic())
+        self.drift = DriftStats()
+
+    def tickOf(self, t: float) -> int:
+        return int(t / self.tick)
+
+    def __len__(self) -> int:
+        return sum(len(i) for i in self.slots)
+
+    def schedule(self, deadline: float, callback) -> Timer:
+        """在 monotonic 时间 deadline 之后调用 callback(late)
+
+        late 是实际触发时间比 deadline 晚的秒数.
+        """
+        # 已经过期的定时器放进当前格, 下一次 advance 时触发
+        tick = max(self.tickOf(deadline), self.current)
+        bucket = self.slots[tick % len(self.slots)]
+        timer = Timer(deadline, tick, callback, bucket)
+        bucket.add(timer)
+        return timer
+
+    def advance(self, now: float = None) -> int:
+        """触发所有在 now 之前到期的定时器
+
+        :returns: 触发的数量
+        """
+        if now is None:
+            now = monotonic()
+        target = self.tickOf(now)
+        n = len(self.slots)
+        if target - self.current >= n:
+            # 落后超过一圈, 每个桶只需检查一次
+            ticks = range(self.current, self.current + n)
+        else:
+            ticks = range(self.current, target + 1)
+        fired = 0
+        for i in ticks:
+            bucket = self.slots[i % n]
+            if not bucket:
+                continue
+            due = [t for t in bucket if t.tick <= target and t.deadline <= now]
+            for timer in due:
+                bucket.discard(timer)
+                timer.bucket = None
+                late = now - timer.deadline
+                self.drift.record(late)
+                timer.callback(late)
+            fired += len(due)
+        # 当前格中还没到 deadline 的定时器留到下一次检查
+        self.current = target
+        return fired
@@ -0,0 +1,559 @@
+"""Drcom 协议状态机
+
+只负责构建发送的包和处理收到的包, 不做任何 I/O.
+阻塞式的 :class:`drcom.app.DrcomApp` 与异步的 :class:`drcom.aio.AsyncDrcomSession`
+共用这里的 challenge → login → keepAlive1/keepAlive2/keepAliveStable 流程.
+"""
+
+import binascii
+import random
+import struct
+import time
+from pathlib import Path
+from time import monotonic
+
+from .account import Account
+from .config import DrcomConfig
+from .context import DrcomContext
+from .exceptions import *
+from .log import LogWriter
+from .metrics import MetricsRegistry
+from .packet import KeepAliveTemplate, LoginTemplate
+from .resolver import ServerResolver
+from .scheduler import DriftStats, RttEstimator
+from .state import STATE_REFRESH, defaultStatePath, loadState, writer
+from .states import (STATE_KEEPALIVE, STATE_LOGIN, STATE_RETRY, STATE_STABLE,
+                     STATE_STARTING, STATES)
+from .utils import hexdump, md5sum
+
+# 等待服务端回应的超时时间, 单位为秒
+RECV_TIMEOUT = 10
+# 一个请求最多重传的次数, 之后视为超时
+MAX_RETRANSMIT = 3
+
+# 请求的首字节 -> 可能的回应首字节
+REPLY_CODES = {
+    0x01: b'\x02',         # challenge
+    0x03: b'\x04\x05',     # login, 0x05 表示登录失败
+    0xff: b'\x07',         # keepAlive1
+    0x07: b'\x07',         # keepAlive2, keepAliveStable
+    0x06: b'\x04',         # logout
+}
+KNOWN_REPLY_CODES = b'\x02\x04\x05\x07'
+# 服务端主动推送的通知消息
+NOTICE_CODE = 0x4d
+
+# keepAlive2 的三个步骤, (type_, first)
+KEEP_ALIVE2_STEPS = ((1, True), (1, False), (3, False))
+# keepAliveStable 的两个步骤, (type_, first)
+KEEP_ALIVE_STABLE_STEPS = ((1, False), (3, False))
+
+
+class DrcomSession:
+    """Drcom 会话
+
+    保存一个账号的上下文以及 keepalive 计数, 提供
+
+    1. 构建各阶段的数据包: ``make*Packet``
+    2. 处理各阶段收到的数据包: ``recv*``
+
+    :param DrcomConfig config: 该会话使用的配置
+    :param LogWriter logger: 日志记录器, 留空则按配置新建; 会话的每条记录都带有账号
+    :param Account account: 该会话的账号, 留空则为配置中的第一个账号
+    """
+
+    def __init__(self, config: DrcomConfig, logger: LogWriter = None,
+                 account: Account = None):
+        self.application = config["application"]
+        if account is None:
+            account = config.accounts()[0]
+        self.srv_num = 0
+        self.tail = bytearray(4)    # 原地更新, 不随每个回应分配新对象
+        self.drift = DriftStats()   # keepalive 实际发出时间与计划时间之差
+        self.metrics = MetricsRegistry()
+        self.slot = None    # 状态表中的槽, 由运行会话的一方分配, 见 drcom.board
+        self.state = STATE_STARTING
+        self.port = None    # 绑定的本地端口, 由子类设置
+        self.savedState = None  # 上一次写入状态文件的内容与 monotonic 时间, 见 saveState
+        self.savedAt = 0.0
+        if logger is None:
+            logger = LogWriter(level=self.application["logging"],
+                               database=self.application["log_path"],
+                               max_keep=self.application["log_max_keep"])
+        self.logger = logger.bind(account.username)
+        self.setAccount(account)
+
+    def setAccount(self, account: Account):
+        """切换到 account, 之后需要重新登录
+
+        修改属性
+
+        -   account
+        -   context
+        -   loginTemplate
+        -   keepAliveTemplate
+        -   servers, resolvers, rtts
+        """
+        self.account = account
+        self.logger.name = account.username
+        if self.slot is not None:
+            self.slot.rename(account.username)
+        self.context = self.initContext()
+        self.loginTemplate = None   # 第一次 login 时建立
+        self.keepAliveTemplate = None   # 第一次 keepalive 时建立
+        # 每个认证服务器各自的地址缓存与 RTT 估计, 决定重传超时
+        self.servers = list(account.servers)
+        self.resolvers = [ServerResolver(i, self.context.port,
+                                         self.application["resolve_ttl"], self.logger)
+                          for i in self.servers]
+        self.rtts = [RttEstimator() for i in self.servers]
+        self.selectServer(0)
+
+    def applyAccount(self, account: Account) -> bool:
+        """应用重新加载的配置, 不产生网络流量
+
+        application 已由 drcom.reload.applyConfig 原地更新, 这里只同步解析缓存时间.
+        account 与当前账号只有 keep_alive_interval 不同时直接替换, 下一次 keepalive 生效.
+
+        :returns: 账号或 core 参数有变化, 需要调用方重新登录
+        """
+        for resolver in self.resolvers:
+            resolver.ttl = self.application["resolve_ttl"]
+        changed = self.account.changedFields(account)
+        if changed:
+            self.logger.info(f"{self.account.username} changed: {', '.join(changed)}", b"")
+            return True
+        self.account = account
+        return False
+
+    def initContext(self) -> DrcomContext:
+        account = self.account
+        dc = DrcomContext(
+            server=account.servers[0],
+            port=account.server_port,
+            username=account.username,
+            password=account.password,
+            mac=account.mac,
+            host_ip=account.host_ip,
+            host_name=account.host_name,
+            host_os=account.host_os,
+            dhcp=account.dhcp,
+            dns=account.dns,
+            CONTROL_CHECK_STATUS=account.CONTROL_CHECK_STATUS,
+            ADAPTER_NUM=account.ADAPTER_NUM,
+            IP_DOG=account.IP_DOG,
+            AUTH_VERSION=account.AUTH_VERSION,
+            SALT=account.SALT,
+            KEEP_ALIVE_VERSION=account.KEEP_ALIVE_VERSION,
+            ROR_VERSION=account.ROR_VERSION,
+        )
+        return dc
+
+    @property
+    def state(self) -> str:
+        """会话所处的阶段, STATES 之一, 修改时同步写入状态表"""
+        return self._state
+
+    @state.setter
+    def state(self, value: str):
+        self._state = value
+        self.publish()
+
+    def keepAliveOK(self):
+        """一轮 keepalive 成功, 记录时间并把这一轮的 RTT 与计数写入状态表"""
+        self.metrics.keepAliveOK()
+        self.publish()
+
+    def publish(self):
+        """把状态写入 drcom.board 的状态表, 没有分配槽时什么也不做
+
+        只在状态变化与每轮 keepalive 结束时调用, 收发的热路径上不写入.
+        """
+        if self.slot is not None:
+            self.slot.write(self._state, self.srv_num, self.port, self.metrics)
+
+    def snapshot(self) -> dict:
+        """会话状态与指标的快照"""
+        snap = self.metrics.snapshot()
+        snap["state"] = self.state
+        snap["server"] = self.context.server
+        snap["port"] = self.port
+        snap["srv_num"] = self.srv_num
+        snap["resolve"] = self.resolver.snapshot()
+        snap["drift"] = self.drift.snapshot()
+        snap["servers"] = {
+            host: {"srtt": rtt.srtt, "rto": rtt.rto}
+            for host, rtt in zip(self.servers, self.rtts)
+        }
+        return snap
+
+    def selectServer(self, index: int):
+        """切换到第 index 个认证服务器
+
+        修改属性
+
+        -   context.server
+        -   resolver
+        -   rtt
+        """
+        self.context.server = self.servers[index]
+        self.resolver = self.resolvers[index]
+        self.rtt = self.rtts[index]
+
+    def raceWinner(self, addresses: dict, address: tuple, data: bytes) -> int:
+        """challenge 竞速时, 判断来自 address 的数据报是否是某个服务端的回应
+
+        :param dict addresses: (ip, port) -> 服务端序号
+        :returns: 服务端序号, 不是回应时返回 None
+        """
+        if data[:1] != b'\x02':
+            return None
+        return addresses.get(tuple(address[:2]))
+
+    def failover(self) -> bool:
+        """keepalive 超时后放弃当前服务端, 重新竞速 challenge
+
+        只在 keepalive 阶段超时时生效; 所有服务端都不回应 challenge 时
+        仍然等待 timeout_retry.
+
+        :returns: 是否可以立即重新登录
+        """
+        if len(self.servers) < 2 or self.state not in (STATE_KEEPALIVE, STATE_STABLE):
+            return False
+        self.metrics.count("failover")
+        self.rtt.backoff()
+        self.logger.warn(f"failover from {self.context.server}", b"")
+        return True
+
+    def statePath(self) -> Path:
+        path = self.application["state_path"]
+        if path is None:
+            return defaultStatePath(self.account.username)
+        # 多个账号时用 {username} 区分各自的状态文件
+        return Path(path.format(username=self.account.username))
+
+    def saveState(self):
+        """把恢复 keepAliveStable 所需的字段交给后台线程写入状态文件
+
+        只在服务器, 端口, SALT, AUTH_INFO 或 tail 变化时写入; 没有变化时每隔
+        STATE_REFRESH 秒重写一次, 使文件不至于过期. srv_num 因此可能落后,
+        恢复时服务端不回应则重新登录.
+
+        读取属性
+
+        -   context.SALT
+        -   context.AUTH_INFO
+        -   srv_num
+        -   tail
+        -   port
+        """
+        if not self.application["resume"]:
+            return
+        context = self.context
+        saved = (context.server, self.port, context.SALT, context.AUTH_INFO, bytes(self.tail))
+        now = monotonic()
+        if saved == self.savedState and now - self.savedAt < STATE_REFRESH:
+            return
+        self.savedState = saved
+        self.savedAt = now
+        writer.submit(self.statePath(), {
+            "server": context.server,
+            "username": context.username,
+            "port": self.port,
+            "SALT": context.SALT.hex(),
+            "AUTH_INFO": context.AUTH_INFO.hex(),
+            "srv_num": self.srv_num,
+            "tail": self.tail.hex(),
+        }, self.logger)
+
+    def loadState(self) -> dict:
+        """读取状态文件, 恢复上一个进程的会话
+
+        修改属性
+
+        -   context.SALT
+        -   context.AUTH_INFO
+        -   srv_num
+        -   tail
+
+        :returns: 状态记录, 没有可用的状态时返回 None
+        """
+        if not self.application["resume"]:
+            return None
+        record = loadState(self.statePath())
+        if record is None:
+            return None
+        try:
+            if record["server"] not in self.servers or record["username"] != self.context.username:
+                return None
+            salt = bytes.fromhex(record["SALT"])
+            auth_info = bytes.fromhex(record["AUTH_INFO"])
+            tail = bytes.fromhex(record["tail"])
+            srv_num = int(record["srv_num"])
+            int(record["port"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if len(salt) != 4 or not auth_info or len(tail) != 4:
+            return None
+        self.selectServer(self.servers.index(record["server"]))
+        self.context.SALT = salt
+        self.context.AUTH_INFO = auth_info
+        self.srv_num = srv_num
+        self.tail[:] = tail
+        self.logger.info("state loaded", salt + auth_info + tail)
+        return record
+
+    def clearState(self):
+        """删除状态文件, 恢复失败或注销后调用"""
+        self.resetKeepAlive()
+        self.savedState = None
+        writer.clear(self.statePath())
+
+    def resetKeepAlive(self):
+        """重置 keepalive 计数
+
+        修改属性
+
+        -   srv_num
+        -   tail
+        """
+        self.srv_num = 0
+        self.tail[:] = b'\x00\x00\x00\x00'
+
+    def nextKeepAliveDeadline(self, deadline: float = None) -> float:
+        """计算下一次 keepalive 的 monotonic 截止时间
+
+        在上一次的截止时间上加 keep_alive_interval, 不受收发耗时的影响;
+        如果已经落后超过一个间隔, 则从现在重新开始计时.
+
+        :param float deadline: 上一次的截止时间, 留空表示从现在开始
+        """
+        now = monotonic()
+        if deadline is None:
+            return now + self.account.keep_alive_interval
+        deadline += self.account.keep_alive_interval
+        if deadline < now:
+            deadline = now
+        return deadline
+
+    def matchReply(self, packet: bytes, data: bytes) -> bool:
+        """判断收到的数据报是否是 packet 的回应
+
+        -   首字节属于其他请求的回应 (例如冗余 challenge 迟到的回应) 时不匹配
+        -   服务端的通知 (0x4d) 不是任何请求的回应
+        -   keepAlive2/keepAliveStable 的回应在第 2 字节回显 srv_num,
+            与本次发送的不同说明是上一轮重传得到的重复回应
+
+        未知的首字节视为匹配, 交给 ``recv*`` 按错误处理.
+        """
+        if not data or data[0] == NOTICE_CODE:
+            return False
+        code = data[0]
+        if code in KNOWN_REPLY_CODES and code not in REPLY_CODES.get(packet[0], b''):
+            return False
+        if packet[0] == 0x07 and code == 0x07 and len(data) > 2:
+            # 0x10 是 keepAlive2 第一步可能收到的特殊回应, 不回显 srv_num;
+            # keepAlive2 第一步发送时 srv_num 总是 0, 回应为 0 也能匹配
+            return data[1] == packet[1] or data[2] == 0x10
+        return True
+
+    def makeChallengePacket(self) -> bytes:
+        """构建 challenge 包"""
+        rand = time.time() + random.randint(0xf, 0xff)
+        pack = struct.pack("<H", int(rand) % 0xffff)
+        return b'\x01\x02' + pack + b'\x09' + b'\x00' * 15
+
+    def recvChallenge(self, data: bytes):
+        """处理 challenge 的回应
+
+        各个 ``recv*`` 方法接受 bytes 或者 memoryview,
+        需要保存的字段会复制出来, 不引用 data 本身.
+
+        修改属性
+
+        -   context.SALT
+        """
+        self.logger.info("challenge recv", data)
+        if data[:1] != b'\x02':
+            self.logger.warn("challenge recv err, != 02", data)
+            raise ChallengeException(rf"{data[:1]} != b'\x02'")
+
+        self.context.SALT = bytes(data[4:8])
+        self.logger.debug("SALT modified in challenge", self.context.SALT)
+
+    def makeLoginPacket(self) -> bytearray:
+        """构建 login 包
+
+        第一次调用时按账号建立 :class:`drcom.packet.LoginTemplate`,
+        之后只用 context.SALT 修补模板. 返回的缓冲区在下一次调用前有效.
+
+        读取属性
+
+        -   context.SALT
+
+        修改属性
+
+        -   loginTemplate
+        """
+        if self.loginTemplate is None:
+            self.loginTemplate = LoginTemplate(self.account)
+        return self.loginTemplate.render(self.context.SALT)
+
+    def recvLogin(self, data: bytes):
+        """处理 login 的回应
+
+        修改属性
+
+        -   context.AUTH_INFO
+        """
+        self.logger.info("login recv", data)
+        if data[:1] == b'\x04':
+            self.context.AUTH_INFO = bytes(data[23:39])
+            self.logger.debug("AUTH_INFO set in sendLogin",
+                              self.context.AUTH_INFO)
+        else:
+            self.logger.warn("login fail, != 04", data)
+            raise LoginException(rf"{data[:1]} != b'\x04'")
+
+    def makeKeepAlive1Packet(self) -> bytes:
+        """构建 keepAlive1 包
+
+        读取属性
+
+        -   context.AUTH_INFO
+        -   context.SALT
+        -   account.password_bytes
+
+        调用函数
+
+        -   utils.md5sum
+        """
+        data = b''
+        foo = struct.pack("!H", int(time.time()) % 0xffff)
+        data += b'\xff'
+        data += md5sum(b'\x03\x01' + self.context.SALT +
+                       self.account.password_bytes)
+        data += b'\x00\x00\x00'
+        data += self.context.AUTH_INFO
+        data += foo
+        data += b'\x00\x00\x00\x00'
+        return data
+
+    def recvKeepAlive1(self, data: bytes):
+        """处理 keepAlive1 的回应"""
+        self.logger.info("keepAlive1 recv", data)
+        if data[:1] != b'\x07':
+            self.logger.warn("keepAlive1 err, != 07", data)
+            raise KeepAliveException(bytes(data))
+
+    def makeKeepAlivePacket(self, type_, first):
+        """构建 keepalive 包
+
+        第一次调用时建立 :class:`drcom.packet.KeepAliveTemplate`,
+        之后只修补 srv_num 与 tail. 返回的缓冲区在下一次构建同类包之前有效.
+
+        读取属性
+
+        self.srv_num
+        self.tail
+
+        修改属性
+
+        self.keepAliveTemplate
+        """
+        if self.keepAliveTemplate is None:
+            self.keepAliveTemplate = KeepAliveTemplate(self.account)
+        return self.keepAliveTemplate.render(type_, first, self.srv_num, self.tail)
+
+    def recvKeepAlive2(self, step: int, data: bytes):
+        """处理 keepAlive2 第 step 步 (从 1 开始) 的回应
+
+        修改属性
+
+        -   srv_num
+        -   tail
+        """
+        if step == 1:
+            if data[:1] != b"\x07":
+                self.logger.warn("keepAlive2 01 error, !=07", data)
+                raise KeepAliveException(bytes(data))
+            self.logger.info("keepAlive2 01 recv", data)
+            if (
+                data[2:4] == b'\x28\x00' and data[1] in (0, self.srv_num) or
+                data[2:3] == b'\x10'
+            ):
+                self.srv_num += 1
+                self.logger.debug("srv_num add, keepAlive2 01",
+                                  bytes([self.srv_num]))
+            return
+
+        self.logger.info(f"keepAlive2 0{step} recv", data)
+        if data[:1] != b'\x07':
+            self.logger.warn(f"keepAlive2 0{step} err, != 07", data)
+            raise KeepAliveException(bytes(data))
+        self.readTail(data, f"keepAlive2 0{step}")
+        self.srv_num += 1
+        self.logger.debug(f"srv_num add keepAlive2 0{step}",
+                          bytes([self.srv_num]))
+        self.logger.debug(f"tail mod in keepAlive2 0{step}", self.tail)
+
+    def recvKeepAliveStable(self, step: int, data: bytes):
+        """处理 keepAliveStable 第 step 步 (从 1 开始) 的回应
+
+        修改属性
+
+        -   srv_num
+        -   tail
+        """
+        if data[:1] != b"\x07":
+            self.logger.warn(f"keepAliveStable 0{step} error, !=07", data)
+            raise KeepAliveException(bytes(data))
+        self.logger.info(f"keepAliveStable 0{step} recv", data)
+        if step == 1:
+            # 第一个回应可以不含 tail
+            self.readTail(data, "keepAliveStable 01", optional=True)
+            self.srv_num += 1
+            self.logger.debug("srv_num add keepAliveStable 01",
+                              bytes([self.srv_num]))
+        else:
+            self.readTail(data, f"keepAliveStable 0{step}")
+            self.srv_num = (self.srv_num + 1) % 127
+            self.logger.debug("srv_num reset keepAliveStable 02",
+                              bytes([self.srv_num]))
+        self.logger.debug(f"tail mod in keepAliveStable 0{step}", self.tail)
+
+    def readTail(self, data: bytes, phase: str, optional: bool = False):
+        """把 keepalive 回应中 16:20 的 tail 写入 self.tail
+
+        :param bool optional: 回应可以止于 tail 之前, 此时 tail 置 0
+        :raises KeepAliveException: 回应过短, tail 不完整; self.tail 不变
+        """
+        tail = data[16:20]
+        if len(tail) != 4:
+            if not (optional and not tail):
+                self.logger.warn(f"{phase} err, too short", data)
+                raise KeepAliveException(bytes(data))
+            tail = b"\x00\x00\x00\x00"
+        self.tail[:] = tail
+
+    def makeLogoutPacket(self) -> bytes:
+        """构建 logout 包, 需要先完成 challenge
+
+        读取属性
+
+        -   context.SALT
+        -   context.AUTH_INFO
+        """
+        data = b''
+        data += b'\x06\x01\x00'
+        data += bytes([len(self.account.username) + 20])
+        data += md5sum(b'\x03\x01' + self.context.SALT +
+                       self.account.password_bytes)
+        data += self.account.account_bytes
+        data += self.account.CONTROL_CHECK_STATUS
+        data += self.account.ADAPTER_NUM
+        data += hexdump(
+            int(binascii.hexlify(data[4:10]), 16) ^ self.account.mac
+        )[-6:0]
+        data += self.context.AUTH_INFO or b''
+        return data
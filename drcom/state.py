@@ -0,0 +1,144 @@
+"""会话状态的持久化
+
+进入 keepalive 后, 把恢复 keepAliveStable 所需的字段写入一个小的 JSON 文件:
+
+-   SALT 与 AUTH_INFO
+-   srv_num 与 tail
+-   绑定的本地端口
+
+进程重启时 (systemd 的 Restart=on-failure, 升级等) 先读取该文件,
+直接发送一轮 keepAliveStable; 服务端仍然持有会话时, 一次往返即可恢复,
+失败时再走完整的 challenge → login 流程.
+
+文件中含有 SALT 与 AUTH_INFO, 权限为 0o600, 所在目录只允许当前用户访问.
+写入由 :class:`StateWriter` 在后台线程中完成, 网络循环不等待文件系统.
+"""
+
+import json
+import os
+import stat
+from atexit import register as atexit
+from os import remove
+from pathlib import Path
+from tempfile import gettempdir
+from threading import Event, Lock, Thread
+from time import time
+
+from .metrics import writeJSON
+
+# 超过这个秒数的状态文件不再尝试恢复, 服务端早已清除了对应的会话
+RESUME_MAX_AGE = 300
+# 内容没有变化时, 每隔这个秒数重写一次, 使文件中的时间保持在 RESUME_MAX_AGE 以内
+STATE_REFRESH = RESUME_MAX_AGE / 2
+
+
+def defaultStatePath(username: str) -> Path:
+    return Path(gettempdir()) / "drcom" / "state" / f"{username}.json"
+
+
+def privateDir(directory: Path):
+    """建立只有当前用户可以访问的目录
+
+    默认的状态目录位于所有用户共用的临时目录中, 已存在时收紧为 0o700.
+
+    :raises PermissionError: 目录是符号链接或属于其他用户
+    """
+    directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+    if not hasattr(os, "getuid"):
+        # Windows 上由 ACL 控制
+        return
+    st = os.lstat(str(directory))
+    if stat.S_ISLNK(st.st_mode) or st.st_uid != os.getuid():
+        raise PermissionError(f"{directory} 不属于当前用户, 拒绝写入状态文件")
+    if st.st_mode & 0o077 and directory == defaultStatePath("").parent:
+        os.chmod(str(directory), 0o700)
+
+
+def dumpState(path: Path, record: dict):
+    """原子地写入状态文件, 只有当前用户可以读取"""
+    record = dict(record, time=time())
+    privateDir(path.parent)
+    writeJSON(path, record, mode=0o600)
+
+
+def loadState(path: Path, max_age: float = RESUME_MAX_AGE) -> dict:
+    """读取状态文件
+
+    :returns: 状态记录, 文件不存在, 无法解析或已过期时返回 None
+    """
+    try:
+        record = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    try:
+        age = time() - float(record["time"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not 0 <= age <= max_age:
+        return None
+    return record
+
+
+def clearState(path: Path):
+    try:
+        remove(str(path))
+    except OSError:
+        pass
+
+
+class StateWriter:
+    """在后台线程中写入状态文件
+
+    :meth:`submit` 只把记录放入字典, 同一个文件尚未写出的旧记录直接被覆盖;
+    :meth:`clear` 同步删除文件, 并丢弃尚未写出的记录, 之后不会再有旧的记录落地.
+    """
+
+    def __init__(self):
+        self.pending = {}   # 路径 -> (记录, 日志记录器)
+        self.lock = Lock()  # 写入一个文件期间持有, clear 等待它完成
+        self.wakeup = Event()
+        self.stopped = False
+        self.thread = None  # 第一次 submit 时启动
+
+    def submit(self, path: Path, record: dict, logger):
+        """交给后台线程写入, 失败时用 logger 记录警告"""
+        self.pending[path] = (record, logger)
+        if self.thread is None:
+            self.thread = Thread(target=self.loop, name="drcom-state", daemon=True)
+            self.thread.start()
+            atexit(self.close)
+        self.wakeup.set()
+
+    def clear(self, path: Path):
+        with self.lock:
+            self.pending.pop(path, None)
+            clearState(path)
+
+    def close(self, timeout: float = 5.0):
+        """写完尚未写出的记录后停止后台线程"""
+        if self.thread is not None and self.thread.is_alive():
+            self.stopped = True
+            self.wakeup.set()
+            self.thread.join(timeout)
+
+    def loop(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            while self.pending:
+                with self.lock:
+                    try:
+                        path, (record, logger) = self.pending.popitem()
+                    except KeyError:
+                        # 刚被 clear 取走
+                        break
+                    try:
+                        dumpState(path, record)
+                    except OSError as e:
+                        logger.warn(f"save state failed: {e}", b"")
+            if self.stopped:
+                return
+
+
+# 所有会话共用一个写入线程
+writer = StateWriter()
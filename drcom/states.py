@@ -0,0 +1,11 @@
+"""会话所处的阶段
+
+单独成模块, 状态表的读取方 (见 drcom.board) 不必导入整个协议状态机.
+"""
+
+STATE_STARTING = "starting"     # 尚未开始
+STATE_LOGIN = "login"           # challenge 与 login
+STATE_KEEPALIVE = "keepalive"   # keepAlive1 与 keepAlive2
+STATE_STABLE = "stable"         # keepAliveStable
+STATE_RETRY = "retry"           # 出错后等待重试
+STATES = (STATE_STARTING, STATE_LOGIN, STATE_KEEPALIVE, STATE_STABLE, STATE_RETRY)
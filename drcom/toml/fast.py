@@ -0,0 +1,249 @@
+"""drcom.toml 所用 TOML 子集的快速解码
+
+配置文件只用到 TOML 的一小部分: 表, 表数组, 裸键, 单行字符串, 整数 (含十六进制),
+浮点数, 布尔值以及由它们组成的数组. :func:`loads` 用预编译的正则表达式直接在字符串上
+扫描这部分语法, 不再把整个文档复制成字符列表逐字符处理.
+
+遇到子集以外的写法 (多行字符串, 内联表, 日期, 带引号的键, 重复定义, 语法错误等)
+时整体交给 :func:`decoder.loads`, 因此结果与错误信息都与原解码器一致.
+"""
+
+import re
+
+from . import decoder
+
+_KEY = r"[A-Za-z0-9_-]+"
+_PATH = _KEY + r"(?:[ \t]*\.[ \t]*" + _KEY + r")*"
+
+# 空白, 换行与注释. 注释必须延伸到行尾, 不能回溯成半个注释后接一个键
+_SKIP_RE = r"(?:[ \t\r\n]+|#[^\n]*(?![^\n]))*"
+_SKIP = re.compile(_SKIP_RE)
+# 值或表头之后直到行尾
+_LINE_END_RE = r"[ \t]*(?:#[^\n]*)?(?:\r?\n|\Z)"
+_LINE_END = re.compile(_LINE_END_RE)
+_BASIC_RE = r'"((?:[^"\\\n]|\\(?:[btnfr"\\]|u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}))*)"'
+_LITERAL_RE = r"'([^'\n]*)'"
+_TABLE = re.compile(r"\[[ \t]*(" + _PATH + r")[ \t]*\]")
+_ARRAY_TABLE = re.compile(r"\[\[[ \t]*(" + _PATH + r")[ \t]*\]\]")
+_KEYVAL = re.compile(r"(" + _KEY + r")[ \t]*=([ \t]*)")
+_PATH_SEP = re.compile(r"[ \t]*\.[ \t]*")
+
+_BASIC = re.compile(_BASIC_RE)
+_LITERAL = re.compile(_LITERAL_RE)
+_ESCAPE = re.compile(r'\\([btnfr"\\]|u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8})')
+_ESCAPES = {"b": "\b", "t": "\t", "n": "\n", "f": "\f",
+            "r": "\r", '"': '"', "\\": "\\"}
+# 原解码器按逗号切分数组, 数组中含有这些字符的字符串交给它处理
+_ARRAY_UNSAFE = re.compile(r"[,\[\]#\\'\"]")
+
+# 字符串与数组以外的值
+_ATOM = re.compile(r"[^ \t\r\n,\]#]+")
+_INT = re.compile(r"[+-]?(?:0|[1-9](?:_?[0-9])*)\Z")
+_HEX = re.compile(r"0x([0-9A-Fa-f](?:_?[0-9A-Fa-f])*)\Z")
+# 原解码器拒绝 0 后面不是小数点的数, 如 0e5
+_FLOAT = re.compile(r"[+-]?(?:0(?=\.)|[1-9](?:_?[0-9])*)"
+                    r"(?:\.[0-9](?:_?[0-9])*)?(?:[eE][+-]?[0-9](?:_?[0-9])*)?\Z")
+
+# 配置中绝大多数行是 键 = 字符串或标量, 连同前面的空行与注释一次匹配
+_SIMPLE = re.compile(_SKIP_RE + r"(" + _KEY + r")[ \t]*=([ \t]*)(?:" + _BASIC_RE + r"|"
+                     + _LITERAL_RE + r"""|([^ \t\r\n,\]#\['"]+))""" + _LINE_END_RE)
+
+
+class Unsupported(Exception):
+    """超出快速路径支持的子集, 需要交给 decoder.loads"""
+
+
+def loads(s: str) -> dict:
+    """解析 TOML 字符串, 与 decoder.loads(s) 的结果相同"""
+    if isinstance(s, str):
+        try:
+            return _Parser(s).parse()
+        except Unsupported:
+            pass
+    return decoder.loads(s)
+
+
+def _unescape(match) -> str:
+    escape = match.group(1)
+    if escape in _ESCAPES:
+        return _ESCAPES[escape]
+    code = int(escape[1:], 16)
+    if 0xd800 <= code < 0xe000 or code > 0x10ffff:
+        raise Unsupported(escape)
+    return chr(code)
+
+
+def _basic(body: str) -> str:
+    if "\\" not in body:
+        return body
+    value = _ESCAPE.sub(_unescape, body)
+    # 原解码器把转义后以引号开头的字符串误当作三引号字符串
+    if value.startswith('"'):
+        raise Unsupported(body)
+    return value
+
+
+def _scalar(text: str):
+    if text == "true":
+        return True
+    if text == "false":
+        return False
+    if _INT.match(text):
+        return int(text.replace("_", ""))
+    match = _HEX.match(text)
+    if match:
+        return int(match.group(1).replace("_", ""), 16)
+    if _FLOAT.match(text) and ("." in text or "e" in text or "E" in text):
+        return float(text.replace("_", ""))
+    raise Unsupported(text)
+
+
+class _Parser:
+    """在字符串上逐个匹配表头与键值对
+
+    :attr defined: 已由 [表头] 显式定义的表的 id, 重复定义交给原解码器报错
+    :attr arrays: 由 [[表头]] 创建的列表的 id
+    """
+
+    __slots__ = ("s", "root", "defined", "arrays")
+
+    def __init__(self, s: str):
+        self.s = s
+        self.root = {}
+        self.defined = set()
+        self.arrays = set()
+
+    def parse(self) -> dict:
+        s = self.s
+        end = len(s)
+        current = self.root
+        pos = 0
+        while True:
+            match = _SIMPLE.match(s, pos)
+            if match:
+                key, space, basic, literal, atom = match.groups()
+                if key in current:
+                    raise Unsupported(key)
+                if basic is not None:
+                    current[key] = _basic(basic)
+                elif literal is not None:
+                    current[key] = literal
+                elif space or not atom.startswith("0x"):
+                    current[key] = _scalar(atom)
+                else:
+                    raise Unsupported(key)
+                pos = match.end()
+                continue
+            pos = _SKIP.match(s, pos).end()
+            if pos == end:
+                return self.root
+            match = _KEYVAL.match(s, pos)
+            if match:
+                key = match.group(1)
+                pos = match.end()
+                # 原解码器不接受紧跟在 = 后面的十六进制数, 如 a=0x20
+                if key in current or not match.group(2) and s.startswith("0x", pos):
+                    raise Unsupported(key)
+                current[key], pos = self.value(pos)
+            else:
+                match = _ARRAY_TABLE.match(s, pos)
+                if match:
+                    current = self.arrayTable(match.group(1))
+                else:
+                    match = _TABLE.match(s, pos)
+                    if match is None:
+                        raise Unsupported(pos)
+                    current = self.table(match.group(1))
+                pos = match.end()
+            match = _LINE_END.match(s, pos)
+            if match is None:
+                raise Unsupported(pos)
+            pos = match.end()
+
+    def walk(self, keys: list) -> dict:
+        """沿着表头的路径向下, 缺少的表隐式创建, 表数组取最后一个元素"""
+        table = self.root
+        for key in keys:
+            child = table.get(key)
+            if child is None:
+                child = table[key] = {}
+            elif id(child) in self.arrays:
+                child = child[-1]
+            elif not isinstance(child, dict):
+                raise Unsupported(key)
+            table = child
+        return table
+
+    def table(self, path: str) -> dict:
+        keys = _PATH_SEP.split(path)
+        parent = self.walk(keys[:-1])
+        table = parent.get(keys[-1])
+        if table is None:
+            table = parent[keys[-1]] = {}
+        elif id(table) in self.defined or not isinstance(table, dict):
+            raise Unsupported(path)
+        self.defined.add(id(table))
+        return table
+
+    def arrayTable(self, path: str) -> dict:
+        keys = _PATH_SEP.split(path)
+        parent = self.walk(keys[:-1])
+        array = parent.get(keys[-1])
+        if array is None:
+            array = parent[keys[-1]] = []
+            self.arrays.add(id(array))
+        elif id(array) not in self.arrays:
+            raise Unsupported(path)
+        table = {}
+        array.append(table)
+        return table
+
+    def value(self, pos: int) -> tuple:
+        """解析 pos 处的值
+
+        :returns: (值, 值之后的位置)
+        """
+        s = self.s
+        char = s[pos:pos + 1]
+        if char == '"':
+            match = _BASIC.match(s, pos)
+            if match is None or s.startswith('"""', pos):
+                raise Unsupported(pos)
+            return _basic(match.group(1)), match.end()
+        if char == "'":
+            match = _LITERAL.match(s, pos)
+            if match is None or s.startswith("'''", pos):
+                raise Unsupported(pos)
+            return match.group(1), match.end()
+        if char == "[":
+            return self.array(pos + 1)
+        match = _ATOM.match(s, pos)
+        if match is None:
+            raise Unsupported(pos)
+        return _scalar(match.group()), match.end()
+
+    def array(self, pos: int) -> tuple:
+        s = self.s
+        values = []
+        kind = None
+        while True:
+            pos = _SKIP.match(s, pos).end()
+            if s.startswith("]", pos):
+                return values, pos + 1
+            start = pos
+            value, pos = self.value(pos)
+            if type(value) is str and _ARRAY_UNSAFE.search(s, start + 1, pos - 1):
+                raise Unsupported(start)
+            # 原解码器要求数组中元素的类型相同
+            if kind is None:
+                kind = type(value)
+            elif type(value) is not kind:
+                raise Unsupported(pos)
+            values.append(value)
+            pos = _SKIP.match(s, pos).end()
+            if s.startswith(",", pos):
+                pos += 1
+            elif s.startswith("]", pos):
+                return values, pos + 1
+            else:
+                raise Unsupported(pos)
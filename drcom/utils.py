@@ -1,8 +1,6 @@
 import binascii
 import os
 import struct
-import sys
-import time
 from hashlib import md5
 
 
@@ -33,30 +31,75 @@ def hexdump(n: int) -> bytes:
     return binascii.unhexlify(bytes(s, 'ascii'))
 
 
-def ror(md5sum: bytes, pwd: str) -> str:
+def ror(md5sum: bytes, pwd: bytes) -> bytes:
     """ror 加密
 
     :param bytes md5sum: md5 检验和 16 字节
-    :param str pwd: Drcom 用户的密码
+    :param bytes pwd: Drcom 用户的密码, 传入 str 时按 UTF-8 编码
     """
-    result = []
+    if isinstance(pwd, str):
+        pwd = pwd.encode()
+    result = bytearray()
     for i in range(len(pwd)):
-        x = ord(md5sum[i]) ^ ord(pwd[i])
-        result.append(struct.pack("B", ((x << 3) & 0xff) + (x >> 5)))
-    return ''.join(result)
+        x = md5sum[i] ^ pwd[i]
+        result.append(((x << 3) & 0xff) + (x >> 5))
+    return bytes(result)
+
+
+# 折叠时使用的掩码, _FOLD_MASKS[k] 保留低 32 * 2**k 位
+_FOLD_MASKS = [(1 << (32 << k)) - 1 for k in range(16)]
 
 
 def checksum(bytes_: bytes) -> bytes:
     """checksum 验证，引用 self.mac
+
+    将输入视为小端序的 32 位字 (末尾不足 4 字节时补 0), 以 1234 为初值逐字异或,
+    再乘以 1968 取低 32 位.
+
+    实现上把整个输入读成一个小端序大整数, 每次把高半部分异或到低半部分,
+    log2(字数) 次折叠后剩下的 32 位就是所有字的异或.
+
+    >>> checksum(b'\x01\x00\x00\x00')
+    b'\x10\x16%\x00'
+    """
+    x = int.from_bytes(bytes_, "little")
+    k = 0
+    while (32 << k) < len(bytes_) * 8:
+        k += 1
+    while k:
+        k -= 1
+        mask = _FOLD_MASKS[k] if k < len(_FOLD_MASKS) else (1 << (32 << k)) - 1
+        x = (x >> (32 << k)) ^ (x & mask)
+    return struct.pack('<I', (1968 * (1234 ^ x)) & 0xffffffff)
+
+
+# 少于这么多个包时逐个调用 checksum 更快
+_BATCH_MIN = 32
+
+
+def checksums(packets) -> list:
+    """批量计算 checksum
+
+    把所有包补 0 到相同的长度 (4 的倍数) 后拼接, 看作每行一个包的 32 位字矩阵.
+    每一列取出来读成一个大整数, 所有列异或之后, 第 i 个 32 位字就是第 i 个包的异或值.
+    异或只与字节有关, 这里不需要考虑本机字节序.
+
+    :param packets: 可迭代的字节串, 例如多个账号的 login 包
+    :returns: 与输入一一对应的 checksum 列表
     """
-    resualt = 1234
-    for i in [x*4 for x in range(0, -(-len(bytes_)//4))]:
-        resualt ^= int(
-            binascii.hexlify(bytes_[i:i+4].ljust(4, b'\x00')[::-1]), 16
-        )
-
-    resualt = (1968 * resualt) & 0xffffffff
-    return struct.pack('<I', resualt)
+    packets = list(packets)
+    n = len(packets)
+    if n < _BATCH_MIN:
+        return [checksum(i) for i in packets]
+    size = -(-max(len(i) for i in packets) // 4) * 4
+    buf = b''.join(bytes(i).ljust(size, b'\x00') for i in packets)
+    words = memoryview(buf).cast('I')
+    step = size // 4
+    x = 0
+    for i in range(step):
+        x ^= int.from_bytes(words[i::step].tobytes(), "little")
+    return [struct.pack('<I', (1968 * (1234 ^ w)) & 0xffffffff)
+            for w in struct.unpack('<%dI' % n, x.to_bytes(n * 4, "little"))]
 
 
 def daemon():
@@ -0,0 +1,104 @@
+"""drcom.config 的编译缓存"""
+
+import os
+import stat
+
+import pytest
+
+from drcom import config
+from drcom.config import DrcomConfig, cachePath
+
+TOML = """\
+[application]
+logging = 20
+[drcom]
+server = "10.0.0.1"
+username = "2019123456"
+password = "password"
+mac = 0x0a1b2c3d4e5f
+host_ip = "10.30.1.23"
+[core]
+AUTH_VERSION = [0x2f, 0x00]
+"""
+
+
+@pytest.fixture
+def parses(monkeypatch) -> list:
+    """记录每一次真正的 TOML 解析"""
+    calls = []
+    parseConfig = config.parseConfig
+
+    def counting(string):
+        calls.append(string)
+        return parseConfig(string)
+
+    monkeypatch.setattr(config, "parseConfig", counting)
+    return calls
+
+
+@pytest.fixture
+def file(tmp_path):
+    path = tmp_path / "drcom.toml"
+    path.write_text(TOML, "utf-8")
+    path.chmod(0o644)
+    return path
+
+
+def load(file):
+    return DrcomConfig().load(file)
+
+
+def test_hit(file, parses):
+    first = load(file)
+    assert len(parses) == 1
+    assert cachePath(file).exists()
+    second = load(file)
+    assert len(parses) == 1
+    assert second.data["core"] == first.data["core"]
+    assert second.data["drcom"]["password"] == "password"
+    assert second.data["core"]["AUTH_VERSION"] == b"\x2f\x00"
+
+
+def test_miss(file, parses):
+    load(file)
+    cachePath(file).write_bytes(b"not marshal")
+    load(file)
+    assert len(parses) == 2
+    cachePath(file).unlink()
+    load(file)
+    assert len(parses) == 3
+
+
+def test_no_cache(file, parses):
+    DrcomConfig().load(file, cache=False)
+    assert len(parses) == 1
+    assert not cachePath(file).exists()
+
+
+def test_invalidate_on_mtime(file, parses):
+    load(file)
+    st = file.stat()
+    os.utime(str(file), ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    load(file)
+    assert len(parses) == 2
+
+
+def test_invalidate_on_size(file, parses):
+    load(file)
+    st = file.stat()
+    file.write_text(TOML.replace("2019123456", "20191234567"), "utf-8")
+    # 保持修改时间不变, 只有大小不同
+    os.utime(str(file), ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert load(file).data["drcom"]["username"] == "20191234567"
+    assert len(parses) == 2
+
+
+@pytest.mark.skipif(os.name != "posix", reason="只有 POSIX 上有文件权限")
+def test_private(file, parses):
+    load(file)
+    assert stat.S_IMODE(cachePath(file).stat().st_mode) == 0o600
+    # 旧版本按配置文件的权限写入的缓存不再使用, 重新写为 0600
+    cachePath(file).chmod(0o644)
+    load(file)
+    assert len(parses) == 2
+    assert stat.S_IMODE(cachePath(file).stat().st_mode) == 0o600
@@ -0,0 +1,81 @@
+"""drcom.log.LogReader 按日期与等级读取日志"""
+
+import sqlite3
+from time import mktime, strptime
+
+import pytest
+
+from drcom.log import (LEVEL_DEBUG, LEVEL_ERROR, LEVEL_INFO, LEVEL_WARN,
+                       Logger, LogReader, Message)
+
+DAY = mktime(strptime("2026-10-18", "%Y-%m-%d"))
+
+ROWS = [
+    (DAY - 1, LEVEL_ERROR, "yesterday", b""),
+    (DAY, LEVEL_DEBUG, "midnight", b"\x01"),
+    (DAY + 3600, LEVEL_INFO, "login", b"\x02\x03"),
+    (DAY + 7200, LEVEL_WARN, "timeout", b""),
+    (DAY + 86399, LEVEL_ERROR, "last second", b"\xff"),
+    (DAY + 86400, LEVEL_ERROR, "tomorrow", b""),
+]
+
+
+@pytest.fixture
+def database(tmp_path) -> str:
+    database = str(tmp_path / "log" / "drcom.db")
+    conn = Logger(database=database).connect()
+    with conn:
+        # 故意打乱插入顺序, 读取时应按时间排序
+        conn.executemany(Message.sql, reversed(ROWS))
+    conn.close()
+    return database
+
+
+def messages(reader: LogReader) -> list:
+    return [(m.time, m.level, m.msg, m.data) for m in reader.iter()]
+
+
+def test_iter_date(database):
+    assert messages(LogReader("2026-10-18", database=database)) == ROWS[1:5]
+    assert messages(LogReader("2026-10-17", database=database)) == ROWS[:1]
+    assert messages(LogReader("2026-10-19", database=database)) == ROWS[5:]
+    assert messages(LogReader("2026-10-20", database=database)) == []
+
+
+@pytest.mark.parametrize("level, expected", [
+    (LEVEL_DEBUG, ROWS[1:5]),
+    (LEVEL_INFO, ROWS[2:5]),
+    (LEVEL_WARN, ROWS[3:5]),
+    (LEVEL_ERROR, ROWS[4:5]),
+])
+def test_iter_level(database, level, expected):
+    assert messages(LogReader("2026-10-18", level, database=database)) == expected
+
+
+def test_to_csv(database, tmp_path):
+    out = tmp_path / "out.csv"
+    LogReader("2026-10-18", LEVEL_WARN, database=database).to_csv(out)
+    lines = out.read_text("utf-8").splitlines()
+    assert lines == [Message(*row).to_csv() for row in ROWS[3:5]]
+    assert lines[0].endswith(",timeout,b''")
+
+
+def test_missing(tmp_path):
+    database = tmp_path / "log" / "drcom.db"
+    assert messages(LogReader("2026-10-18", database=str(database))) == []
+    # 只读, 不创建目录与数据库
+    assert not database.parent.exists()
+
+
+def test_no_table(tmp_path):
+    database = tmp_path / "other.db"
+    conn = sqlite3.connect(str(database))
+    conn.execute("CREATE TABLE other (x INTEGER);")
+    conn.close()
+    assert messages(LogReader("2026-10-18", database=str(database))) == []
+
+
+def test_not_database(tmp_path):
+    database = tmp_path / "drcom.db"
+    database.write_bytes(b"not a sqlite database" * 100)
+    assert messages(LogReader("2026-10-18", database=str(database))) == []
@@ -0,0 +1,40 @@
+"""drcom stats 与 OpenMetrics 输出中的 keepalive 漂移"""
+
+from time import time
+
+from drcom.exposition import renderOpenMetrics
+from drcom.metrics import MetricsRegistry, formatStats
+from drcom.scheduler import DriftStats
+from drcom.states import STATE_STABLE
+
+
+def makeSnapshot() -> dict:
+    drift = DriftStats()
+    for late in (0.002, 0.010, 0.003):
+        drift.record(late)
+    snap = MetricsRegistry().snapshot()
+    snap.update(state=STATE_STABLE, server="10.0.0.1", port=61440, srv_num=3,
+                resolve={"hits": 1, "misses": 1, "seconds": 0.0001},
+                drift=drift.snapshot())
+    return snap
+
+
+def test_drift_snapshot():
+    drift = makeSnapshot()["drift"]
+    assert drift["count"] == 3
+    assert abs(drift["mean"] - 0.005) < 1e-9
+    assert drift["max"] == 0.010
+    assert drift["last"] == 0.003
+
+
+def test_drift_in_stats():
+    text = formatStats({"time": time(), "sessions": {"u": makeSnapshot()}})
+    assert "keepalive drift count=3, mean 5.00 ms, max 10.00 ms, last 3.00 ms" in text
+
+
+def test_drift_in_openmetrics():
+    text = renderOpenMetrics({"u": makeSnapshot()})
+    assert 'drcom_keepalive_drift_seconds_count{session="u"} 3\n' in text
+    assert 'drcom_keepalive_drift_max_seconds{session="u"} 0.01\n' in text
+    assert 'drcom_keepalive_drift_last_seconds{session="u"} 0.003\n' in text
+    assert text.endswith("# EOF\n")
@@ -0,0 +1,147 @@
+"""drcom.packet 的模板与逐字节拼接的旧实现对比"""
+
+import binascii
+
+import pytest
+
+from drcom.account import Account
+from drcom.packet import KeepAliveTemplate, LoginTemplate
+from drcom.utils import checksum, hexdump, md5sum
+
+SALTS = [b"\x00" * 4, b"\x01\x02\x03\x04", b"\xff\xff\xff\xff", b"\x9a\x3c\x00\x7e"]
+
+
+def makeAccount(version: bytes = b"\xdc\x02", ror: bool = False) -> Account:
+    return Account(dict(
+        server="10.0.0.1", server_port=61440, username="2019123456",
+        password="password", mac=0x0a1b2c3d4e5f, host_ip="10.30.1.23",
+        host_name="F**K DRCOM", host_os="DRCOM F**KER", dhcp="0.0.0.0",
+        dns="8.8.8.8", keep_alive_interval=15,
+        CONTROL_CHECK_STATUS=b"\x20", ADAPTER_NUM=b"\x05",
+        IP_DOG=b"\x01", AUTH_VERSION=b"\x2f\x00", SALT=b"",
+        KEEP_ALIVE_VERSION=version, ROR_VERSION=ror,
+    ))
+
+
+def legacyRor(md5sum: bytes, pwd: bytes) -> bytes:
+    """v3.1.3 中的 ror 按 Python 2 的 str 编写, 这里是同一算法的 bytes 版本"""
+    return bytes(((x << 3) & 0xff) + (x >> 5)
+                 for x in (md5sum[i] ^ pwd[i] for i in range(len(pwd))))
+
+
+def legacyLoginPacket(account: Account, salt: bytes) -> bytes:
+    """v3.1.3 中 DrcomSession.makeLoginPacket 的实现"""
+    password = account.password.encode()
+    data = b''
+    data += b'\x03\x01\x00' + bytes([len(account.username) + 20])
+    data += md5sum(b'\x03\x01' + salt + password)
+    data += (account.username.encode() + b'\x00'*36)[:36]
+    data += account.CONTROL_CHECK_STATUS
+    data += account.ADAPTER_NUM
+    data += hexdump(
+        int(
+            binascii.hexlify(data[4:10]),
+            base=16
+        ) ^ account.mac
+    )[-6:]
+    data += md5sum(b'\x01' + password + salt + b'\x00'*4)
+    data += b'\x01'
+    data += b''.join(
+        [bytes([int(i)]) for i in account.host_ip.split('.')]
+    )
+    data += b'\x00'*12
+    data += md5sum(data + b'\x14\x00\x07\x0B')[:8]
+    data += account.IP_DOG
+    data += b'\x00'*4
+    data += (account.host_name.encode() + b'\x00'*32)[:32]
+    data += b''.join([bytes([int(i)]) for i in account.dns.split('.')])
+    data += b''.join([bytes([int(i)]) for i in account.dhcp.split('.')])
+    data += b'\x00'*12
+    data += b'\x94\x00\x00\x00' b'\x05\x00\x00\x00' b'\x01\x00\x00\x00' \
+        b'\x28\x0A\x00\x00' b'\x02\x00\x00\x00'
+    data += (account.host_os.encode() + 32*b'\x00')[:32]
+    data += b'\x00'*96
+    data += account.AUTH_VERSION
+    if account.ROR_VERSION:
+        data += b'\x00'
+        data += bytes([len(password)])
+        data += legacyRor(md5sum(b'\x03\x01' + salt + password), password)
+    data += b'\x02'
+    data += b'\x0c'
+    data += checksum(
+        data + b'\x01\x26\x07\x11\x00\x00' + hexdump(account.mac)
+    )
+    data += b'\x00\x00'
+    data += hexdump(account.mac)
+    data += b'\x00'
+    data += b'\x00'
+    data += b'\xe9\x13'
+    return data
+
+
+@pytest.mark.parametrize("ror", [False, True])
+def test_login_template(ror):
+    account = makeAccount(ror=ror)
+    template = LoginTemplate(account)
+    # 同一个模板用不同的 SALT 修补多次, 之前的内容不能残留
+    for salt in SALTS:
+        packet = bytes(template.render(salt))
+        assert packet == legacyLoginPacket(account, salt)
+
+
+def findSalt(account: Account) -> bytes:
+    """找一个使 MacAddrXORPasswordMD5 的最高字节为 0 的 SALT"""
+    mac = account.mac.to_bytes(6, "big")
+    password = account.password.encode()
+    for n in range(1 << 16):
+        salt = n.to_bytes(4, "big")
+        if md5sum(b'\x03\x01' + salt + password)[0] == mac[0]:
+            return salt
+    raise AssertionError("no such SALT")
+
+
+def test_login_mac_xor_width():
+    """旧实现用 hexdump 写 MacAddrXORPasswordMD5, 会丢掉开头的 0 字节; 模板总是写 6 字节"""
+    account = makeAccount()
+    salt = findSalt(account)
+    template = LoginTemplate(account)
+    packet = bytes(template.render(salt))
+    assert len(packet) == len(legacyLoginPacket(account, salt)) + 1
+    md5_1 = md5sum(b'\x03\x01' + salt + account.password.encode())
+    mac_xor = (int.from_bytes(md5_1[:6], "big") ^ account.mac).to_bytes(6, "big")
+    i = template.mac_xor_at
+    assert packet[i:i + 6] == mac_xor
+
+
+def legacyKeepAlivePacket(account: Account, type_: int, first: bool,
+                          srv_num: int, tail: bytes) -> bytes:
+    """v3.1.3 中 DrcomSession.makeKeepAlivePacket 的实现"""
+    data = b''
+    data += b'\x07' + bytes([srv_num]) + \
+        b'\x28\x00\x0b' + bytes([type_])
+    if first:
+        data += b'\x0f\x27'
+    else:
+        data += account.KEEP_ALIVE_VERSION
+    data += b'\x2f\x12\x00\x00\x00\x00\x00\x00'
+    data += tail
+    data += b'\x00\x00\x00\x00'
+    if type_ == 3:
+        data += b'\x00\x00\x00\x00'
+        data += b''.join([bytes([int(i)])
+                          for i in account.host_ip.split('.')])
+        data += b'\x00\x00\x00\x00\x00\x00\x00\x00'
+    else:
+        data += b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    return data
+
+
+@pytest.mark.parametrize("version", [b"", b"\xdc\x02", b"\xdc\x02\x01"])
+@pytest.mark.parametrize("type_, first", [(1, True), (1, False), (3, False)])
+def test_keepalive_template(version, type_, first):
+    account = makeAccount(version)
+    template = KeepAliveTemplate(account)
+    # 同一个模板修补多次, 之前的 tail 不能残留
+    for srv_num, tail in [(0, b"\x00" * 4), (1, b"\x12\x34\x56\x78"), (255, b"\xff\xee\xdd\xcc")]:
+        packet = bytes(template.render(type_, first, srv_num, tail))
+        assert packet == legacyKeepAlivePacket(account, type_, first, srv_num, tail)
@@ -0,0 +1,164 @@
+"""drcom.toml.fast 与原解码器 decoder.loads 的结果对比"""
+
+import random
+
+import pytest
+
+from drcom.toml import decoder
+from drcom.toml.fast import Unsupported, _Parser, loads
+
+CONFIG = """\
+# drcom.toml
+[application]
+logging = 20          # INFO
+log_path = "/var/log/drcom.db"
+resolve_ttl = 300.0
+
+[drcom]
+server = "10.100.61.3"
+server_port = 61440
+username = "2019123456"
+password = 'p@ss"word'
+mac = 0x0a1b2c3d4e5f
+host_ip = "10.30.1.23"
+host_name = "F**K DRCOM"
+keep_alive_interval = 15
+
+[core]
+CONTROL_CHECK_STATUS = [0x20]
+ADAPTER_NUM = [ 0x05 ]
+AUTH_VERSION = [0x2f, 0x00]
+KEEP_ALIVE_VERSION = [0xdc, 0x02,]
+SALT = []
+ROR_VERSION = false
+
+[[accounts]]
+username = "2019000001"
+password = "password1"
+mac = 0x0a1b2c3d4e01
+
+[[accounts]]
+username = "2019000002"
+password = "password2"
+mac = 0x0a1b2c3d4e02
+"""
+
+# 快速路径能直接处理的写法
+SUPPORTED = [
+    CONFIG,
+    "",
+    "\n\n# only a comment",
+    "a = 1\r\nb = -2\r\n",
+    "a = +3\nb = 1_000\nc = 0\n",
+    "a = 1.5\nb = -0.25\nc = 1e3\nd = 2.5E-2\n",
+    "a = true\nb = false\n",
+    'a = "x\\ty\\n\\u00e9\\U0001F600"\n',
+    "a = 'C:\\path'\n",
+    "a = [1, 2, 3]\nb = [\n  \"x\",  # comment\n  \"y\",\n]\nc = [[1, 2], [3]]\n",
+    "[a.b]\nx = 1\n[a]\ny = 2\n",
+    "[ a . b ]\nx = 1\n",
+    "[[a.b]]\nx = 1\n[[a.b]]\nx = 2\n[a.b.c]\ny = 3\n",
+    "[a]\n[[a.b]]\nx = 1\n",
+    "a = 1 # comment\n# comment\nb = 2",
+]
+
+# 超出子集, 必须交给原解码器的写法
+FALLBACK = [
+    "a = +0x20\n",
+    "a = -0x20\n",
+    "a=0x20\n",
+    "[[a]]\nx = 1\n[a]\ny = 2\n",
+    "[a]\nx = 1\n[[a]]\ny = 2\n",
+    "[a]\nx = 1\n[a]\ny = 2\n",
+    "a = 1\na = 2\n",
+    'a = "\\"quoted"\n',
+    'a = ["a\\\\b"]\n',
+    'a = ["x,y"]\n',
+    'a = """multi\nline"""\n',
+    "a = '''multi\nline'''\n",
+    "a = {x = 1}\n",
+    '"quoted key" = 1\n',
+    "a = 1979-05-27T07:32:00Z\n",
+    "a = [1, 'x']\n",
+    "a = 0e5\n",
+    "a = 01\n",
+    'a = "\\ud800"\n',
+    "a = 1 b = 2\n",
+    "a =\n",
+    "[a\n",
+]
+
+
+def decode(loads, s: str) -> tuple:
+    try:
+        return "ok", loads(s)
+    except Exception as e:
+        return "error", type(e), str(e)
+
+
+@pytest.mark.parametrize("s", SUPPORTED)
+def test_supported(s):
+    # 直接调用 _Parser, 确认没有退回原解码器
+    assert _Parser(s).parse() == decoder.loads(s)
+
+
+@pytest.mark.parametrize("s", FALLBACK)
+def test_fallback(s):
+    with pytest.raises(Unsupported):
+        _Parser(s).parse()
+    assert decode(loads, s) == decode(decoder.loads, s)
+
+
+def randomValue(rng: random.Random) -> str:
+    kind = rng.randrange(8)
+    if kind == 0:
+        return str(rng.randint(-10 ** 6, 10 ** 6))
+    if kind == 1:
+        return " 0x%x" % rng.randrange(1 << 48)
+    if kind == 2:
+        return repr(rng.uniform(-1e3, 1e3))
+    if kind == 3:
+        return rng.choice(["true", "false"])
+    if kind == 4:
+        pieces = ["a", "b", "x y", "_-.:/@", "é", "\\t", "\\n", "\\\\", "\\u00e9"]
+        return '"' + "".join(rng.choice(pieces) for _ in range(rng.randrange(8))) + '"'
+    if kind == 5:
+        return "'" + "".join(rng.choice("abc \\\"#") for _ in range(rng.randrange(8))) + "'"
+    if kind == 6:
+        return str(rng.randrange(256))
+    item = rng.choice([lambda: str(rng.randrange(256)), lambda: '"%s"' % rng.choice("abc")])
+    sep = rng.choice([", ", ",", " ,\n  "])
+    items = [item() for _ in range(rng.randrange(5))]
+    return "[" + sep.join(items) + rng.choice(["", ","]) * bool(items) + "]"
+
+
+def randomDocument(rng: random.Random) -> str:
+    lines = []
+    for _ in range(rng.randrange(1, 20)):
+        kind = rng.randrange(10)
+        if kind == 0:
+            lines.append("[%s]" % ".".join(rng.choice("abc") for _ in range(rng.randrange(1, 3))))
+        elif kind == 1:
+            lines.append("[[%s]]" % rng.choice(["x", "y", "a.x"]))
+        elif kind == 2:
+            lines.append(rng.choice(["", "# comment", "  "]))
+        else:
+            key = rng.choice(["k", "v", "name", "mac", "KEY_2"]) + str(rng.randrange(6))
+            comment = rng.choice(["", " # note", "  "])
+            lines.append(f"{key} = {randomValue(rng)}{comment}")
+    return rng.choice(["\n", "\r\n"]).join(lines) + rng.choice(["", "\n"])
+
+
+def test_random_documents():
+    rng = random.Random(20261018)
+    fast = 0
+    for _ in range(2000):
+        s = randomDocument(rng)
+        assert decode(loads, s) == decode(decoder.loads, s), s
+        try:
+            _Parser(s).parse()
+            fast += 1
+        except Unsupported:
+            pass
+    # 重复的键与表会退回原解码器, 但至少一半的随机文档应当走快速路径
+    assert fast > 1000, fast
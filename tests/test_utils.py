@@ -0,0 +1,43 @@
+"""drcom.utils.checksum 与 v3.1.3 中逐字 hexlify 的实现对比"""
+
+import binascii
+import random
+import struct
+
+import pytest
+
+from drcom.utils import checksum, checksums
+
+
+def legacyChecksum(bytes_: bytes) -> bytes:
+    """v3.1.3 中的实现"""
+    resualt = 1234
+    for i in [x*4 for x in range(0, -(-len(bytes_)//4))]:
+        resualt ^= int(
+            binascii.hexlify(bytes_[i:i+4].ljust(4, b'\x00')[::-1]), 16
+        )
+
+    resualt = (1968 * resualt) & 0xffffffff
+    return struct.pack('<I', resualt)
+
+
+def randomBytes(rng: random.Random, n: int) -> bytes:
+    return bytes(rng.randrange(256) for _ in range(n))
+
+
+@pytest.mark.parametrize("length", [0, 1, 3, 4, 5, 8, 13, 64, 326, 336, 1000])
+def test_checksum(length):
+    rng = random.Random(length)
+    for _ in range(20):
+        data = randomBytes(rng, length)
+        assert checksum(data) == legacyChecksum(data)
+        assert checksum(memoryview(bytearray(data))) == legacyChecksum(data)
+
+
+@pytest.mark.parametrize("count", [0, 1, 31, 32, 100])
+def test_checksums(count):
+    rng = random.Random(count)
+    # 长度不同的包也要各自补 0
+    packets = [randomBytes(rng, rng.randrange(0, 400)) for _ in range(count)]
+    assert checksums(packets) == [legacyChecksum(i) for i in packets]
+    assert checksums(iter(packets)) == [legacyChecksum(i) for i in packets]